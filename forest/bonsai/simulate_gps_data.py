@@ -15,13 +15,14 @@ import numpy as np
 import openrouteservice
 import pandas as pd
 import ratelimit
-import requests
 from timezonefinder import TimezoneFinder
 
-from forest.constants import (ORS_API_BASE_URL, ORS_API_CALLS_PER_MINUTE,
-                              OSM_OVERPASS_URL)
+from forest.constants import ORS_API_BASE_URL, ORS_API_CALLS_PER_MINUTE
 from forest.jasmine.data2mobmat import great_circle_dist
-from forest.poplar.legacy.common_funcs import datetime2stamp, stamp2datetime
+from forest.jasmine.overpass import query_overpass
+from forest.poplar.legacy.common_funcs import (datetime2stamp,
+                                               stamp2datetime,
+                                               stamps2datetimes)
 
 R = 6.371*10**6
 ACTIVE_STATUS_LIST = range(11)
@@ -1165,14 +1166,10 @@ def generate_addresses(country: str, city: str) -> np.ndarray:
     out center 150;
     """
 
-    response = requests.get(OSM_OVERPASS_URL, params={"data": overpy_query},
-                            timeout=60)
-    response.raise_for_status()
-
-    res = response.json()
+    elements = query_overpass(overpy_query)
     try:
         index = np.random.choice(
-            range(len(res["elements"])), 100, replace=False
+            range(len(elements)), 100, replace=False
         )
     except ValueError:
         sys.stderr.write(
@@ -1181,7 +1178,7 @@ def generate_addresses(country: str, city: str) -> np.ndarray:
         )
         raise
 
-    return np.array(res["elements"])[index]
+    return np.array(elements)[index]
 
 
 def generate_nodes(
@@ -1233,11 +1230,7 @@ def generate_nodes(
     out center;
     """
 
-    response = requests.get(OSM_OVERPASS_URL, params={"data": overpy_query2},
-                            timeout=60)
-    response.raise_for_status()
-
-    res = response.json()
+    elements = query_overpass(overpy_query2)
 
     all_nodes: Dict[str, list] = {}
     for place in list(PossibleExits):
@@ -1245,7 +1238,7 @@ def generate_nodes(
     all_nodes["office"] = []
     all_nodes["university"] = []
 
-    for element in res["elements"]:
+    for element in elements:
         if element["type"] == "node":
             lon = element["lon"]
             lat = element["lat"]
@@ -1394,6 +1387,128 @@ def sim_gps_data(
     return gps_data
 
 
+def gen_synthetic_traj(
+    home: Tuple[float, float], no_of_days: int, rng: np.random.Generator,
+    radius: float = 5000,
+) -> np.ndarray:
+    """Generates the complete trajectory of a person without network calls.
+
+    Every day the person leaves home in the morning for a place of work,
+    possibly visits another place in the evening, and returns home,
+    walking or cycling in straight lines at a constant speed.
+
+    Args:
+        home: (tuple) coordinates of the home of the person
+        no_of_days: (int) number of days of the trajectory
+        rng: (numpy.random.Generator) source of randomness
+        radius: (float) maximum distance of the places visited
+            from home, in meters
+    Returns:
+        numpy.ndarray, with one row per second as
+            [time since start in seconds, latitude, longitude]
+    """
+
+    def random_place() -> Tuple[float, float]:
+        distance = rng.uniform(0.2, 1) * radius
+        angle = rng.uniform(0, 2 * np.pi)
+        return (
+            home[0] + np.degrees(distance * np.cos(angle) / R),
+            home[1] + np.degrees(
+                distance * np.sin(angle) / R / np.cos(np.radians(home[0]))
+            ),
+        )
+
+    work = random_place()
+    # knots of the piecewise linear trajectory, as (time, lat, lon)
+    knots: List[Tuple[float, float, float]] = [(0., *home)]
+
+    def go_to(place: Tuple[float, float], time: float) -> None:
+        t_last, lat_last, lon_last = knots[-1]
+        t_leave = max(time, t_last)
+        knots.append((t_leave, lat_last, lon_last))
+        speed = rng.uniform(1.2, 6)
+        distance = great_circle_dist(lat_last, lon_last, *place)
+        knots.append((t_leave + distance / speed, *place))
+
+    for day in range(no_of_days):
+        midnight = 86400. * day
+        go_to(work, midnight + rng.uniform(7, 9.5) * 3600)
+        if rng.uniform() < 0.5:
+            go_to(random_place(), midnight + rng.uniform(17, 18.5) * 3600)
+        go_to(home, midnight + rng.uniform(19, 22) * 3600)
+
+    seconds = np.arange(1, 86400 * no_of_days + 1, dtype=float)
+    knots_array = np.array(knots)
+    traj = np.column_stack((
+        seconds,
+        np.interp(seconds, knots_array[:, 0], knots_array[:, 1]),
+        np.interp(seconds, knots_array[:, 0], knots_array[:, 2]),
+    ))
+    traj[:, 1:] += rng.normal(0, 1e-5, size=(len(seconds), 2))
+    return traj
+
+
+def sim_synthetic_gps_data(
+    n_persons: int,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    cycle: int,
+    percentage: float,
+    center: Tuple[float, float] = (51.4545, -2.5879),
+    tz_str: str = "Europe/London",
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Generates gps trajectories deterministically and offline.
+
+    Unlike sim_gps_data(), no OpenRouteService or Overpass queries are
+    made, so that the data can be used in benchmarks and tests.
+
+    Args:
+        n_persons: (int) number of people to simulate
+        start_date: (datetime.date) start date of trajectories
+        end_date: (datetime.date) end date of trajectories,
+            end date is not included in the trajectories
+        cycle: (int) the sum of on-cycle and off_cycle,
+            unit is minute
+        percentage: (float) the missing rate, in other words,
+            the proportion of off_cycle, should be within [0,1]
+        center: (tuple) coordinates around which the people live
+        tz_str: (str) timezone
+        seed: (int) seed of the random generator, the same seed
+            gives the same data
+    Returns:
+        gps_data: (pandas.DataFrame) contains gps trajectories
+            for each person, in the format of sim_gps_data()
+    """
+    rng = np.random.default_rng(seed)
+    no_of_days = (end_date - start_date).days
+    timestamp_s = datetime2stamp(
+        [start_date.year, start_date.month, start_date.day, 0, 0, 0],
+        tz_str
+    )
+    sample_dur = int(np.around(60 * cycle * (1 - percentage), 0))
+
+    frames = []
+    for user in range(1, n_persons + 1):
+        home = (
+            center[0] + rng.uniform(-0.05, 0.05),
+            center[1] + rng.uniform(-0.05, 0.05),
+        )
+        traj = gen_synthetic_traj(home, no_of_days, rng)
+        # the on periods restart at a random offset every day
+        offsets = rng.uniform(0, 60 * cycle, no_of_days)
+        elapsed = traj[:, 0] - 1 - offsets[
+            (traj[:, 0] - 1).astype(int) // 86400
+        ]
+        observed = (elapsed >= 0) & (elapsed % (60 * cycle) < sample_dur)
+        observed[:600] = True
+        observed[-600:] = True
+        obs_pd = prepare_data(traj[observed], timestamp_s, tz_str)
+        obs_pd.insert(0, "user", user)
+        frames.append(obs_pd)
+    return pd.concat(frames, ignore_index=True)
+
+
 def gps_to_csv(data: pd.DataFrame, path: str, start_date: datetime.date,
                end_date: datetime.date) -> None:
     """Writes gps trajectories to csv files.
@@ -1415,17 +1530,20 @@ def gps_to_csv(data: pd.DataFrame, path: str, start_date: datetime.date,
         [start_date.year, start_date.month, start_date.day, 0, 0, 0],
         tz_str
     ) * 1000
+    # lower bounds of the hours and their filenames, converted at once
+    n_hours = (end_date - start_date).days * 24
+    s_lowers = s + np.arange(n_hours) * 60 * 60 * 1000
+    filenames = [
+        f"{y}-{m:0>2}-{d:0>2} {h:0>2}_00_00.csv"
+        for y, m, d, h, _, _ in stamps2datetimes(s_lowers / 1000, tz_str)
+    ]
     for user in np.unique(data["user"]):
         user_traj = data[data["user"] == user].iloc[:, 1:]
-        for i in range((end_date - start_date).days):
-            for j in range(24):
-                s_lower = s + i * 24 * 60 * 60 * 1000 + j * 60 * 60 * 1000
-                s_upper = s + i * 24 * 60 * 60 * 1000 + (j+1) * 60 * 60 * 1000
-                temp = user_traj[
-                    (user_traj["timestamp"] >= s_lower)
-                    & (user_traj["timestamp"] < s_upper)
-                ]
-                [y, m, d, h, _, _] = stamp2datetime(s_lower/1000, tz_str)
-                filename = f"{y}-{m:0>2}-{d:0>2} {h:0>2}_00_00.csv"
-                os.makedirs(f"{path}/user_{user}/gps/", exist_ok=True)
-                temp.to_csv(f"{path}/user_{user}/gps/{filename}", index=False)
+        os.makedirs(f"{path}/user_{user}/gps/", exist_ok=True)
+        for s_lower, filename in zip(s_lowers, filenames):
+            s_upper = s_lower + 60 * 60 * 1000
+            temp = user_traj[
+                (user_traj["timestamp"] >= s_lower)
+                & (user_traj["timestamp"] < s_upper)
+            ]
+            temp.to_csv(f"{path}/user_{user}/gps/{filename}", index=False)
@@ -9,7 +9,7 @@ from forest.bonsai.simulate_gps_data import (
     bounding_box, get_basic_path, get_path, PossibleExits, Vehicle, Occupation,
     ActionType, Attributes, Person, gen_basic_traj, gen_basic_pause,
     gen_route_traj, gen_all_traj, remove_data, prepare_data,
-    process_switches, load_attributes, sim_gps_data
+    process_switches, load_attributes, sim_gps_data, sim_synthetic_gps_data
     )
 from forest.jasmine.data2mobmat import great_circle_dist
 
@@ -967,3 +967,22 @@ def test_sim_gps_data_multiple_people(
         attributes_dict=sample_attributes,
         )
     assert len(np.unique(data.user)) == 3
+
+
+def test_sim_synthetic_gps_data_deterministic():
+    """Test synthetic data are the same for the same seed"""
+    args = (2, datetime.date(2021, 3, 1), datetime.date(2021, 3, 3), 10, .5)
+    data = sim_synthetic_gps_data(*args, seed=1)
+    assert data.equals(sim_synthetic_gps_data(*args, seed=1))
+    assert not data.equals(sim_synthetic_gps_data(*args, seed=2))
+    assert list(data.columns) == ["user", "timestamp", "UTC time", "latitude",
+                                  "longitude", "altitude", "accuracy"]
+
+
+def test_sim_synthetic_gps_data_missing_rate():
+    """Test synthetic data are observed according to the cycle"""
+    data = sim_synthetic_gps_data(
+        1, datetime.date(2021, 3, 1), datetime.date(2021, 3, 8), 15, .8
+    )
+    assert abs(len(data) / (7 * 86400) - .2) < .01
+    assert data["timestamp"].is_monotonic_increasing
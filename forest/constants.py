@@ -12,3 +12,33 @@ ORS_API_BASE_URL = os.getenv("FOREST_ORS_API_BASE_URL",
 # URL of OpenStreetMap instance
 OSM_OVERPASS_URL = os.getenv("FOREST_OSM_OVERPASS_URL",
                              default="https://overpass-api.de/api/interpreter")
+# Directory of the local cache of Overpass results, disabled if empty
+OSM_CACHE_DIR = os.getenv(
+    "FOREST_OSM_CACHE_DIR",
+    default=os.path.join(
+        os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "forest", "overpass",
+    ),
+)
+# Time after which cached Overpass results are fetched again, in seconds
+OSM_CACHE_TTL = float(os.getenv("FOREST_OSM_CACHE_TTL",
+                                default=str(30 * 24 * 3600)))
+# Maximum size of the Overpass cache, oldest entries are removed first
+OSM_CACHE_MAX_SIZE = int(os.getenv("FOREST_OSM_CACHE_MAX_SIZE",
+                                   default=str(512 * 1024 ** 2)))
+# Size of the tiles in which nearby places are fetched and cached, in degrees
+OSM_TILE_SIZE = float(os.getenv("FOREST_OSM_TILE_SIZE", default="0.01"))
+# Only read Overpass results from the cache or the local extract
+OSM_OFFLINE = os.getenv("FOREST_OSM_OFFLINE",
+                        default="false").lower() in ("1", "true", "yes")
+# Local extract in Overpass JSON format, used for tiles missing offline
+OSM_EXTRACT_PATH = os.getenv("FOREST_OSM_EXTRACT_PATH", default="")
+# Number of tiles fetched in a single Overpass query
+OSM_TILES_PER_QUERY = int(os.getenv("FOREST_OSM_TILES_PER_QUERY",
+                                    default="25"))
+# Number of concurrent Overpass queries, public instances allow few slots
+OSM_MAX_CONCURRENT_QUERIES = int(os.getenv(
+    "FOREST_OSM_MAX_CONCURRENT_QUERIES", default="2"
+))
+# Directory of the binary cache of parsed raw csv files, disabled if empty
+RAW_CACHE_DIR = os.getenv("FOREST_RAW_CACHE_DIR", default="")
@@ -2,6 +2,7 @@ import sys
 import math
 import numpy as np
 from itertools import groupby
+from forest.jasmine.instrument import null_stage
 
 ## the radius of the earth
 R = 6.371*10**6
@@ -123,18 +124,22 @@ def collapse_data(data, itrvl, accuracylim):
                  fourth is none
     """
     data = data[data.accuracy<accuracylim]
-    t_start = sorted(np.array(data.timestamp))[0]/1000
-    t_end = sorted(np.array(data.timestamp))[-1]/1000
+    ## columns by name, so that data may have only the columns used here
+    timestamp = np.array(data.timestamp)
+    latitude = np.array(data.latitude)
+    longitude = np.array(data.longitude)
+    t_start = sorted(timestamp)[0]/1000
+    t_end = sorted(timestamp)[-1]/1000
     avgmat = np.empty([int(np.ceil((t_end-t_start)/itrvl))+2,4])
     sys.stdout.write("Collapse data within " + str(itrvl)+" second intervals ..."+'\n')
     IDam = 0
     count = 0
-    nextline=[1,t_start+itrvl/2,data.iloc[0,2],data.iloc[0,3]]
+    nextline=[1,t_start+itrvl/2,latitude[0],longitude[0]]
     numitrvl=1
     for i in np.arange(1,data.shape[0]):
-        if data.iloc[i,0]/1000 < t_start+itrvl:
-            nextline[2]=nextline[2]+data.iloc[i,2]
-            nextline[3]=nextline[3]+data.iloc[i,3]
+        if timestamp[i]/1000 < t_start+itrvl:
+            nextline[2]=nextline[2]+latitude[i]
+            nextline[3]=nextline[3]+longitude[i]
             numitrvl=numitrvl+1
         else:
             nextline[2]=nextline[2]/numitrvl
@@ -142,16 +147,16 @@ def collapse_data(data, itrvl, accuracylim):
             avgmat[IDam,:]=nextline
             count=count+1
             IDam=IDam+1
-            nummiss=int(np.floor((data.iloc[i,0]/1000-(t_start+itrvl))/itrvl))
+            nummiss=int(np.floor((timestamp[i]/1000-(t_start+itrvl))/itrvl))
             if nummiss>0:
-                avgmat[IDam,:] = [4,t_start+itrvl,t_start+itrvl*(nummiss+1),None]
+                avgmat[IDam,:] = [4,t_start+itrvl,t_start+itrvl*(nummiss+1),np.nan]
                 count=count+1
                 IDam=IDam+1
             t_start=t_start+itrvl*(nummiss+1)
             nextline[0]=1
             nextline[1]=t_start+itrvl/2
-            nextline[2]=data.iloc[i,2]
-            nextline[3]=data.iloc[i,3]
+            nextline[2]=latitude[i]
+            nextline[3]=longitude[i]
             numitrvl=1
     avgmat = avgmat[0:count,:]
     return avgmat
@@ -192,14 +197,15 @@ def ExtractFlights(mat,itrvl,r,w,h):
     Return: a 2d numpy array of trajectories, with headers as
             [status, lat_start, lon_start, stamp_start, lat_end, lon_end, stamp_end]
             status: if there is only one measure in this chunk, mark it as status "3" (unknown)
+                    and its end coordinates as nan,
                     flight status is '1' and pause status is '2'
     """
     ## sometimes mat is a 1d array and sometimes it's 2d array
     ## which correspond to if and elif below
     if len(mat.shape)==1:
-        out = np.array([3,mat[2],mat[3],mat[1]-itrvl/2,None,None,mat[1]+itrvl/2])
+        out = np.array([3,mat[2],mat[3],mat[1]-itrvl/2,np.nan,np.nan,mat[1]+itrvl/2])
     elif len(mat.shape)==2 and mat.shape[0]==1:
-        out = np.array([3,mat[0,2],mat[0,3],mat[0,1]-itrvl/2,None,None,mat[0,1]+itrvl/2])
+        out = np.array([3,mat[0,2],mat[0,3],mat[0,1]-itrvl/2,np.nan,np.nan,mat[0,1]+itrvl/2])
     else:
         n = mat.shape[0]
         mat = np.hstack((mat,np.arange(n).reshape((n,1))))
@@ -258,7 +264,7 @@ def ExtractFlights(mat,itrvl,r,w,h):
             out = np.array(out)
     return out
 
-def GPS2MobMat(data, itrvl, accuracylim, r, w, h):
+def GPS2MobMat(data, itrvl, accuracylim, r, w, h, stage=null_stage):
     """
     This function takes raw input (GPS) as input and return the first-step trajectory mat as output
     It calls collapse_data() and ExtractFlights(). Additionally, it divides the trajectory mat
@@ -270,25 +276,32 @@ def GPS2MobMat(data, itrvl, accuracylim, r, w, h):
                 this threshold, we consider there is a knot
              h: a threshold of distance, if the movemoent between two timestamps is less than h,
                 consider it as a pause and a knot
+         stage: a function called as stage(name, rows_in) returning a context manager
+                which records collapse_data() and ExtractFlights(), see instrument.py
     Return: a 2d numpy array of all observed trajectories(first-step), with headers as
             [status, lat_start, lon_start, stamp_start, lat_end, lon_end, stamp_end]
     """
-    avgmat = collapse_data(data, itrvl, accuracylim)
-    outmat = np.zeros(7)
-    curind = 0
-    sys.stdout.write("Extract flights and pauses ..."+'\n')
-    for i in range(avgmat.shape[0]):
-        if avgmat[i,0]==4:
-            ## divide the intermitted observeds chunk by the missing intervals (status=4)
-            ## extract the flights and pauses from each observed chunk
-            temp = ExtractFlights(avgmat[np.arange(curind,i),:],itrvl,r,w,h)
-            outmat = np.vstack((outmat,temp))
-            curind=i+1
-    if curind<avgmat.shape[0]:
-        #print(np.arange(curind,avgmat.shape[0]))
-        temp = ExtractFlights(avgmat[np.arange(curind,avgmat.shape[0]),:],itrvl,r,w,h)
-        outmat = np.vstack((outmat,temp))
-    mobmat = np.delete(outmat,0,0)
+    with stage("collapse_data", data.shape[0]) as record:
+        avgmat = collapse_data(data, itrvl, accuracylim)
+        record.rows_out = avgmat.shape[0]
+    with stage("ExtractFlights", avgmat.shape[0]) as record:
+        ## flights and pauses of each chunk, stacked once at the end
+        outmat = [np.zeros((0,7))]
+        curind = 0
+        sys.stdout.write("Extract flights and pauses ..."+'\n')
+        for i in range(avgmat.shape[0]):
+            if avgmat[i,0]==4:
+                ## divide the intermitted observeds chunk by the missing intervals (status=4)
+                ## extract the flights and pauses from each observed chunk
+                temp = ExtractFlights(avgmat[np.arange(curind,i),:],itrvl,r,w,h)
+                outmat.append(np.atleast_2d(temp))
+                curind=i+1
+        if curind<avgmat.shape[0]:
+            #print(np.arange(curind,avgmat.shape[0]))
+            temp = ExtractFlights(avgmat[np.arange(curind,avgmat.shape[0]),:],itrvl,r,w,h)
+            outmat.append(np.atleast_2d(temp))
+        mobmat = np.vstack(outmat)
+        record.rows_out = mobmat.shape[0]
     return mobmat
 
 def InferMobMat(mobmat,itrvl,r):
@@ -0,0 +1,275 @@
+"""Module used to record the time and memory used by each stage of the
+processing of each participant, as a machine-readable run report.
+"""
+
+import cProfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import json
+import os
+import time
+import tracemalloc
+from typing import (Callable, ContextManager, Iterator, List, Optional,
+                    Tuple)
+
+import pandas as pd
+
+
+@dataclass
+class StageRecord:
+    """Class containing the measurements of a stage for a participant.
+
+    Args:
+        participant_id: str, beiwe ID
+        stage: str, name of the stage, e.g. "read_data"
+        start: float, UNIX time when the stage started
+        wall_time: float, elapsed time in seconds
+        cpu_time: float, CPU time of this process in seconds
+        memory_mb: float, change of the memory of this process during
+            the stage in MB, see Instrumentation, None if not measured
+        peak_memory_mb: float, peak of the memory of this process during
+            the stage in MB, above the memory at its start, None if not
+            measured
+        rows_in: int, number of rows of the input, None if unknown
+        rows_out: int, number of rows of the output, None if unknown,
+            set by the caller within the stage
+        error: str, the error raised by the stage, empty if none
+    """
+    participant_id: str
+    stage: str
+    start: float = 0
+    wall_time: float = 0
+    cpu_time: float = 0
+    memory_mb: Optional[float] = None
+    peak_memory_mb: Optional[float] = None
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    error: str = ""
+
+
+def proc_memory() -> Optional[Tuple[int, int]]:
+    """Returns the current and peak resident memory of this process
+    in bytes, read from /proc on Linux, or None if it is not available.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as status:
+            values = {
+                line.split(":")[0]: int(line.split()[1]) * 1024
+                for line in status if line.startswith(("VmRSS:", "VmHWM:"))
+            }
+        return values["VmRSS"], values["VmHWM"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_proc_peak() -> bool:
+    """Resets the peak resident memory of this process to the current
+    memory, on Linux 4.0 or later.
+
+    Returns:
+        True if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as refs:
+            refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def reset_traced_peak() -> int:
+    """Resets the peak of the memory traced by tracemalloc to the current
+    memory.
+
+    Python 3.8 has no tracemalloc.reset_peak(), so tracing is restarted
+    instead, and the memory allocated before is no longer traced.
+
+    Returns:
+        the memory traced before which is no longer counted, in bytes
+    """
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+        return 0
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracemalloc.start()
+    return current
+
+
+class Instrumentation:
+    """Class recording the stages of the processing of participants.
+
+    Records are appended to a JSON lines file as soon as a stage ends,
+    so that worker processes can share the same report.
+
+    The memory of a stage is the resident memory of the process on Linux,
+    whose peak is reset at the start of each stage. Elsewhere, it is the
+    memory allocated by Python and numpy, traced by tracemalloc while
+    stages run, which slows down code allocating many small objects.
+
+    Args:
+        report_path: str, path of the JSON lines report,
+            nothing is recorded if None
+        profile_folder: str, folder where a cProfile dump is written
+            for each participant and stage, no profiling if None
+    """
+
+    def __init__(
+        self,
+        report_path: Optional[str] = None,
+        profile_folder: Optional[str] = None,
+    ):
+        self.report_path = report_path
+        self.profile_folder = profile_folder
+        if profile_folder is not None:
+            os.makedirs(profile_folder, exist_ok=True)
+        # True to measure the resident memory, False to trace the memory,
+        # chosen at the first stage in the process running it
+        self.use_proc: Optional[bool] = None
+        # [memory at the start, peak above it] of the running stages,
+        # outer stages first
+        self.memory: List[List[int]] = []
+        self.started_tracing = False
+
+    def get_memory(self) -> Tuple[int, int]:
+        """Returns the current memory and its peak since the last reset
+        in bytes.
+        """
+        if self.use_proc:
+            memory = proc_memory()
+            if memory is not None:
+                return memory
+        return tracemalloc.get_traced_memory()
+
+    def start_memory(self) -> List[int]:
+        """Starts measuring the memory of a stage, keeping the peaks of the
+        stages it is nested in.
+        """
+        if self.use_proc is None:
+            self.use_proc = proc_memory() is not None and reset_proc_peak()
+        if not self.use_proc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        _, peak = self.get_memory()
+        for usage in self.memory:
+            usage[1] = max(usage[1], peak - usage[0])
+        shift = 0
+        if self.use_proc:
+            reset_proc_peak()
+        else:
+            shift = reset_traced_peak()
+        for usage in self.memory:
+            usage[0] -= shift
+        current, _ = self.get_memory()
+        self.memory.append([current, 0])
+        return self.memory[-1]
+
+    def stop_memory(self, usage: List[int]) -> Tuple[float, float]:
+        """Stops measuring the memory of a stage.
+
+        Returns:
+            the change and the peak of the memory of the stage in MB
+        """
+        current, peak = self.get_memory()
+        for outer in self.memory:
+            outer[1] = max(outer[1], peak - outer[0])
+        self.memory = [outer for outer in self.memory if outer is not usage]
+        if not self.memory and self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return (current - usage[0]) / 1024 ** 2, usage[1] / 1024 ** 2
+
+    @contextmanager
+    def stage(
+        self,
+        participant_id: str,
+        stage: str,
+        rows_in: Optional[int] = None,
+    ) -> Iterator[StageRecord]:
+        """Measures a stage of the processing of a participant.
+
+        Args:
+            participant_id: str, beiwe ID
+            stage: str, name of the stage
+            rows_in: int, number of rows of the input
+        Returns:
+            a context manager yielding the StageRecord, whose rows_out
+            can be set within the stage
+        """
+        record = StageRecord(str(participant_id), stage, rows_in=rows_in)
+        if self.report_path is None:
+            yield record
+            return
+
+        profile = None
+        if self.profile_folder is not None:
+            profile = cProfile.Profile()
+        usage = self.start_memory()
+        record.start = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        except BaseException as error:
+            record.error = repr(error)
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(
+                    f"{self.profile_folder}/{participant_id}_{stage}.prof"
+                )
+            record.wall_time = time.perf_counter() - wall_start
+            record.cpu_time = time.process_time() - cpu_start
+            record.memory_mb, record.peak_memory_mb = self.stop_memory(
+                usage
+            )
+            self.write(record)
+
+    def write(self, record: StageRecord) -> None:
+        """Appends a record to the report with a single write."""
+        if self.report_path is None:
+            return
+        line = (json.dumps(asdict(record)) + "\n").encode("utf-8")
+        descriptor = os.open(
+            self.report_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        try:
+            os.write(descriptor, line)
+        finally:
+            os.close(descriptor)
+
+    def bind(
+        self, participant_id: str
+    ) -> Callable[..., ContextManager[StageRecord]]:
+        """Returns a function measuring the stages of a participant,
+        called as stage(name, rows_in).
+        """
+        def stage(
+            name: str, rows_in: Optional[int] = None
+        ) -> ContextManager[StageRecord]:
+            return self.stage(participant_id, name, rows_in)
+        return stage
+
+    def to_csv(self, csv_path: str) -> None:
+        """Writes the report as a csv file, one row per stage."""
+        columns = list(StageRecord.__dataclass_fields__)
+        records = []
+        if self.report_path is not None and os.path.exists(self.report_path):
+            with open(self.report_path, "r", encoding="utf-8") as report:
+                records = [json.loads(line) for line in report if line.strip()]
+        report = pd.DataFrame(records, columns=columns).astype(
+            {"rows_in": "Int64", "rows_out": "Int64"}
+        )
+        report.to_csv(csv_path, index=False)
+
+
+def null_stage(
+    name: str, rows_in: Optional[int] = None
+) -> ContextManager[StageRecord]:
+    """Stage function recording nothing, used when no instrumentation
+    is given.
+    """
+    return Instrumentation().stage("", name, rows_in)
@@ -0,0 +1,420 @@
+"""Functions to query the Overpass API of OpenStreetMap through a local
+cache, so that repeated runs and nearby participants reuse fetched places.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from forest.constants import (OSM_CACHE_DIR, OSM_CACHE_MAX_SIZE,
+                              OSM_CACHE_TTL, OSM_EXTRACT_PATH,
+                              OSM_MAX_CONCURRENT_QUERIES, OSM_OFFLINE,
+                              OSM_OVERPASS_URL, OSM_TILE_SIZE,
+                              OSM_TILES_PER_QUERY)
+
+# HTTP status codes of an overloaded Overpass instance, worth retrying
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+# tag filter of an Overpass statement, e.g. ['amenity'] or ["amenity"="bar"]
+TAG_FILTER = re.compile(
+    r"""\[\s*['"]([^'"]+)['"]\s*(?:=\s*['"]([^'"]*)['"]\s*)?\]"""
+)
+
+
+@dataclass
+class OverpassCache:
+    """Class containing the settings of the local cache of Overpass results.
+
+    Entries are JSON files named after the hash of their content key,
+    and are also kept in memory so that the results prefetched for a
+    study are served even if caching on disk is disabled.
+
+    Args:
+        directory: str, folder of the cache, caching is disabled if empty
+        ttl: float, time after which entries are fetched again, in seconds
+        max_size: int, maximum size of the cache in bytes,
+            the oldest entries are removed first
+        tile_size: float, size of the tiles of nearby places, in degrees
+        offline: bool, True to never query the Overpass API
+        extract_path: str, path of a local extract in Overpass JSON format,
+            used for tiles missing from the cache when offline
+        entries: dict, entries read or written during this run
+    """
+    directory: str = OSM_CACHE_DIR
+    ttl: float = OSM_CACHE_TTL
+    max_size: int = OSM_CACHE_MAX_SIZE
+    tile_size: float = OSM_TILE_SIZE
+    offline: bool = OSM_OFFLINE
+    extract_path: str = OSM_EXTRACT_PATH
+    entries: Dict[str, list] = field(default_factory=dict, repr=False)
+
+    def path(self, key: str) -> str:
+        """Returns the path of the file of a cache entry."""
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key: str) -> Optional[list]:
+        """Returns the elements of a cache entry,
+        or None if it is missing or expired while online.
+        """
+        if key in self.entries:
+            return self.entries[key]
+        if not self.directory:
+            return None
+        path = self.path(key)
+        try:
+            if (
+                not self.offline
+                and time.time() - os.path.getmtime(path) > self.ttl
+            ):
+                return None
+            with open(path, "r", encoding="utf-8") as cached:
+                self.entries[key] = json.load(cached)["elements"]
+        except (OSError, ValueError, KeyError):
+            return None
+        return self.entries[key]
+
+    def put(self, key: str, elements: list) -> None:
+        """Writes a cache entry, call evict() once done writing."""
+        self.entries[key] = elements
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as cached:
+            json.dump({"key": key, "elements": elements}, cached)
+        # replace atomically, other processes may read the same entry
+        os.replace(temp_path, path)
+
+    def evict(self) -> None:
+        """Removes the oldest entries until the cache fits in max_size."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+
+def post_query(
+    query: str, timeout: float = 60, retries: int = 3, backoff: float = 5
+) -> list:
+    """Sends a query to the Overpass API, retrying with an exponential
+    backoff if the connection fails or the instance is overloaded.
+
+    Args:
+        query: str, query in Overpass QL with JSON output
+        timeout: float, timeout of the request in seconds
+        retries: int, number of retries before giving up
+        backoff: float, waiting time before the first retry in seconds,
+            doubled at every retry
+    Returns:
+        list of the elements of the response
+    Raises:
+        requests.RequestException: if the query to Overpass API fails
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = requests.post(OSM_OVERPASS_URL,
+                                     data={"data": query}, timeout=timeout)
+            response.raise_for_status()
+            return response.json()["elements"]
+        except (requests.ConnectionError, requests.Timeout,
+                requests.HTTPError) as error:
+            retry = (
+                not isinstance(error, requests.HTTPError)
+                or error.response is None
+                or error.response.status_code in RETRY_STATUS_CODES
+            )
+            if not retry or attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+    return []
+
+
+def query_overpass(
+    query: str, cache: Optional[OverpassCache] = None
+) -> List[dict]:
+    """Returns the elements of an Overpass query, from the cache if the
+    same query was sent before.
+
+    Args:
+        query: str, query in Overpass QL with JSON output
+        cache: OverpassCache, settings of the cache, defaults from
+            forest.constants if None
+    Returns:
+        list of the elements of the response
+    Raises:
+        RuntimeError: if offline and the query is not in the cache
+    """
+    if cache is None:
+        cache = OverpassCache()
+    elements = cache.get(query)
+    if elements is None:
+        if cache.offline:
+            raise RuntimeError(
+                "Overpass query not found in the cache in offline mode"
+            )
+        elements = post_query(query)
+        cache.put(query, elements)
+        cache.evict()
+    return elements
+
+
+def bbox_tiles(
+    bbox: Tuple[float, float, float, float], tile_size: float
+) -> List[Tuple[int, int]]:
+    """Returns the tiles covering a bounding box.
+
+    Args:
+        bbox: tuple, (south, west, north, east) in degrees
+        tile_size: float, size of the tiles in degrees
+    Returns:
+        list of the (row, col) indices of the tiles
+    """
+    south, west, north, east = bbox
+    return [
+        (i, j)
+        for i in range(math.floor(south / tile_size),
+                       math.floor(north / tile_size) + 1)
+        for j in range(math.floor(west / tile_size),
+                       math.floor(east / tile_size) + 1)
+    ]
+
+
+def tile_bbox(
+    tile: Tuple[int, int], tile_size: float
+) -> Tuple[float, float, float, float]:
+    """Returns the bounding box (south, west, north, east) of a tile."""
+    i, j = tile
+    return (
+        round(i * tile_size, 7), round(j * tile_size, 7),
+        round((i + 1) * tile_size, 7), round((j + 1) * tile_size, 7),
+    )
+
+
+def in_bbox(
+    element: dict, bbox: Tuple[float, float, float, float]
+) -> bool:
+    """Checks if a node, or any point of a way, is in a bounding box."""
+    south, west, north, east = bbox
+    if element["type"] == "node":
+        points = [element]
+    else:
+        points = element.get("geometry", [])
+        if "center" in element:
+            points = points + [element["center"]]
+    return any(
+        south <= point["lat"] <= north and west <= point["lon"] <= east
+        for point in points
+    )
+
+
+def match_selector(element: dict, selector: Tuple[str, str]) -> bool:
+    """Checks if an element matches the type and tag filters
+    of an Overpass statement.
+    """
+    element_type, tag_filters = selector
+    if element["type"] != element_type:
+        return False
+    element_tags = element.get("tags", {})
+    for key, value in TAG_FILTER.findall(tag_filters):
+        if key not in element_tags:
+            return False
+        if value and element_tags[key] != value:
+            return False
+    return True
+
+
+def read_extract(path: str) -> List[dict]:
+    """Reads the elements of a local extract in Overpass JSON format."""
+    with open(path, "r", encoding="utf-8") as extract:
+        return json.load(extract)["elements"]
+
+
+def tile_key(
+    tile: Tuple[int, int], selectors: Sequence[Tuple[str, str]], out: str,
+    tile_size: float,
+) -> str:
+    """Returns the cache key of the elements of a tile."""
+    selector_key = ";".join(f"{kind}{tags}" for kind, tags in selectors)
+    return f"{selector_key} out {out} tile {tile_size} {tile}"
+
+
+def fetch_tiles(
+    tiles: Sequence[Tuple[int, int]],
+    selectors: Sequence[Tuple[str, str]],
+    out: str,
+    tile_size: float,
+) -> List[List[dict]]:
+    """Fetches the elements of some tiles with a single query,
+    each tile preceded by an "out count" statement to split the response
+    between the tiles.
+
+    Args:
+        tiles: list of (row, col) indices of the tiles
+        selectors: list of (element type, tag filters) statements
+        out: str, output mode of the query
+        tile_size: float, size of the tiles in degrees
+    Returns:
+        list of the elements of each tile
+    Raises:
+        RuntimeError: if the response cannot be split between the tiles
+    """
+    query = "[out:json];"
+    for tile in tiles:
+        bbox = tile_bbox(tile, tile_size)
+        query += "\n(" + "".join(
+            f"\n\t{kind}{bbox}{tags};" for kind, tags in selectors
+        ) + f"\n);\nout count;\nout {out};"
+    response = post_query(query)
+    counts = [
+        i for i, element in enumerate(response) if element["type"] == "count"
+    ]
+    if len(counts) != len(tiles):
+        raise RuntimeError("Unexpected response from Overpass API")
+    return [
+        response[start + 1:end]
+        for start, end in zip(counts, counts[1:] + [len(response)])
+    ]
+
+
+def cover_tiles(
+    bboxes: Sequence[Tuple[float, float, float, float]], tile_size: float
+) -> List[Tuple[int, int]]:
+    """Returns the tiles covering some bounding boxes, without duplicates."""
+    tiles: Dict[Tuple[int, int], None] = {}
+    for bbox in bboxes:
+        for tile in bbox_tiles(bbox, tile_size):
+            tiles[tile] = None
+    return list(tiles)
+
+
+def prefetch_tiles(
+    bboxes: Sequence[Tuple[float, float, float, float]],
+    selectors: Sequence[Tuple[str, str]],
+    out: str = "geom qt",
+    cache: Optional[OverpassCache] = None,
+    max_workers: int = OSM_MAX_CONCURRENT_QUERIES,
+    tiles_per_query: int = OSM_TILES_PER_QUERY,
+) -> int:
+    """Fetches the tiles covering some bounding boxes which are missing
+    from the cache, in concurrent queries of a few tiles each.
+
+    Nothing is fetched in offline mode.
+
+    Args:
+        bboxes: list of (south, west, north, east) bounding boxes
+        selectors: list of (element type, tag filters) statements,
+            e.g. ("node", "['amenity']")
+        out: str, output mode of the query, e.g. "geom qt" or "center"
+        cache: OverpassCache, settings of the cache, defaults from
+            forest.constants if None
+        max_workers: int, maximum number of concurrent queries
+        tiles_per_query: int, maximum number of tiles in a query
+    Returns:
+        the number of tiles fetched
+    Raises:
+        RuntimeError: if the query to Overpass API fails
+    """
+    if cache is None:
+        cache = OverpassCache()
+    if cache.offline:
+        return 0
+
+    missing = [
+        tile for tile in cover_tiles(bboxes, cache.tile_size)
+        if cache.get(tile_key(tile, selectors, out, cache.tile_size)) is None
+    ]
+    batches = [
+        missing[i:i + tiles_per_query]
+        for i in range(0, len(missing), tiles_per_query)
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = executor.map(
+            lambda batch: fetch_tiles(batch, selectors, out,
+                                      cache.tile_size),  # type: ignore
+            batches,
+        )
+        for batch, batch_elements in zip(batches, results):
+            for tile, elements in zip(batch, batch_elements):
+                cache.put(
+                    tile_key(tile, selectors, out, cache.tile_size), elements
+                )
+    if missing:
+        cache.evict()
+    return len(missing)
+
+
+def query_overpass_tiles(
+    bboxes: Sequence[Tuple[float, float, float, float]],
+    selectors: Sequence[Tuple[str, str]],
+    out: str = "geom qt",
+    cache: Optional[OverpassCache] = None,
+) -> List[dict]:
+    """Returns the elements matching the selectors in the tiles covering
+    some bounding boxes, fetching only the tiles missing from the cache.
+
+    Args:
+        bboxes: list of (south, west, north, east) bounding boxes
+        selectors: list of (element type, tag filters) statements,
+            e.g. ("node", "['amenity']")
+        out: str, output mode of the query, e.g. "geom qt" or "center"
+        cache: OverpassCache, settings of the cache, defaults from
+            forest.constants if None
+    Returns:
+        list of the elements without duplicates, in the order of the tiles
+    Raises:
+        RuntimeError: if offline and a tile is neither in the cache
+            nor in a local extract
+    """
+    if cache is None:
+        cache = OverpassCache()
+    prefetch_tiles(bboxes, selectors, out, cache, max_workers=1)
+
+    extract: Optional[List[dict]] = None
+    seen = set()
+    all_elements = []
+    for tile in cover_tiles(bboxes, cache.tile_size):
+        elements = cache.get(tile_key(tile, selectors, out, cache.tile_size))
+        if elements is None:
+            if not cache.extract_path:
+                raise RuntimeError(
+                    f"Overpass tile {tile} not found in the cache "
+                    "in offline mode"
+                )
+            if extract is None:
+                extract = read_extract(cache.extract_path)
+            bbox = tile_bbox(tile, cache.tile_size)
+            elements = [
+                element for element in extract
+                if any(match_selector(element, s) for s in selectors)
+                and in_bbox(element, bbox)
+            ]
+        for element in elements:
+            element_key = (element["type"], element["id"])
+            if element_key not in seen:
+                seen.add(element_key)
+                all_elements.append(element)
+    return all_elements
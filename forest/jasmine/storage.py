@@ -0,0 +1,265 @@
+"""Module used to write and read trajectories, mobility matrices and
+summary statistics, as csv files or as typed Parquet files.
+"""
+
+from enum import Enum
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from forest.poplar.legacy.common_funcs import write_all_summaries
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, pip install forest[parquet]
+    pa = None
+    pq = None
+
+TRAJ_COLUMNS = ["status", "x0", "y0", "t0", "x1", "y1", "t1", "obs"]
+MOBMAT_COLUMNS = TRAJ_COLUMNS[:7]
+# columns stored as int8, all others are float64
+INT8_COLUMNS = ["status", "obs"]
+# Record representations of trajectories and mobility matrices, 50 and 49
+# bytes a row instead of 64 and 56 for the float64 arrays used by the
+# imputation: status is 1 for flights and 2 for pauses, x is the latitude,
+# y the longitude and t the timestamp in seconds of the start (0) and end
+# (1) of each flight or pause, and obs is True if it was observed.
+TRAJ_DTYPE = np.dtype([
+    ("status", np.int8),
+    ("x0", np.float64), ("y0", np.float64), ("t0", np.float64),
+    ("x1", np.float64), ("y1", np.float64), ("t1", np.float64),
+    ("obs", np.bool_),
+])
+MOBMAT_DTYPE = np.dtype(TRAJ_DTYPE.descr[:7])
+PARQUET_COMPRESSION = "zstd"
+# row groups hold whole days, but at least this many rows since
+# small row groups are slow to read
+ROW_GROUP_MIN_ROWS = 65536
+
+
+class OutputFormat(Enum):
+    """This class enumerates the file formats of the outputs"""
+    CSV = "csv"
+    PARQUET = "parquet"
+
+
+def require_pyarrow() -> None:
+    """Raises an ImportError if pyarrow is not installed."""
+    if pa is None:
+        raise ImportError(
+            "pyarrow is required for Parquet files, "
+            "install it with pip install forest[parquet]"
+        )
+
+
+def to_records(matrix: np.ndarray) -> np.ndarray:
+    """Converts a trajectory or mobility matrix to its record representation.
+
+    Args:
+        matrix: 2d array, output from Imp2traj() or InferMobMat()
+    Returns:
+        1d structured array of TRAJ_DTYPE or MOBMAT_DTYPE,
+            fields can be accessed by name, e.g. records["t0"]
+    """
+    columns, dtype = MOBMAT_COLUMNS, MOBMAT_DTYPE
+    if matrix.shape[1] == len(TRAJ_COLUMNS):
+        columns, dtype = TRAJ_COLUMNS, TRAJ_DTYPE
+    records = np.empty(matrix.shape[0], dtype=dtype)
+    for i, column in enumerate(columns):
+        records[column] = matrix[:, i]
+    return records
+
+
+def from_records(records: np.ndarray) -> np.ndarray:
+    """Converts records back to the matrix used by the imputation.
+
+    Args:
+        records: 1d structured array, output from to_records()
+    Returns:
+        2d array of float64, as output from Imp2traj() or InferMobMat()
+    """
+    columns = MOBMAT_COLUMNS
+    if records.dtype == TRAJ_DTYPE:
+        columns = TRAJ_COLUMNS
+    matrix = np.empty((len(records), len(columns)))
+    for i, column in enumerate(columns):
+        matrix[:, i] = records[column]
+    return matrix
+
+
+def records_to_table(records: np.ndarray) -> "pa.Table":
+    """Converts trajectory or mobility matrix records to a typed Arrow
+    table, without converting them to a matrix.
+
+    Args:
+        records: 1d structured array, output from to_records()
+    Returns:
+        pyarrow.Table, with int8 status and obs columns
+            and float64 columns otherwise
+    """
+    require_pyarrow()
+    arrays = []
+    for column in records.dtype.names:
+        values = records[column]
+        if column in INT8_COLUMNS:
+            values = values.astype(np.int8)
+        arrays.append(pa.array(np.ascontiguousarray(values)))
+    return pa.Table.from_arrays(arrays, names=list(records.dtype.names))
+
+
+def write_records(
+    records: np.ndarray, path: str, output_format: OutputFormat
+) -> None:
+    """Writes trajectory or mobility matrix records, with the same
+    columns as write_matrix().
+
+    Row groups of Parquet files start at UTC days of the start times,
+    so that readers can skip the days they do not need.
+
+    Args:
+        records: 1d structured array, output from to_records()
+        path: str, path of the file without extension
+        output_format: OutputFormat, format of the file
+    """
+    if output_format == OutputFormat.CSV:
+        # the same csv as the float64 matrix used by the imputation
+        pd.DataFrame({
+            column: records[column].astype(np.float64)
+            for column in records.dtype.names
+        }).to_csv(f"{path}.csv", index=False)
+        return
+
+    table = records_to_table(records)
+    days = np.floor(records["t0"] / 86400)
+    # rows are in chronological order, days start where they change
+    day_starts = np.flatnonzero(np.diff(days)) + 1
+    with pq.ParquetWriter(
+        f"{path}.parquet", table.schema, compression=PARQUET_COMPRESSION
+    ) as writer:
+        start = 0
+        for day_start in day_starts:
+            if day_start - start >= ROW_GROUP_MIN_ROWS:
+                writer.write_table(table.slice(start, day_start - start))
+                start = day_start
+        writer.write_table(table.slice(start))
+
+
+def write_matrix(
+    matrix: np.ndarray, path: str, columns: list,
+    output_format: OutputFormat,
+) -> None:
+    """Writes a trajectory or mobility matrix, see write_records().
+
+    Args:
+        matrix: 2d array, output from Imp2traj() or InferMobMat()
+        path: str, path of the file without extension
+        columns: list of str, TRAJ_COLUMNS or MOBMAT_COLUMNS
+        output_format: OutputFormat, format of the file
+    """
+    if len(columns) != matrix.shape[1]:
+        raise ValueError(f"{len(columns)} columns for a matrix of "
+                         f"{matrix.shape[1]} columns")
+    write_records(to_records(matrix), path, output_format)
+
+
+def read_matrix_columns(path: str) -> Dict[str, np.ndarray]:
+    """Reads the columns of a trajectory or mobility matrix.
+
+    Columns of Parquet files are returned without copying the data
+    read by pyarrow when they have a single chunk.
+
+    Args:
+        path: str, path of a .csv or .parquet file
+    Returns:
+        dict of 1d arrays, by column name
+    """
+    if not path.endswith(".parquet"):
+        pd_matrix = pd.read_csv(path)
+        return {
+            column: pd_matrix[column].to_numpy()
+            for column in pd_matrix.columns
+        }
+    require_pyarrow()
+    table = pq.read_table(path)
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        if column.num_chunks == 1:
+            columns[name] = column.chunk(0).to_numpy()
+        else:
+            columns[name] = column.to_numpy()
+    return columns
+
+
+def read_records(path: str) -> np.ndarray:
+    """Reads a trajectory or mobility matrix as records, without
+    converting it to a float64 matrix.
+
+    Args:
+        path: str, path of a .csv or .parquet file
+    Returns:
+        1d structured array of TRAJ_DTYPE or MOBMAT_DTYPE,
+            as output from to_records()
+    """
+    columns = read_matrix_columns(path)
+    names, dtype = MOBMAT_COLUMNS, MOBMAT_DTYPE
+    if len(columns) == len(TRAJ_COLUMNS):
+        names, dtype = TRAJ_COLUMNS, TRAJ_DTYPE
+    records = np.empty(len(columns["t0"]), dtype=dtype)
+    for column in names:
+        records[column] = columns[column]
+    return records
+
+
+def read_matrix(path: str) -> np.ndarray:
+    """Reads a trajectory or mobility matrix.
+
+    Args:
+        path: str, path of a .csv or .parquet file
+    Returns:
+        2d array of float64, as output from Imp2traj() or InferMobMat()
+    """
+    columns = read_matrix_columns(path)
+    matrix = np.empty((len(columns["t0"]), len(columns)))
+    for i, values in enumerate(columns.values()):
+        matrix[:, i] = values
+    return matrix
+
+
+def write_summaries(
+    participant_id: str, summary_stats: pd.DataFrame, output_folder: str,
+    output_format: OutputFormat,
+) -> None:
+    """Writes the summary statistics of a participant.
+
+    Args:
+        participant_id: str, beiwe ID
+        summary_stats: pd dataframe, summary statistics
+        output_folder: str, folder of the file named by participant_id
+        output_format: OutputFormat, format of the file
+    """
+    if output_format == OutputFormat.CSV:
+        write_all_summaries(participant_id, summary_stats, output_folder)
+        return
+    require_pyarrow()
+    os.makedirs(output_folder, exist_ok=True)
+    summary_stats.to_parquet(
+        f"{output_folder}/{participant_id}.parquet", index=False,
+        compression=PARQUET_COMPRESSION,
+    )
+
+
+def read_summaries(path: str) -> pd.DataFrame:
+    """Reads the summary statistics of a participant.
+
+    Args:
+        path: str, path of a .csv or .parquet file
+    Returns:
+        pd dataframe, summary statistics
+    """
+    if path.endswith(".parquet"):
+        require_pyarrow()
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
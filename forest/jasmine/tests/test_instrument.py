@@ -0,0 +1,111 @@
+"""Tests for the stage instrumentation in Jasmine"""
+
+import json
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forest.jasmine.instrument import (Instrumentation, null_stage,
+                                       proc_memory, reset_proc_peak)
+
+# arrays of 40 MB, larger than the blocks glibc allocates in its heap,
+# so that their memory is mapped when allocated and released when freed
+ARRAY_SIZE = 40 * 1024 ** 2 // 8
+
+
+def test_stage_records_measurements(tmp_path):
+    """Testing a stage is appended to the report with its row counts"""
+    report_path = tmp_path / "report.jsonl"
+    instrumentation = Instrumentation(str(report_path))
+    stage = instrumentation.bind("user1")
+    with stage("collapse_data", 10) as record:
+        record.rows_out = 4
+    with stage("ExtractFlights", 4):
+        pass
+    records = [json.loads(line) for line in report_path.open()]
+    assert [r["stage"] for r in records] == ["collapse_data",
+                                             "ExtractFlights"]
+    assert records[0]["participant_id"] == "user1"
+    assert records[0]["rows_in"] == 10 and records[0]["rows_out"] == 4
+    assert records[0]["wall_time"] >= 0 and records[0]["cpu_time"] >= 0
+
+
+@pytest.fixture(params=["proc", "tracemalloc"])
+def memory_source(request, monkeypatch):
+    """Measures the resident memory from /proc on Linux,
+    or traces the memory allocated
+    """
+    if request.param == "proc":
+        if proc_memory() is None or not reset_proc_peak():
+            pytest.skip("resident memory not available from /proc")
+    else:
+        monkeypatch.setattr("forest.jasmine.instrument.proc_memory",
+                            lambda: None)
+    return request.param
+
+
+def test_stage_records_memory_of_stage(tmp_path, memory_source):
+    """Testing the memory of a stage is its own, not the peak of the
+    process so far
+    """
+    instrumentation = Instrumentation(str(tmp_path / "report.jsonl"))
+    with instrumentation.stage("user1", "large") as large:
+        kept = np.ones(ARRAY_SIZE)
+        np.ones(ARRAY_SIZE)
+    with instrumentation.stage("user1", "small") as small:
+        sum(range(100))
+    assert instrumentation.use_proc == (memory_source == "proc")
+    assert large.memory_mb == pytest.approx(40, abs=2)
+    assert large.peak_memory_mb == pytest.approx(80, abs=4)
+    assert small.peak_memory_mb < 1
+    assert kept.size > 0
+
+
+@pytest.mark.parametrize("reset_peak", [True, False])
+def test_nested_stages_keep_outer_peak(tmp_path, monkeypatch, memory_source,
+                                       reset_peak):
+    """Testing the peak of a nested stage is included in the peak of the
+    stage around it, also when tracing is restarted as on Python 3.8
+    """
+    if not reset_peak:
+        monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    instrumentation = Instrumentation(str(tmp_path / "report.jsonl"))
+    with instrumentation.stage("user1", "outer") as outer:
+        with instrumentation.stage("user1", "inner") as inner:
+            np.ones(ARRAY_SIZE)
+        with instrumentation.stage("user1", "empty") as empty:
+            pass
+    assert inner.peak_memory_mb == pytest.approx(40, abs=2)
+    assert outer.peak_memory_mb >= inner.peak_memory_mb
+    assert empty.peak_memory_mb < 1
+    assert not tracemalloc.is_tracing()
+
+
+def test_stage_records_errors(tmp_path):
+    """Testing a failed stage is recorded and the error raised"""
+    report_path = tmp_path / "report.jsonl"
+    instrumentation = Instrumentation(str(report_path))
+    with pytest.raises(ValueError):
+        with instrumentation.stage("user1", "read_data"):
+            raise ValueError("no data")
+    instrumentation.to_csv(str(tmp_path / "report.csv"))
+    report = pd.read_csv(tmp_path / "report.csv")
+    assert report.loc[0, "error"] == "ValueError('no data')"
+
+
+def test_stage_profiles(tmp_path):
+    """Testing a cProfile dump is written for each stage"""
+    instrumentation = Instrumentation(str(tmp_path / "report.jsonl"),
+                                      str(tmp_path / "profiles"))
+    with instrumentation.stage("user1", "Imp2traj"):
+        sum(range(100))
+    assert (tmp_path / "profiles" / "user1_Imp2traj.prof").exists()
+
+
+def test_null_stage_records_nothing(tmp_path):
+    """Testing the default stage function only yields a record"""
+    with null_stage("InferMobMat", 3) as record:
+        record.rows_out = 2
+    assert record.wall_time == 0 and list(tmp_path.iterdir()) == []
@@ -0,0 +1,109 @@
+"""Tests for the Overpass cache in Jasmine"""
+
+import json
+import os
+
+import pytest
+
+from forest.jasmine.overpass import (OverpassCache, bbox_tiles,
+                                     prefetch_tiles, query_overpass,
+                                     query_overpass_tiles)
+
+SELECTORS = [("node", "['amenity']"), ("way", "['amenity']")]
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return OverpassCache(directory=str(tmp_path), ttl=3600,
+                         max_size=10 ** 6, tile_size=0.01, offline=False,
+                         extract_path="")
+
+
+@pytest.fixture()
+def pub():
+    return {"type": "node", "id": 1, "lat": 51.4572, "lon": -2.5979,
+            "tags": {"amenity": "pub"}}
+
+
+def count(total):
+    return {"type": "count", "id": 0, "tags": {"total": str(total)}}
+
+
+def test_bbox_tiles():
+    """Testing the tiles cover the bounding box"""
+    tiles = bbox_tiles((51.451, -2.605, 51.469, -2.591), 0.01)
+    assert tiles == [(5145, -261), (5145, -260), (5146, -261), (5146, -260)]
+
+
+def test_query_overpass_tiles_uses_cache(cache, pub, mocker):
+    """Testing tiles are fetched once and split by the count elements"""
+    post = mocker.patch("forest.jasmine.overpass.post_query",
+                        return_value=[count(0), count(1), pub])
+    bboxes = [(51.4561, -2.6005, 51.4581, -2.5975)]
+    elements = query_overpass_tiles(bboxes, SELECTORS, cache=cache)
+    assert elements == [pub] and post.call_count == 1
+    assert post.call_args[0][0].count("out count;") == 2
+    elements = query_overpass_tiles(bboxes, SELECTORS, cache=cache)
+    assert elements == [pub] and post.call_count == 1
+
+
+def test_prefetch_tiles_batches(cache, pub, mocker):
+    """Testing prefetched tiles are served without further queries"""
+    post = mocker.patch("forest.jasmine.overpass.post_query",
+                        side_effect=lambda query: (
+                            [count(1), pub] * query.count("out count;")
+                        ))
+    bboxes = [(51.4561, -2.6005, 51.4581, -2.5975),
+              (51.4661, -2.6005, 51.4681, -2.5975)]
+    assert prefetch_tiles(bboxes, SELECTORS, cache=cache,
+                          tiles_per_query=3) == 4
+    assert post.call_count == 2
+    cache.directory = ""
+    assert query_overpass_tiles(bboxes[:1], SELECTORS, cache=cache) == [pub]
+    assert post.call_count == 2
+
+
+def test_query_overpass_expired(cache, pub, mocker):
+    """Testing expired entries are fetched again"""
+    post = mocker.patch("forest.jasmine.overpass.post_query",
+                        return_value=[pub])
+    query_overpass("query", cache)
+    os.utime(cache.path("query"), (0, 0))
+    cache.entries.clear()
+    assert query_overpass("query", cache) == [pub]
+    assert post.call_count == 2
+
+
+def test_cache_eviction(cache, pub):
+    """Testing the oldest entries are removed when the cache is full"""
+    cache.max_size = 2 * os.path.getsize(
+        _write_entry(cache, "first", [pub])
+    )
+    os.utime(cache.path("first"), (0, 0))
+    _write_entry(cache, "second", [pub])
+    _write_entry(cache, "third", [pub])
+    cache.evict()
+    cache.entries.clear()
+    assert cache.get("first") is None
+    assert cache.get("third") == [pub]
+
+
+def test_query_overpass_tiles_offline_extract(cache, pub, tmp_path, mocker):
+    """Testing offline mode reads missing tiles from a local extract"""
+    post = mocker.patch("forest.jasmine.overpass.post_query")
+    far_bar = {"type": "node", "id": 2, "lat": 40.0, "lon": -2.5979,
+               "tags": {"amenity": "bar"}}
+    extract_path = tmp_path / "extract.json"
+    extract_path.write_text(json.dumps({"elements": [pub, far_bar]}))
+    cache.offline = True
+    bboxes = [(51.4561, -2.5989, 51.4581, -2.5969)]
+    with pytest.raises(RuntimeError):
+        query_overpass_tiles(bboxes, SELECTORS, cache=cache)
+    cache.extract_path = str(extract_path)
+    assert query_overpass_tiles(bboxes, SELECTORS, cache=cache) == [pub]
+    assert post.call_count == 0
+
+
+def _write_entry(cache, key, elements):
+    cache.put(key, elements)
+    return cache.path(key)
@@ -0,0 +1,105 @@
+"""Tests for the csv and Parquet outputs of Jasmine"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forest.jasmine.storage import (MOBMAT_COLUMNS, MOBMAT_DTYPE,
+                                    TRAJ_COLUMNS, TRAJ_DTYPE, OutputFormat,
+                                    from_records, read_matrix,
+                                    read_matrix_columns, read_records,
+                                    read_summaries, to_records,
+                                    write_matrix, write_records,
+                                    write_summaries)
+
+
+@pytest.fixture()
+def traj():
+    t0 = np.arange(0, 4 * 86400, 3600.)
+    return np.column_stack((
+        np.where(np.arange(len(t0)) % 2, 1, 2), np.full(len(t0), 51.45),
+        np.full(len(t0), -2.59), t0, np.full(len(t0), 51.46),
+        np.full(len(t0), -2.58), t0 + 1800, np.arange(len(t0)) % 2,
+    )).astype(float)
+
+
+def test_records_round_trip(traj):
+    """Testing records have named fields and convert back exactly"""
+    records = to_records(traj)
+    assert records.dtype == TRAJ_DTYPE
+    assert records.nbytes < 0.8 * traj.nbytes
+    np.testing.assert_array_equal(records["t0"], traj[:, 3])
+    assert records["obs"].dtype == bool
+    np.testing.assert_array_equal(from_records(records), traj)
+    mobmat_records = to_records(traj[:, :7])
+    np.testing.assert_array_equal(from_records(mobmat_records), traj[:, :7])
+
+
+@pytest.mark.parametrize("output_format", list(OutputFormat))
+def test_matrix_round_trip(traj, tmp_path, output_format):
+    """Testing trajectories are read back as written"""
+    if output_format == OutputFormat.PARQUET:
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / "user")
+    write_matrix(traj, path, TRAJ_COLUMNS, output_format)
+    np.testing.assert_array_equal(
+        read_matrix(f"{path}.{output_format.value}"), traj
+    )
+
+
+@pytest.mark.parametrize("output_format", list(OutputFormat))
+@pytest.mark.parametrize("n_columns", [7, 8])
+def test_records_written_as_matrix(traj, tmp_path, output_format,
+                                   n_columns):
+    """Testing records are written as the same file as their matrix,
+    and read back as records
+    """
+    if output_format == OutputFormat.PARQUET:
+        pytest.importorskip("pyarrow")
+    matrix = traj[:, :n_columns]
+    columns = TRAJ_COLUMNS[:n_columns]
+    write_matrix(matrix, str(tmp_path / "matrix"), columns, output_format)
+    write_records(to_records(matrix), str(tmp_path / "records"),
+                  output_format)
+    extension = output_format.value
+    records = read_records(str(tmp_path / f"records.{extension}"))
+    assert records.dtype == (TRAJ_DTYPE if n_columns == 8 else MOBMAT_DTYPE)
+    np.testing.assert_array_equal(from_records(records), matrix)
+    if output_format == OutputFormat.CSV:
+        # as the matrix was written before records
+        expected = pd.DataFrame(matrix, columns=columns).to_csv(index=False)
+        assert (tmp_path / "records.csv").read_text() == expected
+        assert (tmp_path / "matrix.csv").read_text() == expected
+    else:
+        np.testing.assert_array_equal(
+            read_matrix(str(tmp_path / "matrix.parquet")), matrix
+        )
+
+
+def test_parquet_row_groups_by_day(traj, tmp_path, mocker):
+    """Testing Parquet files are typed and row groups hold whole days"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    mocker.patch("forest.jasmine.storage.ROW_GROUP_MIN_ROWS", 30)
+    path = str(tmp_path / "user")
+    write_matrix(traj[:, :7], path, MOBMAT_COLUMNS, OutputFormat.PARQUET)
+    parquet_file = pq.ParquetFile(f"{path}.parquet")
+    assert [
+        parquet_file.metadata.row_group(i).num_rows
+        for i in range(parquet_file.metadata.num_row_groups)
+    ] == [48, 48]
+    assert str(parquet_file.schema_arrow.field("status").type) == "int8"
+    columns = read_matrix_columns(f"{path}.parquet")
+    assert columns["t0"].dtype == np.float64
+    assert list(columns) == MOBMAT_COLUMNS
+
+
+def test_summaries_round_trip(tmp_path):
+    """Testing summary statistics are read back as written"""
+    pytest.importorskip("pyarrow")
+    summary_stats = pd.DataFrame({"year": [2021, 2021], "day": [1, 2],
+                                  "dist_traveled": [1.5, np.nan]})
+    write_summaries("user", summary_stats, str(tmp_path),
+                    OutputFormat.PARQUET)
+    pd.testing.assert_frame_equal(
+        read_summaries(str(tmp_path / "user.parquet")), summary_stats
+    )
@@ -1,12 +1,39 @@
 """Tests for traj2stats summary statistics in Jasmine"""
 
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+
 import numpy as np
+import pandas as pd
 import pytest
 from shapely.geometry import Point
 
-from forest.jasmine.data2mobmat import great_circle_dist
-from forest.jasmine.traj2stats import (Frequency, transform_point_to_circle,
-                                       gps_summaries)
+from forest.jasmine import traj2stats
+from forest.jasmine.data2mobmat import R, great_circle_dist
+from forest.jasmine.overpass import OverpassCache
+from forest.jasmine.storage import (TRAJ_COLUMNS, TRAJ_DTYPE, OutputFormat,
+                                    from_records, to_records, write_matrix)
+from forest.jasmine.traj2stats import (CircleBuffer, Frequency,
+                                       Hyperparameters, PlaceIndex,
+                                       SummaryContext,
+                                       cluster_pauses, cut_traj_boundaries,
+                                       get_nearby_bboxes,
+                                       get_nearby_locations, get_window_rows,
+                                       gps_quality_check, gps_stats_main,
+                                       gps_summaries, gps_summaries_both,
+                                       gps_summaries_from_saved,
+                                       load_saved_trajectory,
+                                       map_participants,
+                                       prefetch_nearby_locations,
+                                       split_traj_by_windows,
+                                       summarize_participant,
+                                       summarize_participants,
+                                       summarize_places,
+                                       transform_point_to_circle)
+from forest.poplar.legacy.common_funcs import datetime2stamp
 
 
 @pytest.fixture()
@@ -48,7 +75,75 @@ def test_transform_point_to_circle_radius(coords1):
     ]
 
     distance = great_circle_dist(*coords1, *point_in_edge)
-    assert distance >= 4 and distance <= 5
+    assert distance == pytest.approx(5, rel=1e-3)
+
+
+def test_circle_buffer_radius(coords1, coords2):
+    """Testing circles created in bulk have the right radius
+    around their center
+    """
+    lats = np.array([coords1[0], coords2[0], -33.9])
+    lons = np.array([coords1[1], coords2[1], 151.2])
+    circles = CircleBuffer().circles(lats, lons, 5)
+    for circle, lat, lon in zip(circles, lats, lons):
+        edge_lats, edge_lons = circle.exterior.coords.xy
+        distances = great_circle_dist(
+            lat, lon, np.array(edge_lats), np.array(edge_lons)
+        )
+        assert np.allclose(distances, 5, rtol=1e-3)
+
+
+def test_transform_point_to_circle_same_as_circle_buffer(coords1):
+    """Testing single circles are the circles of the summary statistics"""
+    circle1 = transform_point_to_circle(*coords1, 5)
+    circle2 = CircleBuffer().circles(
+        np.array([coords1[0]]), np.array([coords1[1]]), 5
+    )[0]
+    assert circle1.equals(circle2)
+
+
+@pytest.mark.parametrize(
+    "place", [(51.457183, -2.597960), (-33.8688, 151.2093)]
+)
+@pytest.mark.parametrize("distance, in_place", [(8, True), (11, False)])
+@pytest.mark.parametrize("bearing", ["north", "east"])
+def test_summarize_places_pause_at_distance(place, distance, in_place,
+                                            bearing):
+    """Testing a pause is in a place when its circle of 2 m intersects the
+    circle of 7.5 m of the place, i.e. closer than 9.5 m, in the northern
+    and western as well as in the southern and eastern hemispheres
+    """
+    lat, lon = place
+    if bearing == "north":
+        lat += np.degrees(distance / R)
+    else:
+        lon += np.degrees(distance / (R * np.cos(np.radians(lat))))
+    assert great_circle_dist(lat, lon, *place) == pytest.approx(
+        distance, rel=1e-3
+    )
+    traj = np.array([[2, lat, lon, 0, lat, lon, 3600, 1]], dtype=float)
+    context = SummaryContext(
+        home_lat=place[0] + 0.1, home_lon=place[1],
+        ids={"pub": [1]}, locations={1: [list(place)]},
+        tags={1: {"amenity": "pub"}},
+    )
+    place_times, _, _ = summarize_places(
+        traj, context, ["pub"], False, None, 2, 7.5
+    )
+    assert place_times == ([1, 0] if in_place else [0, 1])
+
+
+def test_circle_buffer_cache_size(coords1):
+    """Testing the cache of circles keeps the most recent circles"""
+    circle_buffer = CircleBuffer(max_size=2)
+    first = circle_buffer.circle(*coords1, 2)
+    circle_buffer.circle(coords1[0] + 0.001, coords1[1], 2)
+    assert circle_buffer.circle(*coords1, 2) is first
+    circle_buffer.circle(coords1[0] + 0.002, coords1[1], 2)
+    assert len(circle_buffer.saved_circles) == 2
+    assert (coords1[0] + 0.001, coords1[1], 2) not in (
+        circle_buffer.saved_circles
+    )
 
 
 @pytest.fixture()
@@ -393,3 +488,427 @@ def test_gps_summaries_log_format(
     )
     dates_log = np.array(list(log.keys()))
     assert np.all(dates_stats == dates_log)
+
+
+def test_get_window_rows_matches_mask(sample_trajectory):
+    """Testing the binary search finds the same rows as a full scan"""
+    start_times = np.arange(1633042800, 1633129500, 3600)
+    end_times = start_times + 3600
+    first_rows, last_rows = get_window_rows(
+        sample_trajectory, start_times, end_times
+    )
+    for start, end, first, last in zip(
+        start_times, end_times, first_rows, last_rows
+    ):
+        mask = (
+            (sample_trajectory[:, 3] < end) * (sample_trajectory[:, 6] > start)
+        )
+        assert np.array_equal(np.where(mask)[0], np.arange(first, last))
+
+
+def test_cut_traj_boundaries(sample_trajectory):
+    """Testing a flight is cut proportionally at both ends"""
+    temp = sample_trajectory[[1]].copy()
+    cut_traj_boundaries(temp, [0], [1633082700], [-1], [1633083000])
+    assert temp[0, 3] == 1633082700 and temp[0, 6] == 1633083000
+    mid_lat = (sample_trajectory[1, 1] + sample_trajectory[1, 4]) / 2
+    assert np.isclose((temp[0, 1] + temp[0, 4]) / 2, mid_lat)
+    assert np.isclose(temp[0, 4] - temp[0, 1], (
+        sample_trajectory[1, 4] - sample_trajectory[1, 1]
+    ) / 3)
+
+
+def test_split_traj_by_windows(sample_trajectory):
+    """Testing pieces are within their window and cover the trajectory"""
+    pieces, window_index = split_traj_by_windows(
+        sample_trajectory, 1633042800, 3600, 24
+    )
+    window_start = 1633042800 + window_index * 3600
+    assert np.all(pieces[:, 3] >= window_start)
+    assert np.all(pieces[:, 6] <= window_start + 3600)
+    assert np.all(np.diff(window_index) >= 0)
+    assert np.isclose(sum(pieces[:, 6] - pieces[:, 3]), 24 * 3600)
+
+
+def test_gps_summaries_both(
+    coords1, sample_trajectory, sample_nearby_locations, mocker
+):
+    """Testing the combined summaries match the separate ones
+    and query the nearby locations only once
+    """
+    nearby = mocker.patch(
+        "forest.jasmine.traj2stats.get_nearby_locations",
+        return_value=sample_nearby_locations,
+    )
+    mocker.patch("forest.jasmine.traj2stats.locate_home", return_value=coords1)
+    hourly, hourly_log, daily, daily_log = gps_summaries_both(
+        traj=sample_trajectory,
+        tz_str="Europe/London",
+        places_of_interest=["pub", "fast_food"],
+        save_log=True,
+        threshold=None,
+    )
+    assert nearby.call_count == 1
+    hourly_alone, hourly_log_alone = gps_summaries(
+        sample_trajectory, "Europe/London", Frequency.HOURLY,
+        ["pub", "fast_food"], True,
+    )
+    daily_alone, daily_log_alone = gps_summaries(
+        sample_trajectory, "Europe/London", Frequency.DAILY,
+        ["pub", "fast_food"], True,
+    )
+    assert hourly.equals(hourly_alone) and daily.equals(daily_alone)
+    assert hourly_log == hourly_log_alone and daily_log == daily_log_alone
+
+
+def test_prefetch_nearby_locations(sample_trajectory, mocker):
+    """Testing prefetched tiles serve the nearby locations of
+    all participants without querying Overpass again
+    """
+    pub = {"type": "node", "id": 1, "lat": 51.4572, "lon": -2.5979,
+           "tags": {"amenity": "pub"}}
+    post = mocker.patch(
+        "forest.jasmine.overpass.post_query",
+        side_effect=lambda query: (
+            [{"type": "count", "id": 0}, pub] * query.count("out count;")
+        ),
+    )
+    cache = OverpassCache(directory="", offline=False)
+    other_trajectory = sample_trajectory.copy()
+    other_trajectory[:, [1, 4]] += 0.001
+    prefetch_nearby_locations([sample_trajectory, other_trajectory], cache)
+    calls = post.call_count
+    ids, locations, tags = get_nearby_locations(sample_trajectory, cache)
+    get_nearby_locations(other_trajectory, cache)
+    assert post.call_count == calls
+    assert ids == {"pub": [1]} and locations[1] == [[51.4572, -2.5979]]
+
+
+def test_place_index(sample_nearby_locations):
+    """Testing the spatial index finds the same places as testing
+    every place
+    """
+    ids, locations, _ = sample_nearby_locations
+    place_index = PlaceIndex(ids, locations, 7.5, CircleBuffer())
+    assert list(place_index.get_place_rows("missing")) == []
+    for lat, lon in [(51.45425, -2.58622), (51.45397, -2.58595),
+                     (51.45412, -2.58602), (51.46, -2.58)]:
+        pause_circle = transform_point_to_circle(lat, lon, 2)
+        candidates = place_index.query(pause_circle)
+        assert set(np.where([
+            pause_circle.intersects(geometry)
+            for geometry in place_index.geometries
+        ])[0]) <= set(candidates)
+        expected = [
+            row for row, element_id in enumerate(place_index.element_ids)
+            if (len(locations[element_id]) == 1 and great_circle_dist(
+                lat, lon, *locations[element_id][0]) < 7.5)
+            or place_index.geometries[row].contains(Point(lat, lon))
+            and len(locations[element_id]) >= 3
+        ]
+        assert list(place_index.containing(lat, lon, 7.5)) == expected
+
+
+def test_cluster_pauses_matches_greedy_loop():
+    """Testing the batch clustering gives the same clusters and
+    durations as adding the pauses one by one
+    """
+    rng = np.random.default_rng(0)
+    latitudes = 51.45 + rng.normal(0, 0.0003, 300)
+    longitudes = -2.59 + rng.normal(0, 0.0005, 300)
+    durations = rng.uniform(1, 30, 300)
+    pause_array = np.empty((0, 3))
+    for lat, lon, duration in zip(latitudes, longitudes, durations):
+        distances = great_circle_dist(
+            lat, lon, pause_array[:, 0], pause_array[:, 1]
+        )
+        if len(pause_array) == 0 or np.min(distances) > 15:
+            pause_array = np.append(
+                pause_array, [[lat, lon, duration]], axis=0
+            )
+        else:
+            pause_array[distances <= 15, -1] += duration
+
+    creators, totals = cluster_pauses(latitudes, longitudes, 15, durations)
+    assert np.array_equal(latitudes[creators], pause_array[:, 0])
+    assert np.array_equal(longitudes[creators], pause_array[:, 1])
+    assert np.array_equal(totals, pause_array[:, 2])
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_map_participants_collects_errors(n_jobs):
+    """Testing every participant is returned, with the errors
+    of the failed ones
+    """
+    results = {
+        participant_id: (result, error)
+        for participant_id, result, error in map_participants(
+            int, [("1", ()), ("x", ()), ("3", ())], n_jobs, max_in_flight=1
+        )
+    }
+    assert results["1"] == (1, None) and results["3"] == (3, None)
+    assert results["x"][0] is None
+    assert isinstance(results["x"][1], ValueError)
+
+
+def test_summarize_participants_prefetches_by_batch(
+    sample_trajectory, mocker
+):
+    """Testing nearby locations are prefetched for batches of
+    participants, each batch summarized before the next is read
+    """
+    events = []
+
+    def trajectories():
+        for participant_id in ["a", "b", "c"]:
+            events.append(("read", participant_id))
+            yield participant_id, to_records(sample_trajectory)
+
+    mocker.patch(
+        "forest.jasmine.traj2stats.prefetch_nearby_locations",
+        side_effect=lambda trajs, cache: events.append(
+            ("prefetch", len(list(trajs)))
+        ),
+    )
+    mocker.patch("forest.jasmine.traj2stats.get_nearby_locations",
+                 return_value=({}, {}, {}))
+    mocker.patch(
+        "forest.jasmine.traj2stats.summarize_participant",
+        side_effect=lambda participant_id, *args: events.append(
+            ("summary", participant_id)
+        ),
+    )
+    results = list(summarize_participants(
+        trajectories(), (), True, batch_size=2
+    ))
+    assert [error for _, error, _ in results] == [None] * 3
+    assert events == [
+        ("read", "a"), ("read", "b"), ("prefetch", 2),
+        ("summary", "a"), ("summary", "b"),
+        ("read", "c"), ("prefetch", 1), ("summary", "c"),
+    ]
+
+
+def test_summarize_participant_from_records(sample_trajectory, tmp_path):
+    """Testing the summaries of the records of a trajectory are those of
+    its matrix
+    """
+    for name, traj in [("matrix", sample_trajectory),
+                       ("records", to_records(sample_trajectory))]:
+        os.makedirs(tmp_path / name)
+        summarize_participant(
+            "user", traj, str(tmp_path / name), "Europe/London",
+            Frequency.DAILY, None, False, None, False, 2, 7.5,
+        )
+    assert (tmp_path / "records" / "user.csv").read_bytes() == (
+        tmp_path / "matrix" / "user.csv"
+    ).read_bytes()
+
+
+def test_nearby_bboxes_from_records(sample_trajectory):
+    """Testing the pauses of records are those of the matrix"""
+    records = to_records(sample_trajectory)
+    assert get_nearby_bboxes(records) == get_nearby_bboxes(sample_trajectory)
+    assert len(get_nearby_bboxes(records)) > 0
+
+
+def test_load_saved_trajectory_as_records(sample_trajectory, tmp_path):
+    """Testing a saved trajectory is loaded as records"""
+    write_matrix(sample_trajectory, str(tmp_path / "user"), TRAJ_COLUMNS,
+                 OutputFormat.CSV)
+    records = load_saved_trajectory(str(tmp_path), "user")
+    assert records.dtype == TRAJ_DTYPE
+    np.testing.assert_array_equal(from_records(records), sample_trajectory)
+
+
+def test_gps_stats_main_summarizes_batches_as_imputed(
+    sample_trajectory, tmp_path, mocker
+):
+    """Testing each batch of participants is summarized before the next
+    participants are imputed, and failures are in the run report
+    """
+    events = []
+
+    def impute(participant_id, *args):
+        events.append(("impute", participant_id))
+        if participant_id == "b":
+            raise ValueError("no data")
+        return sample_trajectory, {}, {}
+
+    mocker.patch("forest.jasmine.traj2stats.impute_participant",
+                 side_effect=impute)
+    mocker.patch("forest.jasmine.traj2stats.prefetch_nearby_locations")
+    mocker.patch("forest.jasmine.traj2stats.get_nearby_locations",
+                 return_value=({}, {}, {}))
+    mocker.patch(
+        "forest.jasmine.traj2stats.summarize_participant",
+        side_effect=lambda participant_id, *args: events.append(
+            ("summary", participant_id)
+        ),
+    )
+    gps_stats_main(str(tmp_path / "study"), str(tmp_path / "output"),
+                   "Europe/London", Frequency.DAILY, False,
+                   places_of_interest=["pub"], participant_ids=["a", "b", "c"],
+                   batch_size=1)
+    assert events == [
+        ("impute", "a"), ("summary", "a"),
+        ("impute", "b"), ("impute", "c"), ("summary", "c"),
+    ]
+    report = pd.read_csv(tmp_path / "output" / "run_report.csv")
+    assert report.set_index("participant_id")["status"].to_dict() == {
+        "a": "processed", "b": "failed", "c": "processed"
+    }
+
+
+def test_gps_stats_main_shares_workers(sample_trajectory, tmp_path, mocker):
+    """Testing the imputation and the summaries run in the same pool of
+    n_jobs workers, so that at most n_jobs participants are processed
+    at once
+    """
+    pools = []
+    running = []
+    lock = threading.Lock()
+
+    class Pool(ThreadPoolExecutor):
+        def __init__(self, max_workers):
+            super().__init__(max_workers)
+            pools.append(max_workers)
+
+    def run(result):
+        with lock:
+            running.append(1)
+            concurrent = len(running)
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return result, concurrent
+
+    concurrency = []
+
+    def impute(participant_id, *args):
+        result, concurrent = run((sample_trajectory, {}, {}))
+        concurrency.append(concurrent)
+        return result
+
+    def summarize(participant_id, *args):
+        concurrency.append(run(None)[1])
+
+    mocker.patch("forest.jasmine.traj2stats.ProcessPoolExecutor", Pool)
+    mocker.patch("forest.jasmine.traj2stats.impute_participant",
+                 side_effect=impute)
+    mocker.patch("forest.jasmine.traj2stats.prefetch_nearby_locations")
+    mocker.patch("forest.jasmine.traj2stats.get_nearby_locations",
+                 return_value=({}, {}, {}))
+    mocker.patch("forest.jasmine.traj2stats.summarize_participant",
+                 side_effect=summarize)
+    participant_ids = [f"p{i}" for i in range(12)]
+    gps_stats_main(str(tmp_path / "study"), str(tmp_path / "output"),
+                   "Europe/London", Frequency.DAILY, False,
+                   places_of_interest=["pub"],
+                   participant_ids=participant_ids, n_jobs=2, batch_size=3)
+    assert pools == [2]
+    assert len(concurrency) == 24 and max(concurrency) <= 2
+    report = pd.read_csv(tmp_path / "output" / "run_report.csv")
+    assert (report["status"] == "processed").all()
+
+
+@pytest.mark.parametrize("block_size", [7, 1024 ** 2])
+def test_gps_quality_check_counts_rows(tmp_path, monkeypatch, block_size):
+    """Testing the quality check counts rows like pandas, also by blocks
+    smaller than a line, and keeps the content of the hourly files
+    """
+    monkeypatch.setattr("forest.jasmine.traj2stats.CSV_BLOCK_SIZE",
+                        block_size)
+    gps_path = tmp_path / "id" / "gps"
+    gps_path.mkdir(parents=True)
+    header = "timestamp,UTC time,latitude,longitude,altitude,accuracy\n"
+    row = "1633042800000,2021-10-01T00:00:00.000,51.4,-2.5,0,10\n"
+    (gps_path / "2021-10-01 00_00_00.csv").write_text(header + row * 61)
+    (gps_path / "2021-10-01 01_00_00.csv").write_text(header + row * 60)
+    (gps_path / "2021-10-01 02_00_00.csv").write_text(
+        header + (row * 61).rstrip("\n")
+    )
+    file_contents = {}
+    quality = gps_quality_check(str(tmp_path), "id", file_contents, 2)
+    assert np.isclose(quality, 2 / 3, atol=1e-4)
+    assert sorted(file_contents) == sorted(
+        path.name for path in gps_path.iterdir()
+    )
+    assert file_contents["2021-10-01 01_00_00.csv"] == (
+        gps_path / "2021-10-01 01_00_00.csv"
+    ).read_bytes()
+
+
+def test_gps_quality_check_keeps_files_in_range(tmp_path, mocker):
+    """Testing the content of the files is only kept when asked for,
+    for the hours in range
+    """
+    gps_path = tmp_path / "id" / "gps"
+    gps_path.mkdir(parents=True)
+    for hour in range(4):
+        (gps_path / f"2021-10-01 0{hour}_00_00.csv").write_text("timestamp\n")
+    (gps_path / "notes.txt").write_text("")
+    count = mocker.spy(traj2stats, "count_csv_rows")
+    assert gps_quality_check(str(tmp_path), "id", None, 2) == 0
+    assert all(not call.args[1] for call in count.call_args_list)
+    file_contents = {}
+    start = datetime2stamp([2021, 10, 1, 1, 0, 0], "UTC")
+    gps_quality_check(str(tmp_path), "id", file_contents, 2,
+                      (start, start + 7200))
+    assert sorted(file_contents) == ["2021-10-01 01_00_00.csv",
+                                     "2021-10-01 02_00_00.csv"]
+
+
+def test_gps_summaries_from_saved(
+    coords1, sample_trajectory, tmp_path, mocker
+):
+    """Testing summaries are computed from trajectories imputed
+    with the same hyperparameters only
+    """
+    mocker.patch("forest.jasmine.traj2stats.locate_home", return_value=coords1)
+    trajectory_folder = tmp_path / "trajectory"
+    trajectory_folder.mkdir()
+    for participant_id, parameters in [
+        ("same", Hyperparameters()), ("other", Hyperparameters(itrvl=20))
+    ]:
+        write_matrix(sample_trajectory,
+                     str(trajectory_folder / participant_id),
+                     TRAJ_COLUMNS, OutputFormat.CSV)
+        (trajectory_folder / f"{participant_id}.json").write_text(
+            json.dumps({"parameters_hash": parameters.content_hash()})
+        )
+    output_folder = tmp_path / "output"
+    gps_summaries_from_saved(str(trajectory_folder), str(output_folder),
+                             "Europe/London", Frequency.DAILY,
+                             Hyperparameters())
+    report = pd.read_csv(output_folder / "run_report.csv")
+    assert report.set_index("participant_id")["status"].to_dict() == {
+        "other": "failed", "same": "processed"
+    }
+    assert pd.read_csv(output_folder / "same.csv").shape[0] == 2
+
+
+def test_gps_summaries_from_saved_loads_one_by_one(
+    sample_trajectory, tmp_path, mocker
+):
+    """Testing each saved trajectory is loaded when it is summarized"""
+    events = []
+
+    def load(trajectory_folder, participant_id, parameters):
+        events.append(("load", participant_id))
+        return sample_trajectory
+
+    mocker.patch("forest.jasmine.traj2stats.load_saved_trajectory",
+                 side_effect=load)
+    mocker.patch(
+        "forest.jasmine.traj2stats.summarize_participant",
+        side_effect=lambda participant_id, *args: events.append(
+            ("summary", participant_id)
+        ),
+    )
+    gps_summaries_from_saved(str(tmp_path), str(tmp_path / "output"),
+                             "Europe/London", Frequency.DAILY,
+                             participant_ids=["a", "b"])
+    assert events == [
+        ("load", "a"), ("summary", "a"), ("load", "b"), ("summary", "b"),
+    ]
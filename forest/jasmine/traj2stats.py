@@ -2,33 +2,60 @@
 modules and calculate summary statistics of imputed trajectories.
 """
 
-from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import (FIRST_COMPLETED, Executor, Future,
+                                ProcessPoolExecutor, as_completed, wait)
+from dataclasses import asdict, dataclass, field, replace
 from enum import Enum
+import hashlib
+from itertools import islice
 import json
 import os
 import pickle
 import sys
-from typing import Dict, List, Tuple, Union
+import traceback
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple, Union)
 
 import numpy as np
 import pandas as pd
 from pyproj import Transformer
-import requests
+import shapely
 from shapely.geometry import Point
 from shapely.geometry.polygon import Polygon
-from shapely.ops import transform
+from shapely.strtree import STRtree
 
 from forest.bonsai.simulate_gps_data import bounding_box
-from forest.constants import OSM_OVERPASS_URL
-from forest.jasmine.data2mobmat import (GPS2MobMat, InferMobMat,
+from forest.jasmine.data2mobmat import (GPS2MobMat, InferMobMat, R,
                                         great_circle_dist,
                                         pairwise_great_circle_dist)
+from forest.jasmine.instrument import Instrumentation, null_stage
 from forest.jasmine.mobmat2traj import (Imp2traj, ImputeGPS, locate_home,
                                         num_sig_places)
+from forest.jasmine.overpass import (OverpassCache, prefetch_tiles,
+                                     query_overpass_tiles)
 from forest.jasmine.sogp_gps import BV_select
-from forest.poplar.legacy.common_funcs import (datetime2stamp, read_data,
-                                               stamp2datetime,
-                                               write_all_summaries)
+from forest.jasmine.storage import (MOBMAT_COLUMNS, OutputFormat,
+                                    from_records, read_records,
+                                    require_pyarrow, to_records,
+                                    write_matrix, write_records,
+                                    write_summaries)
+from forest.poplar.functions.io import map_files
+from forest.poplar.legacy.common_funcs import (FILENAME_PATTERN,
+                                               datetime2stamp,
+                                               filenames2stamps, read_data,
+                                               stamp2datetime)
+
+
+# columns of the raw GPS data used by the imputation
+GPS_COLUMNS = ["timestamp", "latitude", "longitude", "accuracy"]
+# size of the blocks of the raw GPS files read to count their rows
+CSV_BLOCK_SIZE = 1024 ** 2
+# Overpass statements of the places searched around pauses
+NEARBY_SELECTORS = [
+    ("node", "['leisure']"), ("way", "['leisure']"),
+    ("node", "['amenity']"), ("way", "['amenity']"),
+]
 
 
 class Frequency(Enum):
@@ -74,45 +101,170 @@ class Hyperparameters:
     w: Union[float, None] = None
     h: Union[int, None] = None
 
-
-def transform_point_to_circle(lat: float, lon: float, radius: float
-                              ) -> Polygon:
-    """This function transforms a set of cooordinates to a shapely
-    circle with a provided radius.
+    def content_hash(self) -> str:
+        """Returns a hash of the values of the hyperparameters,
+        the same for equal hyperparameters across runs.
+        """
+        content = json.dumps(asdict(self), sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def cluster_pauses(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    radius: float,
+    durations: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """This function clusters pauses greedily in their order: a pause
+    further than radius from all the previous clusters creates a cluster
+    at its coordinates, otherwise its duration is added to all the
+    clusters within radius.
+
+    The pauses are sorted by the cells of a grid larger than radius,
+    so that each cluster only measures the pauses in the 9 cells around
+    it, and the loop runs once per cluster instead of once per pause.
 
     Args:
-        lat: float, latitude of the center of the circle
-        lon: float, longitude of the center of the circle
+        latitudes, longitudes: 1d arrays, coordinates of the pauses
         radius: float, in meters
+        durations: 1d array, durations of the pauses, zeros if None
     Returns:
-        shapely polygon of a circle
+        the indices of the pauses creating the clusters, in order,
+        and the total duration of each cluster
     """
 
-    local_azimuthal_projection = (
-        f"+proj=aeqd +R=6371000 +units=m +lat_0={lat} +lon_0={lon}"
+    n_pauses = len(latitudes)
+    if durations is None:
+        durations = np.zeros(n_pauses)
+    if n_pauses == 0:
+        return np.array([], dtype=int), np.array([], dtype=float)
+
+    # cells are slightly larger than radius in both directions
+    lat_size = max(radius / R * 180 / np.pi * (1 + 1e-6), 1e-9)
+    max_cos = np.cos(np.max(np.abs(latitudes)) / 180 * np.pi)
+    lon_size = min(lat_size / max(max_cos, 1e-12), 360)
+    cell_rows = np.floor(latitudes / lat_size).astype(np.int64)
+    cell_cols = np.floor(longitudes / lon_size).astype(np.int64)
+    cell_rows -= cell_rows.min() - 1
+    cell_cols -= cell_cols.min() - 1
+    width = cell_cols.max() + 2
+    cells = cell_rows * width + cell_cols
+    order = np.argsort(cells, kind="stable")
+    sorted_cells = cells[order]
+    neighbour_offsets = np.array(
+        [i * width + j for i in (-1, 0, 1) for j in (-1, 0, 1)]
     )
-    wgs84_to_aeqd = Transformer.from_crs(
-        "+proj=longlat +datum=WGS84 +no_defs",
-        local_azimuthal_projection,
-    ).transform
-    aeqd_to_wgs84 = Transformer.from_crs(
-        local_azimuthal_projection,
-        "+proj=longlat +datum=WGS84 +no_defs",
-    ).transform
-
-    center = Point(lat, lon)
-    point_transformed = transform(wgs84_to_aeqd, center)
-    buffer = point_transformed.buffer(radius)
-    return transform(aeqd_to_wgs84, buffer)
-
-
-def get_nearby_locations(traj: np.ndarray) -> Tuple[dict, dict, dict]:
+
+    undecided = np.ones(n_pauses, dtype=bool)
+    creators: List[int] = []
+    members: List[np.ndarray] = []
+    while np.any(undecided):
+        # the first undecided pause has no previous cluster within radius
+        creator = int(np.argmax(undecided))
+        creators.append(creator)
+        neighbour_cells = cells[creator] + neighbour_offsets
+        starts = np.searchsorted(sorted_cells, neighbour_cells, side="left")
+        ends = np.searchsorted(sorted_cells, neighbour_cells, side="right")
+        candidates = np.concatenate(
+            [order[start:end] for start, end in zip(starts, ends)]
+        )
+        candidates = np.sort(candidates[candidates > creator])
+        distances = great_circle_dist(
+            latitudes[candidates], longitudes[candidates],
+            latitudes[creator], longitudes[creator],
+        )
+        members.append(candidates[distances <= radius])
+        undecided[creator] = False
+        undecided[members[-1]] = False
+
+    # durations are added in the order of the pauses, as in a loop
+    cluster_index = np.concatenate(
+        [np.arange(len(creators))]
+        + [np.full(len(member), i) for i, member in enumerate(members)]
+    )
+    pause_index = np.concatenate([np.array(creators)] + members)
+    added = np.lexsort((cluster_index, pause_index))
+    totals = np.bincount(
+        cluster_index[added], weights=durations[pause_index[added]],
+        minlength=len(creators),
+    )
+    return np.array(creators, dtype=int), totals
+
+
+def get_pause_coordinates(traj: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """This function returns the coordinates of the pauses of a trajectory.
+
+    Args:
+        traj: numpy array, trajectory, output from Imp2traj()
+            or its records from to_records()
+    Returns:
+        the latitudes and the longitudes of the start of the pauses
+    """
+
+    if traj.dtype.names is not None:
+        pauses = traj[traj["status"] == 2]
+        return pauses["x0"], pauses["y0"]
+    pauses = traj[traj[:, 0] == 2]
+    return pauses[:, 1], pauses[:, 2]
+
+
+def get_nearby_bboxes(traj: np.ndarray) -> List[Tuple]:
+    """This function returns the bounding boxes around the pauses
+    of a trajectory, where nearby locations are searched.
+
+    Args:
+        traj: numpy array, trajectory, or its records
+    Returns:
+        list of bounding boxes of 1km around pauses at least 1km apart
+    """
+
+    pause_lat, pause_lon = get_pause_coordinates(traj)
+    # only keep pauses which are not too close to the previous ones
+    creators, _ = cluster_pauses(pause_lat, pause_lon, 1000)
+    return [
+        bounding_box((lat, lon), 1000)
+        for lat, lon in zip(pause_lat[creators], pause_lon[creators])
+    ]
+
+
+def prefetch_nearby_locations(
+    trajs: Iterable[np.ndarray], cache: Optional[OverpassCache] = None
+) -> int:
+    """This function fetches once the tiles of nearby locations of all
+    the participants of a study, so that get_nearby_locations() serves
+    each participant from the cache.
+
+    Args:
+        trajs: iterable of trajectories, outputs from Imp2traj()
+            or their records
+        cache: OverpassCache, settings of the local cache of
+            Overpass results, defaults from forest.constants if None
+    Returns:
+        the number of tiles fetched
+    Raises:
+        RuntimeError: if the query to Overpass API fails
+    """
+
+    bboxes = [
+        bbox
+        for traj in trajs
+        if len(get_pause_coordinates(traj)[0]) > 0
+        for bbox in get_nearby_bboxes(traj)
+    ]
+    return prefetch_tiles(bboxes, NEARBY_SELECTORS, "geom qt", cache)
+
+
+def get_nearby_locations(
+    traj: np.ndarray, cache: Optional[OverpassCache] = None
+) -> Tuple[dict, dict, dict]:
     """This function returns a dictionary of nearby locations,
     a dictionary of nearby locations' names, and a dictionary of
     nearby locations' coordinates.
 
     Args:
-        traj: numpy array, trajectory
+        traj: numpy array, trajectory, or its records
+        cache: OverpassCache, settings of the local cache of
+            Overpass results, defaults from forest.constants if None
     Returns:
         ids: dictionary, contains nearby locations' ids
         locations: dictionary, contains nearby locations' coordinates
@@ -121,43 +273,15 @@ def get_nearby_locations(traj: np.ndarray) -> Tuple[dict, dict, dict]:
         RuntimeError: if the query to Overpass API fails
     """
 
-    pause_vec = traj[traj[:, 0] == 2]
-    latitudes: List[float] = [pause_vec[0, 1]]
-    longitudes: List[float] = [pause_vec[0, 2]]
-    for row in pause_vec:
-        minimum_distance = np.min([
-            great_circle_dist(row[1], row[2], lat, lon)
-            for lat, lon in zip(latitudes, longitudes)
-            ])
-        # only add coordinates to the list if they are not too close
-        # with the other coordinates in the list
-        if minimum_distance > 1000:
-            latitudes.append(row[1])
-            longitudes.append(row[2])
-
-    query = "[out:json];\n("
-
-    for lat, lon in zip(latitudes, longitudes):
-        bbox = bounding_box((lat, lon), 1000)
-
-        query += f"""
-        \tnode{bbox}['leisure'];
-        \tway{bbox}['leisure'];
-        \tnode{bbox}['amenity'];
-        \tway{bbox}['amenity'];"""
-
-    query += "\n);\nout geom qt;"
-
-    response = requests.post(OSM_OVERPASS_URL,
-                             data={"data": query}, timeout=60)
-    response.raise_for_status()
-
-    res = response.json()
+    # whole tiles around the bounding boxes are fetched and cached
+    elements = query_overpass_tiles(
+        get_nearby_bboxes(traj), NEARBY_SELECTORS, "geom qt", cache
+    )
     ids: Dict[str, List[int]] = {}
     locations: Dict[int, List[List[float]]] = {}
     tags: Dict[int, Dict[str, str]] = {}
 
-    for element in res["elements"]:
+    for element in elements:
 
         element_id = element["id"]
 
@@ -184,6 +308,585 @@ def get_nearby_locations(traj: np.ndarray) -> Tuple[dict, dict, dict]:
     return ids, locations, tags
 
 
+class CircleBuffer:
+    """Class creating circles around coordinates in bulk, in local azimuthal
+    equidistant projections centred on cells of a grid, whose transformers
+    are created once and reused.
+
+    Args:
+        cell_size: float, size of the cells of the grid in degrees,
+            so that points are at most a few tens of km from the centre
+            of their projection
+        max_size: int, maximum number of circles kept in the cache
+            of circle()
+    """
+
+    def __init__(self, cell_size: float = 1, max_size: int = 100000):
+        self.cell_size = cell_size
+        self.max_size = max_size
+        self.transformers: Dict[Tuple[int, int],
+                                Tuple[Transformer, Transformer]] = {}
+        self.saved_circles: OrderedDict = OrderedDict()
+
+    def get_transformers(
+        self, cell: Tuple[int, int]
+    ) -> Tuple[Transformer, Transformer]:
+        """Returns the transformers from and to the projection of a cell."""
+        if cell not in self.transformers:
+            lat = (cell[0] + 0.5) * self.cell_size
+            lon = (cell[1] + 0.5) * self.cell_size
+            local_azimuthal_projection = (
+                f"+proj=aeqd +R=6371000 +units=m +lat_0={lat} +lon_0={lon}"
+            )
+            self.transformers[cell] = (
+                Transformer.from_crs(
+                    "+proj=longlat +datum=WGS84 +no_defs",
+                    local_azimuthal_projection,
+                    always_xy=True,
+                ),
+                Transformer.from_crs(
+                    local_azimuthal_projection,
+                    "+proj=longlat +datum=WGS84 +no_defs",
+                    always_xy=True,
+                ),
+            )
+        return self.transformers[cell]
+
+    def circles(
+        self, lats: np.ndarray, lons: np.ndarray, radius: float
+    ) -> np.ndarray:
+        """Creates circles around coordinates.
+
+        Args:
+            lats, lons: 1d arrays, coordinates of the centers
+            radius: float, in meters
+        Returns:
+            1d array of shapely polygons, with (lat, lon) coordinates
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        circles = np.empty(len(lats), dtype=object)
+        cells = np.floor(
+            np.column_stack([lats, lons]) / self.cell_size
+        ).astype(int)
+        for cell in np.unique(cells, axis=0):
+            rows = np.where(np.all(cells == cell, axis=1))[0]
+            to_local, to_wgs84 = self.get_transformers(tuple(cell))
+            x, y = to_local.transform(lons[rows], lats[rows])
+            buffers = shapely.buffer(shapely.points(x, y), radius)
+
+            def to_lat_lon(coords: np.ndarray, to_wgs84=to_wgs84
+                           ) -> np.ndarray:
+                lon, lat = to_wgs84.transform(coords[:, 0], coords[:, 1])
+                return np.column_stack([lat, lon])
+
+            circles[rows] = shapely.transform(buffers, to_lat_lon)
+        return circles
+
+    def circle(self, lat: float, lon: float, radius: float) -> Polygon:
+        """Creates a circle around coordinates,
+        cached with the least recently used circles evicted first.
+
+        Args:
+            lat, lon: float, coordinates of the center
+            radius: float, in meters
+        Returns:
+            shapely polygon, with (lat, lon) coordinates
+        """
+        key = (lat, lon, radius)
+        if key in self.saved_circles:
+            self.saved_circles.move_to_end(key)
+        else:
+            self.saved_circles[key] = self.circles(
+                np.array([lat]), np.array([lon]), radius
+            )[0]
+            if len(self.saved_circles) > self.max_size:
+                self.saved_circles.popitem(last=False)
+        return self.saved_circles[key]
+
+
+# circles created by transform_point_to_circle()
+POINT_CIRCLES = CircleBuffer()
+
+
+def transform_point_to_circle(lat: float, lon: float, radius: float
+                              ) -> Polygon:
+    """This function transforms a set of cooordinates to a shapely
+    circle with a provided radius.
+
+    Args:
+        lat: float, latitude of the center of the circle
+        lon: float, longitude of the center of the circle
+        radius: float, in meters
+    Returns:
+        shapely polygon of a circle, with (lat, lon) coordinates,
+            the same as the circles of the summary statistics
+    """
+    return POINT_CIRCLES.circle(lat, lon, radius)
+
+
+class PlaceIndex:
+    """Class containing the geometries of the nearby locations in a spatial
+    index, so that only the places close to a pause are tested.
+
+    Args:
+        ids: dictionary, contains nearby locations' ids
+        locations: dictionary, contains nearby locations' coordinates
+        place_point_radius: float, radius of place's circle
+            when place is returned as centre coordinates from osm
+        circle_buffer: CircleBuffer, creates the circles of places
+            returned as centre coordinates
+    """
+
+    def __init__(
+        self,
+        ids: Dict[str, List[int]],
+        locations: Dict[int, List[List[float]]],
+        place_point_radius: float,
+        circle_buffer: CircleBuffer,
+    ):
+        self.ids = ids
+        self.element_ids = [
+            element_id for element_id, coordinates in locations.items()
+            if len(coordinates) == 1 or len(coordinates) >= 3
+        ]
+        self.rows = {
+            element_id: i for i, element_id in enumerate(self.element_ids)
+        }
+        self.is_point = np.array(
+            [len(locations[element_id]) == 1
+             for element_id in self.element_ids],
+            dtype=bool,
+        )
+        self.point_coordinates = np.array(
+            [locations[element_id][0] for element_id in self.element_ids],
+            dtype=float,
+        ).reshape(-1, 2)
+        self.geometries = np.empty(len(self.element_ids), dtype=object)
+        self.geometries[self.is_point] = circle_buffer.circles(
+            self.point_coordinates[self.is_point, 0],
+            self.point_coordinates[self.is_point, 1],
+            place_point_radius,
+        )
+        for row in np.where(~self.is_point)[0]:
+            self.geometries[row] = Polygon(
+                locations[self.element_ids[row]]
+            )
+        self.tree = STRtree(self.geometries)
+        self.place_rows: Dict[str, np.ndarray] = {}
+
+    def get_place_rows(self, place: str) -> np.ndarray:
+        """Returns the rows of the geometries of a type of place,
+        -1 for the locations without geometry, in the order of ids.
+        """
+        if place not in self.place_rows:
+            self.place_rows[place] = np.array(
+                [
+                    self.rows.get(element_id, -1)
+                    for element_id in self.ids.get(place, [])
+                ],
+                dtype=int,
+            )
+        return self.place_rows[place]
+
+    def query(self, geometry: Polygon) -> np.ndarray:
+        """Returns the rows of the geometries whose bounding box
+        intersects the one of a geometry.
+        """
+        return self.tree.query(geometry)
+
+    def containing(
+        self, lat: float, lon: float, place_point_radius: float
+    ) -> np.ndarray:
+        """Returns the sorted rows of the places containing a point:
+        points closer than place_point_radius and polygons around it.
+        """
+        near_points = np.where(self.is_point)[0]
+        near_points = near_points[
+            great_circle_dist(
+                lat, lon,
+                self.point_coordinates[near_points, 0],
+                self.point_coordinates[near_points, 1],
+            )
+            < place_point_radius
+        ]
+        polygons = self.tree.query(Point(lat, lon), predicate="within")
+        polygons = polygons[~self.is_point[polygons]]
+        return np.sort(np.concatenate([near_points, polygons]))
+
+
+@dataclass
+class SummaryContext:
+    """Class containing the inputs of the summary statistics which depend
+    on the whole trajectory of a participant, so that they are computed
+    once and shared by the hourly and daily summaries.
+
+    Args:
+        home_lat, home_lon: coordinates of the home, from locate_home()
+        ids, locations, tags: nearby locations, from get_nearby_locations()
+        circle_buffer: creates and caches the circles around pauses
+            and places
+        place_indexes: cache of the spatial indexes of nearby locations,
+            by radius of places' circles
+    """
+    home_lat: float
+    home_lon: float
+    ids: Dict[str, List[int]] = field(default_factory=dict)
+    locations: Dict[int, List[List[float]]] = field(default_factory=dict)
+    tags: Dict[int, Dict[str, str]] = field(default_factory=dict)
+    circle_buffer: CircleBuffer = field(default_factory=CircleBuffer)
+    place_indexes: Dict[float, PlaceIndex] = field(default_factory=dict)
+
+    def get_place_index(self, place_point_radius: float) -> PlaceIndex:
+        """Returns the spatial index of nearby locations,
+        built at the first call for a radius.
+        """
+        if place_point_radius not in self.place_indexes:
+            self.place_indexes[place_point_radius] = PlaceIndex(
+                self.ids, self.locations, place_point_radius,
+                self.circle_buffer,
+            )
+        return self.place_indexes[place_point_radius]
+
+
+def get_summary_context(
+    traj: np.ndarray,
+    tz_str: str,
+    places_of_interest: Union[List[str], None] = None,
+    save_log: bool = False,
+    cache: Optional[OverpassCache] = None,
+    nearby_locations: Optional[Tuple[dict, dict, dict]] = None,
+) -> SummaryContext:
+    """This function computes the inputs of the summary statistics
+    shared by all the windows and frequencies.
+
+    Args:
+        traj: 2d array, output from Imp2traj()
+        tz_str: timezone
+        places_of_interest: list of amenities or leisure places to watch,
+            keywords as used in openstreetmaps
+        save_log: bool, True if you want to output a log of locations
+            visited and their tags
+        cache: OverpassCache, settings of the local cache of
+            Overpass results, defaults from forest.constants if None
+        nearby_locations: tuple of ids, locations and tags, output from
+            get_nearby_locations(), queried if None
+    Returns:
+        a SummaryContext, with the nearby locations only if
+            places_of_interest or save_log are used
+    Raises:
+        RuntimeError: if the query to Overpass API fails
+    """
+
+    ids: Dict[str, List[int]] = {}
+    locations: Dict[int, List[List[float]]] = {}
+    tags: Dict[int, Dict[str, str]] = {}
+    if nearby_locations is not None:
+        ids, locations, tags = nearby_locations
+    elif places_of_interest is not None or save_log:
+        ids, locations, tags = get_nearby_locations(traj, cache)
+
+    obs_traj = traj[traj[:, 7] == 1, :]
+    home_lat, home_lon = locate_home(obs_traj, tz_str)
+    return SummaryContext(home_lat, home_lon, ids, locations, tags)
+
+
+def get_window_rows(
+    traj: np.ndarray,
+    start_time: Union[float, np.ndarray],
+    end_time: Union[float, np.ndarray],
+    inclusive: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """This function finds the rows of a trajectory overlapping
+    one or several time windows.
+
+    The trajectory is sorted in time and its segments do not overlap,
+    so the rows overlapping a window are contiguous and their range
+    is found with a binary search instead of a scan over all rows.
+
+    Args:
+        traj: 2d array, output from Imp2traj()
+        start_time: float or 1d array, starting timestamps of the windows
+        end_time: float or 1d array, ending timestamps of the windows
+        inclusive: bool, True if the segments touching the window
+            boundaries should be included
+    Returns:
+        the index of the first row in each window and the index
+            one past the last row in each window
+    """
+
+    if inclusive:
+        first_row = np.searchsorted(traj[:, 6], start_time, side="left")
+        last_row = np.searchsorted(traj[:, 3], end_time, side="right")
+    else:
+        first_row = np.searchsorted(traj[:, 6], start_time, side="right")
+        last_row = np.searchsorted(traj[:, 3], end_time, side="left")
+    return first_row, np.maximum(first_row, last_row)
+
+
+def cut_traj_boundaries(
+    traj: np.ndarray,
+    first_rows: Union[List[int], np.ndarray],
+    start_times: Union[List[float], np.ndarray],
+    last_rows: Union[List[int], np.ndarray],
+    end_times: Union[List[float], np.ndarray],
+) -> None:
+    """This function cuts the segments of a trajectory in place, so that
+    the first rows start and the last rows end at the given times.
+
+    The new coordinates are linearly interpolated along each segment
+    (or extrapolated, if the segment does not reach the given time).
+
+    Args:
+        traj: 2d array, a subset of the output from Imp2traj()
+        first_rows: list of rows to be cut at their start
+        start_times: list of new starting timestamps of first_rows
+        last_rows: list of rows to be cut at their end
+        end_times: list of new ending timestamps of last_rows
+    """
+
+    start_times = np.asarray(start_times, dtype=float)
+    end_times = np.asarray(end_times, dtype=float)
+    first = traj[first_rows, :]
+    last = traj[last_rows, :]
+    p0 = (first[:, 6] - start_times) / (first[:, 6] - first[:, 3])
+    p1 = (end_times - last[:, 3]) / (last[:, 6] - last[:, 3])
+    traj[first_rows, 1] = (1 - p0) * first[:, 4] + p0 * first[:, 1]
+    traj[first_rows, 2] = (1 - p0) * first[:, 5] + p0 * first[:, 2]
+    traj[first_rows, 3] = start_times
+    traj[last_rows, 4] = (1 - p1) * last[:, 1] + p1 * last[:, 4]
+    traj[last_rows, 5] = (1 - p1) * last[:, 2] + p1 * last[:, 5]
+    traj[last_rows, 6] = end_times
+
+
+def split_traj_by_windows(
+    traj: np.ndarray, start_stamp: int, window: int, no_windows: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """This function splits the segments of a trajectory at the boundaries
+    of consecutive time windows of the same length.
+
+    Each segment is repeated once for every window it overlaps and the
+    first and last segments of every window are cut proportionally at the
+    window boundaries, the same way as for a single window in
+    gps_summaries(), so that all the windows can be summarized at once.
+
+    Args:
+        traj: 2d array, output from Imp2traj()
+        start_stamp: int, starting timestamp of the first window
+        window: int, length of the windows, in seconds
+        no_windows: int, number of windows
+    Returns:
+        2d array, the pieces of the trajectory, sorted by window and time
+        1d array, the index of the window of each piece
+    """
+
+    first_window = np.floor((traj[:, 3] - start_stamp) / window)
+    last_window = np.ceil((traj[:, 6] - start_stamp) / window) - 1
+    first_window = np.maximum(first_window, 0).astype(int)
+    last_window = np.minimum(last_window, no_windows - 1).astype(int)
+    counts = np.maximum(last_window - first_window + 1, 0)
+    rows = np.repeat(np.arange(traj.shape[0]), counts)
+    offsets = (
+        np.arange(rows.shape[0])
+        - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    window_index = first_window[rows] + offsets
+    pieces = traj[rows, :]
+    if pieces.shape[0] == 0:
+        return pieces, window_index
+
+    new_window = np.diff(window_index) != 0
+    first_pieces = np.flatnonzero(np.concatenate(([True], new_window)))
+    last_pieces = np.flatnonzero(np.concatenate((new_window, [True])))
+    window_start = start_stamp + window_index * window
+    cut_traj_boundaries(
+        pieces,
+        first_pieces, window_start[first_pieces],
+        last_pieces, window_start[last_pieces] + window,
+    )
+    return pieces, window_index
+
+
+def window_metrics(
+    pieces: np.ndarray,
+    window_index: np.ndarray,
+    no_windows: int,
+    home_lat: float,
+    home_lon: float,
+) -> Dict[str, np.ndarray]:
+    """This function computes the summary statistics shared by the hourly
+    and daily summaries, for all the windows at once.
+
+    Args:
+        pieces: 2d array, output from split_traj_by_windows()
+        window_index: 1d array, output from split_traj_by_windows()
+        no_windows: int, number of windows
+        home_lat, home_lon: float, coordinates of the home
+    Returns:
+        a dictionary of 1d arrays with one value per window,
+            durations are in seconds and distances in meters
+    """
+
+    duration = pieces[:, 6] - pieces[:, 3]
+    d_home_1 = great_circle_dist(home_lat, home_lon, pieces[:, 1],
+                                 pieces[:, 2])
+    d_home_2 = great_circle_dist(home_lat, home_lon, pieces[:, 4],
+                                 pieces[:, 5])
+    d_home = (d_home_1 + d_home_2) / 2
+    mov_vec = np.round(
+        great_circle_dist(pieces[:, 4], pieces[:, 5], pieces[:, 1],
+                          pieces[:, 2]),
+        0,
+    )
+    flight = (pieces[:, 0] == 1).astype(float)
+    pause = (pieces[:, 0] == 2).astype(float)
+
+    def window_sum(values: np.ndarray) -> np.ndarray:
+        return np.bincount(window_index, weights=values,
+                           minlength=no_windows)
+
+    def window_mean_sd(values: np.ndarray, mask: np.ndarray
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+        count = window_sum(mask)
+        mean = window_sum(values * mask) / np.maximum(count, 1)
+        var = (
+            window_sum((values - mean[window_index]) ** 2 * mask)
+            / np.maximum(count, 1)
+        )
+        return mean, np.sqrt(var)
+
+    max_dist_home = np.zeros(no_windows)
+    if pieces.shape[0] > 0:
+        first_pieces = np.flatnonzero(
+            np.concatenate(([True], np.diff(window_index) != 0))
+        )
+        max_dist_home[window_index[first_pieces]] = np.maximum.reduceat(
+            np.maximum(d_home_1, d_home_2), first_pieces
+        )
+    av_f_len, sd_f_len = window_mean_sd(mov_vec, flight)
+    av_f_dur, sd_f_dur = window_mean_sd(duration, flight)
+    av_p_dur, sd_p_dur = window_mean_sd(duration, pause)
+
+    return {
+        "obs_duration": window_sum(duration * (pieces[:, 7] == 1)),
+        "home_time": window_sum(duration * (d_home <= 50)),
+        "dist_traveled": window_sum(mov_vec),
+        "max_dist_home": max_dist_home,
+        "total_flight_time": window_sum(duration * flight),
+        "av_flight_length": av_f_len,
+        "sd_flight_length": sd_f_len,
+        "av_flight_duration": av_f_dur,
+        "sd_flight_duration": sd_f_dur,
+        "total_pause_time": window_sum(duration * pause),
+        "av_pause_duration": av_p_dur,
+        "sd_pause_duration": sd_p_dur,
+    }
+
+
+def summarize_places(
+    temp: np.ndarray,
+    context: SummaryContext,
+    places_of_interest: Union[List[str], None],
+    save_log: bool,
+    threshold: Union[int, None],
+    person_point_radius: float,
+    place_point_radius: float,
+) -> Tuple[List[float], List[float], List[dict]]:
+    """This function finds the time spent in places of interest
+    and the tags of places visited during one window.
+
+    Args:
+        temp: 2d array, the trajectory of one window, cut at its
+            boundaries
+        context: SummaryContext, output from get_summary_context(),
+            its caches of circles and indexes are updated in place
+        places_of_interest: list of amenities or leisure places to watch,
+            keywords as used in openstreetmaps
+        save_log: bool, True if you want to output a log of locations
+            visited and their tags
+        threshold: int, time spent in a pause needs to exceed the threshold
+            to be placed in the log, in minutes
+        person_point_radius: float, radius of the person's circle when
+            discovering places near him in pauses
+        place_point_radius: float, radius of place's circle
+            when place is returned as centre coordinates from osm
+    Returns:
+        a list of time spent in each place of interest (plus other),
+        a list of time spent in each place of interest adjusted by
+            the intersection areas,
+        a list of tags of the places visited
+    """
+
+    home_lat, home_lon = context.home_lat, context.home_lon
+    tags = context.tags
+    all_place_times: List[float] = []
+    all_place_times_adjusted: List[float] = []
+    log_tags_temp: List[dict] = []
+    pause_vec = temp[temp[:, 0] == 2]
+    pause_vec = pause_vec[
+        great_circle_dist(pause_vec[:, 1], pause_vec[:, 2], home_lat, home_lon)
+        > 2*place_point_radius
+    ]
+    creators, minutes = cluster_pauses(
+        pause_vec[:, 1], pause_vec[:, 2], 2*place_point_radius,
+        (pause_vec[:, 6] - pause_vec[:, 3]) / 60,
+    )
+    pause_array = np.column_stack(
+        [pause_vec[creators, 1], pause_vec[creators, 2], minutes]
+    )
+
+    if places_of_interest is not None:
+        all_place_times = [0] * (len(places_of_interest) + 1)
+        all_place_times_adjusted = all_place_times[:-1]
+
+    place_index = context.get_place_index(place_point_radius)
+    for pause in pause_array:
+        if places_of_interest is not None:
+            all_place_probs: List[float] = [0] * len(places_of_interest)
+            pause_circle = context.circle_buffer.circle(
+                pause[0], pause[1], person_point_radius
+            )
+            add_to_other = True
+            # places outside the bounding box of the pause do not intersect
+            candidates = place_index.query(pause_circle)
+            intersection_areas: Dict[int, float] = {}
+            for j, place in enumerate(places_of_interest):
+                place_rows = place_index.get_place_rows(place)
+                for row in place_rows[np.isin(place_rows, candidates)]:
+                    if row not in intersection_areas:
+                        intersection_areas[row] = pause_circle.intersection(
+                            place_index.geometries[row]
+                        ).area
+                    if intersection_areas[row] > 0:
+                        all_place_probs[j] += intersection_areas[row]
+                        add_to_other = False
+
+            # in case of pause not in places of interest
+            if add_to_other:
+                all_place_times[-1] += pause[2] / 60
+            else:
+                all_place_probs2 = np.array(all_place_probs) / sum(
+                    all_place_probs
+                )
+                chosen_type = np.argmax(all_place_probs2)
+                all_place_times[chosen_type] += pause[2] / 60
+                for h, prob in enumerate(all_place_probs2):
+                    all_place_times_adjusted[h] += (
+                        prob * pause[2] / 60
+                    )
+
+        if save_log and threshold is not None:
+            if pause[2] >= threshold:
+                for row in place_index.containing(
+                    pause[0], pause[1], place_point_radius
+                ):
+                    log_tags_temp.append(
+                        tags[place_index.element_ids[row]]
+                    )
+
+    return all_place_times, all_place_times_adjusted, log_tags_temp
+
+
 def gps_summaries(
     traj: np.ndarray,
     tz_str: str,
@@ -194,6 +897,7 @@ def gps_summaries(
     split_day_night: bool = False,
     person_point_radius: float = 2,
     place_point_radius: float = 7.5,
+    context: Optional[SummaryContext] = None,
 ) -> Tuple[pd.DataFrame, dict]:
     """This function derives summary statistics from the imputed trajectories
 
@@ -227,6 +931,9 @@ def gps_summaries(
             discovering places near him in pauses
         place_point_radius: float, radius of place's circle
             when place is returned as centre coordinates from osm
+        context: SummaryContext, output from get_summary_context() with
+            the same places_of_interest and save_log, computed here
+            if None
     Returns:
         a pd dataframe, with each row as an hour/day,
             and each col as a feature/stat
@@ -242,17 +949,24 @@ def gps_summaries(
     elif frequency == Frequency.BOTH:
         raise ValueError("Frequency must be 'hourly' or 'daily'")
 
-    ids: Dict[str, List[int]] = {}
-    locations: Dict[int, List[List[float]]] = {}
-    tags: Dict[int, Dict[str, str]] = {}
-    if places_of_interest is not None or save_log:
-        ids, locations, tags = get_nearby_locations(traj)
+    if save_log and threshold is None:
+        threshold = 60
+        sys.stdout.write(
+            "threshold parameter set to None,"
+            + " automatically converted to 60min."
+            + "\n"
+        )
 
-    obs_traj = traj[traj[:, 7] == 1, :]
-    home_lat, home_lon = locate_home(obs_traj, tz_str)
+    if context is None:
+        context = get_summary_context(
+            traj, tz_str, places_of_interest, save_log
+        )
+    home_lat, home_lon = context.home_lat, context.home_lon
     summary_stats: List[List[float]] = []
     log_tags: Dict[str, List[dict]] = {}
-    saved_polygons: Dict[str, Polygon] = {}
+    log_tags_temp: List[dict] = []
+    all_place_times: List[float] = []
+    all_place_times_adjusted: List[float] = []
     if frequency == Frequency.HOURLY:
         # find starting and ending time
         sys.stdout.write("Calculating the hourly summary stats...\n")
@@ -285,344 +999,198 @@ def gps_summaries(
     if no_windows <= 0:
         raise ValueError("start time and end time are not correct")
 
-    summary_stats_df = pd.DataFrame([])
-    for i in range(no_windows):
-        if split_day_night:
-            i2 = i // 2
-        else:
-            i2 = i
-        start_time = start_stamp + i2 * window
-        end_time = start_stamp + (i2 + 1) * window
-        start_time2 = 0
-        end_time2 = 0
-
-        current_time_list = stamp2datetime(start_time, tz_str)
-        year, month, day, hour = current_time_list[:4]
-        # take a subset, the starting point of the last traj <end_time
-        # and the ending point of the first traj >start_time
-        index_rows = (traj[:, 3] < end_time) * (traj[:, 6] > start_time)
-
-        stop1 = 0
-        stop2 = 0
-        if split_day_night:
-            current_time_list2 = current_time_list.copy()
-            current_time_list3 = current_time_list.copy()
-            current_time_list2[3] = 8
-            current_time_list3[3] = 20
-            start_time2 = datetime2stamp(current_time_list2, tz_str)
-            end_time2 = datetime2stamp(current_time_list3, tz_str)
-            if i % 2 == 0:
-                # daytime
-                index_rows = (
-                    (traj[:, 3] <= end_time2)
-                    * (traj[:, 6] >= start_time2)
-                    )
-            else:
-                # nighttime
-                index1 = (
-                    (traj[:, 6] < start_time2)
-                    * (traj[:, 3] < end_time)
-                    * (traj[:, 6] > start_time)
-                )
-                index2 = (
-                    (traj[:, 3] > end_time2)
-                    * (traj[:, 3] < end_time)
-                    * (traj[:, 6] > start_time)
+    if frequency == Frequency.HOURLY:
+        # split the trajectory at all the hour boundaries at once
+        # and aggregate the pieces of every window together
+        pieces, window_index = split_traj_by_windows(
+            traj, start_stamp, window, no_windows
+        )
+        metrics = window_metrics(
+            pieces, window_index, no_windows, home_lat, home_lon
+        )
+        window_rows = np.searchsorted(window_index, np.arange(no_windows + 1))
+        for i in range(no_windows):
+            year, month, day, hour = stamp2datetime(
+                start_stamp + i * window, tz_str
+            )[:4]
+            if metrics["obs_duration"][i] == 0:
+                res = [year, month, day, hour, 0] + [pd.NA] * 11
+                if places_of_interest is not None:
+                    res += [pd.NA] * (2 * len(places_of_interest) + 1)
+                summary_stats.append(res)
+                log_tags[f"{day}/{month}/{year} {hour}:00"] = []
+                continue
+
+            res = [
+                year,
+                month,
+                day,
+                hour,
+                metrics["obs_duration"][i] / 60,
+                metrics["home_time"][i] / 60,
+                metrics["dist_traveled"][i],
+                metrics["max_dist_home"][i],
+                metrics["total_flight_time"][i] / 60,
+                metrics["av_flight_length"][i],
+                metrics["sd_flight_length"][i],
+                metrics["av_flight_duration"][i] / 60,
+                metrics["sd_flight_duration"][i] / 60,
+                metrics["total_pause_time"][i] / 60,
+                metrics["av_pause_duration"][i] / 60,
+                metrics["sd_pause_duration"][i] / 60,
+            ]
+            log_tags_temp = []
+            if places_of_interest is not None or save_log:
+                (all_place_times, all_place_times_adjusted,
+                 log_tags_temp) = summarize_places(
+                    pieces[window_rows[i]:window_rows[i + 1]], context,
+                    places_of_interest, save_log, threshold,
+                    person_point_radius, place_point_radius,
                 )
-                stop1 = sum(index1) - 1
-                stop2 = sum(index1)
-                index_rows = index1 + index2
-
-        if sum(index_rows) == 0 and split_day_night:
-            # if there is no data in the day, then we need to
-            # to add empty rows to the dataframe with 21 columns
-            res = [year, month, day] + [0] * 18
-            if places_of_interest is not None:
-                # add empty data for places of interest
-                # for daytime/nighttime + other
-                res += [0] * (2 * len(places_of_interest) + 1)
+                if places_of_interest is not None:
+                    res += all_place_times
+                    res += all_place_times_adjusted
+            log_tags[f"{day}/{month}/{year} {hour}:00"] = log_tags_temp
             summary_stats.append(res)
-            continue
-
-        temp = traj[index_rows, :]
-        # take a subset which is exactly one hour/day,
-        # cut the trajs at two ends proportionally
-        if split_day_night and i % 2 == 0:
-            t0_temp = start_time2
-            t1_temp = end_time2
-        else:
-            t0_temp = start_time
-            t1_temp = end_time
-
-        if sum(index_rows) == 1:
-            p0 = (t0_temp - temp[0, 3]) / (temp[0, 6] - temp[0, 3])
-            p1 = (t1_temp - temp[0, 3]) / (temp[0, 6] - temp[0, 3])
-            x0, y0 = temp[0, [1, 2]]
-            x1, y1 = temp[0, [4, 5]]
-            temp[0, 1] = (1 - p0) * x0 + p0 * x1
-            temp[0, 2] = (1 - p0) * y0 + p0 * y1
-            temp[0, 3] = t0_temp
-            temp[0, 4] = (1 - p1) * x0 + p1 * x1
-            temp[0, 5] = (1 - p1) * y0 + p1 * y1
-            temp[0, 6] = t1_temp
-        else:
-            if split_day_night and i % 2 != 0:
-                t0_temp_l = [start_time, end_time2]
-                t1_temp_l = [start_time2, end_time]
-                start_temp = [0, stop2]
-                end_temp = [stop1, -1]
-                for j in range(2):
-                    p0 = (temp[start_temp[j], 6] - t0_temp_l[j]) / (
-                        temp[start_temp[j], 6] - temp[start_temp[j], 3]
+    else:
+        for i in range(no_windows):
+            if split_day_night:
+                i2 = i // 2
+            else:
+                i2 = i
+            start_time = start_stamp + i2 * window
+            end_time = start_stamp + (i2 + 1) * window
+            start_time2 = 0
+            end_time2 = 0
+
+            current_time_list = stamp2datetime(start_time, tz_str)
+            year, month, day, hour = current_time_list[:4]
+
+            stop1 = 0
+            stop2 = 0
+            if not split_day_night:
+                # take a subset, the starting point of the last traj <end_time
+                # and the ending point of the first traj >start_time
+                first_row, last_row = get_window_rows(
+                    traj, start_time, end_time
+                )
+                temp = traj[first_row:last_row].copy()
+            else:
+                current_time_list2 = current_time_list.copy()
+                current_time_list3 = current_time_list.copy()
+                current_time_list2[3] = 8
+                current_time_list3[3] = 20
+                start_time2 = datetime2stamp(current_time_list2, tz_str)
+                end_time2 = datetime2stamp(current_time_list3, tz_str)
+                if i % 2 == 0:
+                    # daytime
+                    first_row, last_row = get_window_rows(
+                        traj, start_time2, end_time2, inclusive=True
                     )
-                    p1 = (t1_temp_l[j] - temp[end_temp[j], 3]) / (
-                        temp[end_temp[j], 6] - temp[end_temp[j], 3]
+                    temp = traj[first_row:last_row].copy()
+                else:
+                    # nighttime, the trajs ending before 8am
+                    # and the trajs starting after 8pm
+                    first_row1 = np.searchsorted(
+                        traj[:, 6], start_time, side="right"
                     )
-                    temp[start_temp[j], 1] = (1 - p0) * temp[
-                        start_temp[j], 4
-                    ] + p0 * temp[start_temp[j], 1]
-                    temp[start_temp[j], 2] = (1 - p0) * temp[
-                        start_temp[j], 5
-                    ] + p0 * temp[start_temp[j], 2]
-                    temp[start_temp[j], 3] = t0_temp_l[j]
-                    temp[end_temp[j], 4] = (1 - p1) * temp[
-                        end_temp[j], 1
-                    ] + p1 * temp[end_temp[j], 4]
-                    temp[end_temp[j], 5] = (1 - p1) * temp[
-                        end_temp[j], 2
-                    ] + p1 * temp[end_temp[j], 5]
-                    temp[end_temp[j], 6] = t1_temp_l[j]
-            else:
-                p0 = (temp[0, 6] - t0_temp) / (temp[0, 6] - temp[0, 3])
-                p1 = (
-                    (t1_temp - temp[-1, 3])
-                    / (temp[-1, 6] - temp[-1, 3])
+                    last_row1 = max(first_row1, min(
+                        np.searchsorted(traj[:, 6], start_time2, side="left"),
+                        np.searchsorted(traj[:, 3], end_time, side="left"),
+                    ))
+                    first_row2 = max(
+                        first_row1,
+                        np.searchsorted(traj[:, 3], end_time2, side="right"),
                     )
-                temp[0, 1] = (1 - p0) * temp[0, 4] + p0 * temp[0, 1]
-                temp[0, 2] = (1 - p0) * temp[0, 5] + p0 * temp[0, 2]
-                temp[0, 3] = t0_temp
-                temp[-1, 4] = (1 - p1) * temp[-1, 1] + p1 * temp[-1, 4]
-                temp[-1, 5] = (1 - p1) * temp[-1, 2] + p1 * temp[-1, 5]
-                temp[-1, 6] = t1_temp
-
-        obs_dur = sum((temp[:, 6] - temp[:, 3])[temp[:, 7] == 1])
-        d_home_1 = great_circle_dist(
-            home_lat, home_lon, temp[:, 1], temp[:, 2]
-            )
-        d_home_2 = great_circle_dist(
-            home_lat, home_lon, temp[:, 4], temp[:, 5]
-            )
-        d_home = (d_home_1 + d_home_2) / 2
-        max_dist_home = max(np.concatenate((d_home_1, d_home_2)))
-        time_at_home = sum((temp[:, 6] - temp[:, 3])[d_home <= 50])
-        mov_vec = np.round(
-            great_circle_dist(
-                temp[:, 4], temp[:, 5], temp[:, 1], temp[:, 2]
-            ),
-            0,
-        )
-        flight_d_vec = mov_vec[temp[:, 0] == 1]
-        flight_t_vec = (temp[:, 6] - temp[:, 3])[temp[:, 0] == 1]
-        pause_t_vec = (temp[:, 6] - temp[:, 3])[temp[:, 0] == 2]
-        total_pause_time = sum(pause_t_vec)
-        total_flight_time = sum(flight_t_vec)
-        dist_traveled = sum(mov_vec)
-        # Locations of importance
-        all_place_times = []
-        all_place_times_adjusted = []
-        log_tags_temp = []
-        if places_of_interest is not None or save_log:
-            pause_vec = temp[temp[:, 0] == 2]
-            pause_array: np.ndarray = np.array([])
-            for row in pause_vec:
-                if (
-                    great_circle_dist(row[1], row[2], home_lat, home_lon)
-                    > 2*place_point_radius
-                ):
-                    if len(pause_array) == 0:
-                        pause_array = np.array(
-                            [[row[1], row[2], (row[6] - row[3]) / 60]]
-                        )
-                    elif (
-                        np.min(
-                            great_circle_dist(
-                                row[1], row[2],
-                                pause_array[:, 0], pause_array[:, 1],
-                            )
-                        )
-                        > 2*place_point_radius
-                    ):
-                        pause_array = np.append(
-                            pause_array,
-                            [[row[1], row[2], (row[6] - row[3]) / 60]],
-                            axis=0,
-                        )
-                    else:
-                        pause_array[
-                            great_circle_dist(
-                                row[1], row[2],
-                                pause_array[:, 0], pause_array[:, 1],
-                            )
-                            <= 2*place_point_radius,
-                            -1,
-                        ] += (row[6] - row[3]) / 60
-
-            if places_of_interest is not None:
-                all_place_times = [0] * (len(places_of_interest) + 1)
-                all_place_times_adjusted = all_place_times[:-1]
-
-            for pause in pause_array:
-                if places_of_interest is not None:
-                    all_place_probs = [0] * len(places_of_interest)
-                    pause_str = f"{pause[0]}, {pause[1]} - person"
-                    if pause_str in saved_polygons.keys():
-                        pause_circle = saved_polygons[pause_str]
-                    else:
-                        pause_circle = transform_point_to_circle(
-                            pause[0], pause[1], person_point_radius
-                        )
-                        saved_polygons[pause_str] = pause_circle
-                    add_to_other = True
-                    for j, place in enumerate(places_of_interest):
-                        for element_id in ids[place]:
-                            if len(locations[element_id]) == 1:
-                                loc_lat = locations[element_id][0][0]
-                                loc_lon = locations[element_id][0][1]
-                                loc_str = f"{loc_lat}, {loc_lon} - place"
-                                if loc_str in saved_polygons.keys():
-                                    loc_circle = saved_polygons[loc_str]
-                                else:
-                                    loc_circle = transform_point_to_circle(
-                                        loc_lat,
-                                        loc_lon,
-                                        place_point_radius,
-                                    )
-                                    saved_polygons[loc_str] = loc_circle
-
-                                intersection_area = pause_circle.intersection(
-                                    loc_circle
-                                ).area
-                                if intersection_area > 0:
-                                    all_place_probs[j] += intersection_area
-                                    add_to_other = False
-
-                            elif len(locations[element_id]) >= 3:
-                                polygon = Polygon(locations[element_id])
-
-                                intersection_area = pause_circle.intersection(
-                                    polygon
-                                ).area
-                                if intersection_area > 0:
-                                    all_place_probs[j] += intersection_area
-                                    add_to_other = False
-
-                    # in case of pause not in places of interest
-                    if add_to_other:
-                        all_place_times[-1] += pause[2] / 60
-                    else:
-                        all_place_probs2 = np.array(all_place_probs) / sum(
-                            all_place_probs
-                        )
-                        chosen_type = np.argmax(all_place_probs2)
-                        all_place_times[chosen_type] += pause[2] / 60
-                        for h, prob in enumerate(all_place_probs2):
-                            all_place_times_adjusted[h] += (
-                                prob * pause[2] / 60
-                            )
-
-                if save_log:
-                    if threshold is None:
-                        threshold = 60
-                        sys.stdout.write(
-                            "threshold parameter set to None,"
-                            + " automatically converted to 60min."
-                            + "\n"
-                        )
-                    if pause[2] >= threshold:
-                        for place_id, place_coordinates in locations.items():
-                            if len(place_coordinates) == 1:
-                                if (
-                                    great_circle_dist(
-                                        pause[0], pause[1],
-                                        place_coordinates[0][0],
-                                        place_coordinates[0][1],
-                                    )
-                                    < place_point_radius
-                                ):
-                                    log_tags_temp.append(tags[place_id])
-                            elif len(place_coordinates) >= 3:
-                                polygon = Polygon(place_coordinates)
-                                point = Point(pause[0], pause[1])
-                                if polygon.contains(point):
-                                    log_tags_temp.append(tags[place_id])
-
-        if len(flight_d_vec) > 0:
-            av_f_len = np.mean(flight_d_vec)
-            sd_f_len = np.std(flight_d_vec)
-            av_f_dur = np.mean(flight_t_vec)
-            sd_f_dur = np.std(flight_t_vec)
-        else:
-            av_f_len = 0
-            sd_f_len = 0
-            av_f_dur = 0
-            sd_f_dur = 0
-        if len(pause_t_vec) > 0:
-            av_p_dur = np.mean(pause_t_vec)
-            sd_p_dur = np.std(pause_t_vec)
-        else:
-            av_p_dur = 0
-            sd_p_dur = 0
-        if frequency == Frequency.HOURLY:
-            if obs_dur == 0:
-                res = [
-                    year,
-                    month,
-                    day,
-                    hour,
-                    0,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                    pd.NA,
-                ]
+                    last_row2 = max(
+                        first_row2,
+                        np.searchsorted(traj[:, 3], end_time, side="left"),
+                    )
+                    stop1 = last_row1 - first_row1 - 1
+                    stop2 = last_row1 - first_row1
+                    temp = np.concatenate((
+                        traj[first_row1:last_row1],
+                        traj[first_row2:last_row2],
+                    ))
+
+            if temp.shape[0] == 0 and split_day_night:
+                # if there is no data in the day, then we need to
+                # to add empty rows to the dataframe with 21 columns
+                res = [year, month, day] + [0] * 18
                 if places_of_interest is not None:
-                    for p in range(2 * len(places_of_interest) + 1):
-                        res.append(pd.NA)
+                    # add empty data for places of interest
+                    # for daytime/nighttime + other
+                    res += [0] * (2 * len(places_of_interest) + 1)
                 summary_stats.append(res)
-                log_tags[f"{day}/{month}/{year} {hour}:00"] = []
+                continue
+
+            # take a subset which is exactly one hour/day,
+            # cut the trajs at two ends proportionally
+            if split_day_night and i % 2 == 0:
+                t0_temp = start_time2
+                t1_temp = end_time2
             else:
-                res = [
-                    year,
-                    month,
-                    day,
-                    hour,
-                    obs_dur / 60,
-                    time_at_home / 60,
-                    dist_traveled,
-                    max_dist_home,
-                    total_flight_time / 60,
-                    av_f_len,
-                    sd_f_len,
-                    av_f_dur / 60,
-                    sd_f_dur / 60,
-                    total_pause_time / 60,
-                    av_p_dur / 60,
-                    sd_p_dur / 60,
-                ]
-                if places_of_interest is not None:
-                    res += all_place_times
-                    res += all_place_times_adjusted
-                log_tags[f"{day}/{month}/{year} {hour}:00"] = log_tags_temp
+                t0_temp = start_time
+                t1_temp = end_time
+
+            if split_day_night and i % 2 != 0 and temp.shape[0] > 1:
+                cut_traj_boundaries(
+                    temp,
+                    [0, stop2], [start_time, end_time2],
+                    [stop1, -1], [start_time2, end_time],
+                )
+            else:
+                cut_traj_boundaries(temp, [0], [t0_temp], [-1], [t1_temp])
 
-                summary_stats.append(res)
-        else:
+            obs_dur = sum((temp[:, 6] - temp[:, 3])[temp[:, 7] == 1])
+            d_home_1 = great_circle_dist(
+                home_lat, home_lon, temp[:, 1], temp[:, 2]
+                )
+            d_home_2 = great_circle_dist(
+                home_lat, home_lon, temp[:, 4], temp[:, 5]
+                )
+            d_home = (d_home_1 + d_home_2) / 2
+            max_dist_home = max(np.concatenate((d_home_1, d_home_2)))
+            time_at_home = sum((temp[:, 6] - temp[:, 3])[d_home <= 50])
+            mov_vec = np.round(
+                great_circle_dist(
+                    temp[:, 4], temp[:, 5], temp[:, 1], temp[:, 2]
+                ),
+                0,
+            )
+            flight_d_vec = mov_vec[temp[:, 0] == 1]
+            flight_t_vec = (temp[:, 6] - temp[:, 3])[temp[:, 0] == 1]
+            pause_t_vec = (temp[:, 6] - temp[:, 3])[temp[:, 0] == 2]
+            total_pause_time = sum(pause_t_vec)
+            total_flight_time = sum(flight_t_vec)
+            dist_traveled = sum(mov_vec)
+            # Locations of importance
+            all_place_times = []
+            all_place_times_adjusted = []
+            log_tags_temp = []
+            if places_of_interest is not None or save_log:
+                (all_place_times, all_place_times_adjusted,
+                 log_tags_temp) = summarize_places(
+                    temp, context, places_of_interest, save_log, threshold,
+                    person_point_radius, place_point_radius,
+                )
+
+            if len(flight_d_vec) > 0:
+                av_f_len = np.mean(flight_d_vec)
+                sd_f_len = np.std(flight_d_vec)
+                av_f_dur = np.mean(flight_t_vec)
+                sd_f_dur = np.std(flight_t_vec)
+            else:
+                av_f_len = 0
+                sd_f_len = 0
+                av_f_dur = 0
+                sd_f_dur = 0
+            if len(pause_t_vec) > 0:
+                av_p_dur = np.mean(pause_t_vec)
+                sd_p_dur = np.std(pause_t_vec)
+            else:
+                av_p_dur = 0
+                sd_p_dur = 0
             hours = []
             for j in range(temp.shape[0]):
                 time_list = stamp2datetime(
@@ -733,67 +1301,68 @@ def gps_summaries(
                     )
                 else:
                     log_tags[f"{day}/{month}/{year}"] = log_tags_temp
-        summary_stats_df = pd.DataFrame(summary_stats)
-        if places_of_interest is None:
-            places_of_interest2 = []
-            places_of_interest3 = []
-        else:
-            places_of_interest2 = places_of_interest.copy()
-            places_of_interest2.append("other")
-            places_of_interest3 = [
-                f"{pl}_adjusted" for pl in places_of_interest
+
+    summary_stats_df = pd.DataFrame(summary_stats)
+    if places_of_interest is None:
+        places_of_interest2 = []
+        places_of_interest3 = []
+    else:
+        places_of_interest2 = places_of_interest.copy()
+        places_of_interest2.append("other")
+        places_of_interest3 = [
+            f"{pl}_adjusted" for pl in places_of_interest
+        ]
+    if frequency == Frequency.HOURLY:
+        summary_stats_df.columns = (
+            [
+                "year",
+                "month",
+                "day",
+                "hour",
+                "obs_duration",
+                "home_time",
+                "dist_traveled",
+                "max_dist_home",
+                "total_flight_time",
+                "av_flight_length",
+                "sd_flight_length",
+                "av_flight_duration",
+                "sd_flight_duration",
+                "total_pause_time",
+                "av_pause_duration",
+                "sd_pause_duration",
             ]
-        if frequency == Frequency.HOURLY:
-            summary_stats_df.columns = (
-                [
-                    "year",
-                    "month",
-                    "day",
-                    "hour",
-                    "obs_duration",
-                    "home_time",
-                    "dist_traveled",
-                    "max_dist_home",
-                    "total_flight_time",
-                    "av_flight_length",
-                    "sd_flight_length",
-                    "av_flight_duration",
-                    "sd_flight_duration",
-                    "total_pause_time",
-                    "av_pause_duration",
-                    "sd_pause_duration",
-                ]
-                + places_of_interest2
-                + places_of_interest3
-            )
-        else:
-            summary_stats_df.columns = (
-                [
-                    "year",
-                    "month",
-                    "day",
-                    "obs_duration",
-                    "obs_day",
-                    "obs_night",
-                    "home_time",
-                    "dist_traveled",
-                    "max_dist_home",
-                    "radius",
-                    "diameter",
-                    "num_sig_places",
-                    "entropy",
-                    "total_flight_time",
-                    "av_flight_length",
-                    "sd_flight_length",
-                    "av_flight_duration",
-                    "sd_flight_duration",
-                    "total_pause_time",
-                    "av_pause_duration",
-                    "sd_pause_duration",
-                ]
-                + places_of_interest2
-                + places_of_interest3
-            )
+            + places_of_interest2
+            + places_of_interest3
+        )
+    else:
+        summary_stats_df.columns = (
+            [
+                "year",
+                "month",
+                "day",
+                "obs_duration",
+                "obs_day",
+                "obs_night",
+                "home_time",
+                "dist_traveled",
+                "max_dist_home",
+                "radius",
+                "diameter",
+                "num_sig_places",
+                "entropy",
+                "total_flight_time",
+                "av_flight_length",
+                "sd_flight_length",
+                "av_flight_duration",
+                "sd_flight_duration",
+                "total_pause_time",
+                "av_pause_duration",
+                "sd_pause_duration",
+            ]
+            + places_of_interest2
+            + places_of_interest3
+        )
 
     if split_day_night:
         summary_stats_df_daytime = summary_stats_df[::2].reset_index(
@@ -842,12 +1411,116 @@ def gps_summaries(
     return summary_stats_df2, log_tags
 
 
-def gps_quality_check(study_folder: str, study_id: str) -> float:
+def gps_summaries_both(
+    traj: np.ndarray,
+    tz_str: str,
+    places_of_interest: Union[List[str], None] = None,
+    save_log: bool = False,
+    threshold: Union[int, None] = None,
+    split_day_night: bool = False,
+    person_point_radius: float = 2,
+    place_point_radius: float = 7.5,
+    context: Optional[SummaryContext] = None,
+) -> Tuple[pd.DataFrame, dict, pd.DataFrame, dict]:
+    """This function derives the hourly and the daily summary statistics
+    of a trajectory, locating the home, querying the nearby locations
+    and creating the circles around pauses and places only once.
+
+    Args:
+        traj: 2d array, output from Imp2traj(), which is a n by 8 mat,
+            with headers as [s,x0,y0,t0,x1,y1,t1,obs]
+        tz_str: timezone
+        places_of_interest: list of amenities or leisure places to watch,
+            keywords as used in openstreetmaps
+        save_log: bool, True if you want to output a log of locations
+            visited and their tags
+        threshold: int, time spent in a pause needs to exceed the threshold
+            to be placed in the log
+            only if save_log True, in minutes
+        split_day_night: bool, True if you want to split all metrics to
+            datetime and nighttime patterns
+            only for daily frequency
+        person_point_radius: float, radius of the person's circle when
+            discovering places near him in pauses
+        place_point_radius: float, radius of place's circle
+            when place is returned as centre coordinates from osm
+        context: SummaryContext, output from get_summary_context() with
+            the same places_of_interest and save_log, computed here
+            if None
+    Returns:
+        the hourly summary stats dataframe and logs dictionary,
+            followed by the daily ones, as returned by gps_summaries()
+    Raises:
+        RuntimeError: if the query to Overpass API fails
+    """
+
+    if context is None:
+        context = get_summary_context(
+            traj, tz_str, places_of_interest, save_log
+        )
+    summary_stats_hourly, logs_hourly = gps_summaries(
+        traj, tz_str, Frequency.HOURLY, places_of_interest, save_log,
+        threshold, split_day_night, person_point_radius,
+        place_point_radius, context,
+    )
+    summary_stats_daily, logs_daily = gps_summaries(
+        traj, tz_str, Frequency.DAILY, places_of_interest, save_log,
+        threshold, split_day_night, person_point_radius,
+        place_point_radius, context,
+    )
+    return (
+        summary_stats_hourly, logs_hourly, summary_stats_daily, logs_daily
+    )
+
+
+def count_csv_rows(
+    path: str, keep: bool = False
+) -> Tuple[int, Optional[bytes]]:
+    """This function counts the rows of a csv file from the newlines
+    in its raw bytes, read by blocks without parsing them.
+
+    Args:
+        path: str, path of the csv file
+        keep: bool, True to return the content of the file
+    Returns:
+        the number of rows without the header, and the content of the file
+            if keep is True, None otherwise
+    """
+    lines = 0
+    last = b""
+    blocks = []
+    with open(path, "rb") as csv_file:
+        while True:
+            block = csv_file.read(CSV_BLOCK_SIZE)
+            if not block:
+                break
+            lines += block.count(b"\n")
+            last = block[-1:]
+            if keep:
+                blocks.append(block)
+    if last not in (b"", b"\n"):
+        lines += 1
+    return max(lines - 1, 0), b"".join(blocks) if keep else None
+
+
+def gps_quality_check(
+    study_folder: str,
+    study_id: str,
+    file_contents: Optional[Dict[str, bytes]] = None,
+    n_threads: int = 8,
+    stamp_range: Optional[Tuple[float, float]] = None,
+) -> float:
     """The function checks the gps data quality.
 
     Args:
         study_folder (str): The path to the study folder.
         study_id (str): The id code of the study.
+        file_contents (dict): if not None, filled with the content of each
+            hourly file in stamp_range, by filename, to be passed to
+            read_data()
+        n_threads (int): number of files read at the same time
+        stamp_range (tuple): UNIX times [start, end) of the hours of the
+            files kept in file_contents, all the hourly files if None
     Returns:
         a scalar between 0 and 1, bigger means better data quality
             (percentage of data which meet the criterion)
@@ -860,21 +1533,509 @@ def gps_quality_check(study_folder: str, study_id: str) -> float:
         for i, _ in enumerate(file_list):
             if file_list[i][0] == ".":
                 file_list[i] = file_list[i][2:]
-        file_path = [
-            f"{gps_path }/{file_list[j]}"
-            for j, _ in enumerate(file_list)
-        ]
-        file_path_array = np.sort(np.array(file_path))
         # check if there are enough data for the following algorithm
+        unique_files = sorted(set(file_list))
+        kept = set()
+        if file_contents is not None:
+            hourly = [filename for filename in unique_files
+                      if FILENAME_PATTERN.match(filename)]
+            kept = set(hourly)
+            if stamp_range is not None and hourly:
+                stamps = filenames2stamps(hourly)
+                in_range = ((stamps >= stamp_range[0])
+                            & (stamps < stamp_range[1]))
+                kept = set(np.array(hourly)[in_range])
+        counts = {}
+        for filename, (rows, content) in zip(unique_files, map_files(
+            lambda filename: count_csv_rows(
+                f"{gps_path}/{filename}", filename in kept
+            ),
+            unique_files,
+            n_threads,
+        )):
+            counts[filename] = rows
+            if file_contents is not None and content is not None:
+                file_contents[filename] = content
         quality_yes = 0.
-        for i, _ in enumerate(file_path_array):
-            df = pd.read_csv(file_path_array[i])
-            if df.shape[0] > 60:
+        for filename in file_list:
+            if counts[filename] > 60:
                 quality_yes = quality_yes + 1.
-        quality_check = quality_yes / (len(file_path_array) + 0.0001)
+        quality_check = quality_yes / (len(file_list) + 0.0001)
     return quality_check
 
 
+def impute_participant(
+    participant_id: str,
+    study_folder: str,
+    output_folder: str,
+    tz_str: str,
+    save_traj: bool,
+    parameters: Hyperparameters,
+    time_start: Optional[list],
+    time_end: Optional[list],
+    memory_dict: Optional[dict],
+    bv_set: Optional[dict],
+    quality_threshold: float,
+    instrumentation: Optional[Instrumentation] = None,
+    output_format: OutputFormat = OutputFormat.CSV,
+) -> Optional[Tuple[np.ndarray, dict, dict]]:
+    """This function imputes the trajectory of a participant.
+
+    Args:
+        participant_id: str, beiwe ID
+        study_folder, output_folder, tz_str, save_traj, parameters,
+            time_start, time_end, quality_threshold,
+            output_format: as in gps_stats_main()
+        memory_dict, bv_set: dict, memory objects of the participant
+            from previous run (none if it's the first time)
+        instrumentation: Instrumentation, records the time and memory
+            used by each stage, nothing recorded if None
+    Returns:
+        the records of the trajectory, see to_records(), and the updated
+            memory_dict and bv_set, or None if the data quality is too low
+    """
+
+    sys.stdout.write(f"User: {participant_id}\n")
+    stage = null_stage
+    if instrumentation is not None:
+        stage = instrumentation.bind(participant_id)
+    # data quality check, keeping the files read for read_data, those of
+    # the hours in the time range
+    stamp_start, stamp_end = -np.inf, np.inf
+    if time_start is not None:
+        stamp_start = datetime2stamp(time_start, tz_str)
+    if time_end is not None:
+        stamp_end = datetime2stamp(time_end, tz_str)
+    file_contents: Dict[str, bytes] = {}
+    quality = gps_quality_check(study_folder, participant_id, file_contents,
+                                stamp_range=(stamp_start, stamp_end))
+    if quality <= quality_threshold:
+        sys.stdout.write("GPS data are not collected"
+                         " or the data quality is too low\n")
+        return None
+
+    # read data, only the columns used and, unless the accuracy of all
+    # records is needed for the default w, the accurate records
+    sys.stdout.write("Read in the csv files ...\n")
+    filters = None
+    if parameters.w is not None:
+        filters = [("accuracy", "<", parameters.accuracylim)]
+    with stage("read_data") as record:
+        data, _, _ = read_data(
+            participant_id, study_folder, "gps",
+            tz_str, time_start, time_end, file_contents,
+            columns=GPS_COLUMNS, filters=filters,
+        )
+        record.rows_out = data.shape[0]
+    del file_contents
+    parameters_hash = parameters.content_hash()
+    # default hyperparameters depend on the participant's data
+    parameters = replace(parameters)
+    if parameters.r is None:
+        parameters.r = parameters.itrvl
+    if parameters.h is None:
+        parameters.h = parameters.r
+    if parameters.w is None:
+        parameters.w = np.mean(data.accuracy)
+    pars0 = [
+        parameters.l1, parameters.l2, parameters.l3, parameters.a1,
+        parameters.a2, parameters.b1, parameters.b2, parameters.b3
+    ]
+    pars1 = [
+        parameters.l1, parameters.l2, parameters.a1, parameters.a2,
+        parameters.b1, parameters.b2, parameters.b3, parameters.g
+    ]
+    # process data
+    mobmat1 = GPS2MobMat(
+        data, parameters.itrvl, parameters.accuracylim,
+        parameters.r, parameters.w, parameters.h, stage
+    )
+    with stage("InferMobMat", mobmat1.shape[0]) as record:
+        mobmat2 = InferMobMat(mobmat1, parameters.itrvl, parameters.r)
+        record.rows_out = mobmat2.shape[0]
+    with stage("BV_select", mobmat2.shape[0]) as record:
+        out_dict = BV_select(
+            mobmat2,
+            parameters.sigma2,
+            parameters.tol,
+            parameters.d,
+            pars0,
+            memory_dict,
+            bv_set,
+        )
+        record.rows_out = out_dict["BV_set"].shape[0]
+    with stage("ImputeGPS", mobmat2.shape[0]) as record:
+        imp_table = ImputeGPS(mobmat2, out_dict["BV_set"], parameters.method,
+                              parameters.switch, parameters.num,
+                              parameters.linearity, tz_str, pars1)
+        record.rows_out = imp_table.shape[0]
+    with stage("Imp2traj", imp_table.shape[0]) as record:
+        traj = Imp2traj(imp_table, mobmat2, parameters.itrvl,
+                        parameters.r, parameters.w, parameters.h)
+        record.rows_out = traj.shape[0]
+    records = to_records(traj)
+    del traj
+    if save_traj is True:
+        write_records(records, f"{output_folder}/trajectory/{participant_id}",
+                      output_format)
+        # used by gps_summaries_from_saved() to check the trajectory
+        with open(
+            f"{output_folder}/trajectory/{participant_id}.json", "w"
+        ) as f:
+            json.dump({
+                "parameters_hash": parameters_hash,
+                "parameters": asdict(parameters),
+                "tz_str": tz_str,
+                "time_start": time_start,
+                "time_end": time_end,
+            }, f, indent=4)
+        if output_format == OutputFormat.PARQUET:
+            write_matrix(mobmat2, f"{output_folder}/mobmat/{participant_id}",
+                         MOBMAT_COLUMNS, output_format)
+    return records, out_dict["memory_dict"], out_dict["BV_set"]
+
+
+def summarize_participant(
+    participant_id: str,
+    traj: np.ndarray,
+    output_folder: str,
+    tz_str: str,
+    frequency: Frequency,
+    places_of_interest: Optional[list],
+    save_log: bool,
+    threshold: Optional[int],
+    split_day_night: bool,
+    person_point_radius: float,
+    place_point_radius: float,
+    nearby_locations: Optional[Tuple[dict, dict, dict]] = None,
+    instrumentation: Optional[Instrumentation] = None,
+    output_format: OutputFormat = OutputFormat.CSV,
+) -> None:
+    """This function writes the summary statistics of a participant,
+    and their log of locations visited if required.
+
+    Args:
+        participant_id: str, beiwe ID
+        traj: 2d array, output from Imp2traj(), or its records from
+            to_records(), converted to a matrix for the summaries which
+            interpolate the rows cut at the boundaries of the windows
+        output_folder, tz_str, frequency, places_of_interest, save_log,
+            threshold, split_day_night, person_point_radius,
+            place_point_radius, output_format: as in gps_stats_main()
+        nearby_locations: tuple of ids, locations and tags, output from
+            get_nearby_locations(), queried if None
+        instrumentation: Instrumentation, records the time and memory
+            used by the summaries, nothing recorded if None
+    """
+
+    sys.stdout.write(f"Summarizing user: {participant_id}\n")
+    if traj.dtype.names is not None:
+        traj = from_records(traj)
+    stage = null_stage
+    if instrumentation is not None:
+        stage = instrumentation.bind(participant_id)
+    if frequency == Frequency.BOTH:
+        with stage("gps_summaries", traj.shape[0]) as record:
+            context = get_summary_context(
+                traj, tz_str, places_of_interest, save_log,
+                nearby_locations=nearby_locations,
+            )
+            (summary_stats1, logs1,
+             summary_stats2, logs2) = gps_summaries_both(
+                traj,
+                tz_str,
+                places_of_interest,
+                save_log,
+                threshold,
+                split_day_night,
+                person_point_radius,
+                place_point_radius,
+                context,
+            )
+            record.rows_out = (
+                summary_stats1.shape[0] + summary_stats2.shape[0]
+            )
+        write_summaries(participant_id, summary_stats1,
+                        f"{output_folder}/hourly", output_format)
+        write_summaries(participant_id, summary_stats2,
+                        f"{output_folder}/daily", output_format)
+        if save_log:
+            with open(
+                f"{output_folder}/logs/"
+                f"locations_logs_hourly_{participant_id}.json",
+                "w",
+            ) as hourly:
+                json.dump(logs1, hourly, indent=4)
+            with open(
+                f"{output_folder}/logs/"
+                f"locations_logs_daily_{participant_id}.json",
+                "w",
+            ) as daily:
+                json.dump(logs2, daily, indent=4)
+    else:
+        with stage("gps_summaries", traj.shape[0]) as record:
+            context = get_summary_context(
+                traj, tz_str, places_of_interest, save_log,
+                nearby_locations=nearby_locations,
+            )
+            summary_stats, logs = gps_summaries(
+                traj,
+                tz_str,
+                frequency,
+                places_of_interest,
+                save_log,
+                threshold,
+                split_day_night,
+                person_point_radius,
+                place_point_radius,
+                context,
+            )
+            record.rows_out = summary_stats.shape[0]
+        write_summaries(
+            participant_id, summary_stats, output_folder, output_format
+        )
+        if save_log:
+            with open(
+                f"{output_folder}/logs/locations_logs_{participant_id}.json",
+                "w",
+            ) as loc:
+                json.dump(logs, loc, indent=4)
+
+
+def process_participant(
+    participant_id: str, impute_args: tuple, summary_args: tuple
+) -> Optional[Tuple[np.ndarray, dict, dict]]:
+    """This function imputes the trajectory of a participant and writes
+    their summary statistics.
+
+    Args:
+        participant_id: str, beiwe ID
+        impute_args: tuple, arguments of impute_participant()
+            after participant_id
+        summary_args: tuple, arguments of summarize_participant()
+            after participant_id and traj
+    Returns:
+        the output of impute_participant()
+    """
+
+    imputed = impute_participant(participant_id, *impute_args)
+    if imputed is not None:
+        summarize_participant(participant_id, imputed[0], *summary_args)
+    return imputed
+
+
+def map_participants(
+    function: Callable,
+    participant_args: Iterable[Tuple[str, tuple]],
+    n_jobs: int = 1,
+    max_in_flight: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Iterator[Tuple[str, Any, Optional[BaseException]]]:
+    """This function calls a function for each participant, in worker
+    processes if n_jobs > 1, catching the errors of each participant.
+
+    Args:
+        function: callable, called as function(participant_id, *args),
+            defined at the top level of a module if n_jobs > 1
+        participant_args: iterable of (participant_id, args), only
+            consumed as workers become available
+        n_jobs: int, number of worker processes, 1 to run in this process
+        max_in_flight: int, maximum number of participants submitted
+            to the workers at once, 2 * n_jobs if None
+        executor: Executor, pool of n_jobs workers shared with other
+            calls, so that n_jobs bounds the processes of all of them,
+            a pool is created for this call if None
+    Returns:
+        an iterator of (participant_id, result, error), in the order
+            the participants are done, with result None if an error
+            was raised
+    """
+
+    if n_jobs <= 1:
+        for participant_id, args in participant_args:
+            try:
+                yield participant_id, function(participant_id, *args), None
+            except Exception as error:
+                yield participant_id, None, error
+        return
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            yield from map_participants(function, participant_args, n_jobs,
+                                        max_in_flight, pool)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * n_jobs
+    pending: Dict[Future, str] = {}
+    for participant_id, args in participant_args:
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                exception = future.exception()
+                yield (pending.pop(future),
+                       None if exception else future.result(), exception)
+        future = executor.submit(function, participant_id, *args)
+        pending[future] = participant_id
+    for future in as_completed(pending):
+        exception = future.exception()
+        yield (pending[future],
+               None if exception else future.result(), exception)
+
+
+def report_failure(
+    report: List[dict], participant_id: str, error: BaseException,
+    stage: str,
+) -> None:
+    """This function prints the traceback of an error of a participant
+    and adds it to the run report.
+
+    Args:
+        report: list of dict, rows of the run report
+        participant_id: str, beiwe ID
+        error: the exception raised
+        stage: str, the stage where the error was raised
+    """
+    sys.stderr.write(
+        f"Participant {participant_id} failed in {stage}:\n"
+        + "".join(traceback.format_exception(
+            type(error), error, error.__traceback__
+        ))
+    )
+    report.append({"participant_id": participant_id, "status": "failed",
+                   "stage": stage, "error": repr(error)})
+
+
+def summarize_participants(
+    trajectories: Iterable[Tuple[str, np.ndarray]],
+    summary_args: tuple,
+    fetch_nearby: bool,
+    n_jobs: int = 1,
+    instrumentation: Optional[Instrumentation] = None,
+    output_format: OutputFormat = OutputFormat.CSV,
+    batch_size: int = 50,
+    executor: Optional[Executor] = None,
+) -> Iterator[Tuple[str, Optional[BaseException], str]]:
+    """This function writes the summary statistics of participants
+    from their trajectories, in worker processes if n_jobs > 1.
+
+    Args:
+        trajectories: iterable of (beiwe ID, trajectory), trajectories
+            as records from to_records(), only consumed batch by batch
+            if fetch_nearby is True
+        summary_args: tuple, arguments of summarize_participant()
+            after participant_id and traj, up to place_point_radius
+        fetch_nearby: bool, True to fetch the nearby locations of the
+            trajectories of each batch together before their summaries,
+            needed for places_of_interest or save_log
+        n_jobs, instrumentation, output_format: as in gps_stats_main()
+        batch_size: int, number of participants whose nearby locations
+            are fetched together, so that at most batch_size
+            trajectories are kept in memory
+        executor: Executor, pool of n_jobs workers shared with the
+            stage producing the trajectories, see map_participants()
+    Returns:
+        an iterator of (participant_id, error, stage), error is None
+            if the summaries were written
+    """
+    cache = OverpassCache()
+    trajectories = iter(trajectories)
+    batches: Iterator[Iterable[Tuple[str, np.ndarray]]] = iter(
+        [trajectories]
+    )
+    if fetch_nearby:
+        batches = iter(
+            lambda: list(islice(trajectories, max(1, batch_size))), []
+        )
+
+    for batch in batches:
+        failures: List[Tuple[str, BaseException, str]] = []
+        if fetch_nearby:
+            sys.stdout.write("Fetching nearby locations ...\n")
+            try:
+                prefetch_nearby_locations(
+                    (records for _, records in batch), cache,
+                )
+            except Exception as exception:
+                # the tiles missing from the cache are queried again by
+                # get_nearby_locations(), for each participant
+                sys.stderr.write(f"Prefetching nearby locations failed: "
+                                 f"{exception!r}\n")
+
+        def nearby_args(
+            batch: Iterable[Tuple[str, np.ndarray]] = batch,
+            failures: List[Tuple[str, BaseException, str]] = failures,
+        ) -> Iterator[Tuple[str, tuple]]:
+            for participant_id, records in batch:
+                nearby_locations = None
+                if fetch_nearby:
+                    try:
+                        nearby_locations = get_nearby_locations(
+                            records, cache
+                        )
+                    except Exception as error:
+                        failures.append(
+                            (participant_id, error, "nearby locations")
+                        )
+                        continue
+                # the records are sent to the workers, 50 bytes a row
+                # instead of 64 for the matrix
+                yield participant_id, (
+                    records, *summary_args, nearby_locations,
+                    instrumentation, output_format,
+                )
+
+        for participant_id, _, error in map_participants(
+            summarize_participant, nearby_args(), n_jobs,
+            executor=executor,
+        ):
+            while failures:
+                yield failures.pop(0)
+            yield participant_id, error, "summaries"
+        yield from failures
+
+
+def load_saved_trajectory(
+    trajectory_folder: str,
+    participant_id: str,
+    parameters: Optional[Hyperparameters] = None,
+) -> np.ndarray:
+    """This function loads a trajectory saved by gps_stats_main().
+
+    Args:
+        trajectory_folder: str, the trajectory folder of the output
+            of gps_stats_main()
+        participant_id: str, beiwe ID
+        parameters: Hyperparameters, the trajectory is only loaded
+            if it was imputed with these hyperparameters, not checked
+            if None
+    Returns:
+        1d structured array of TRAJ_DTYPE, records of the trajectory
+            as from to_records(), read without building its matrix
+    Raises:
+        FileNotFoundError: if there is no trajectory for the participant
+        ValueError: if the trajectory was imputed with other
+            hyperparameters, or without a record of them
+    """
+    path = f"{trajectory_folder}/{participant_id}"
+    if parameters is not None:
+        try:
+            with open(f"{path}.json") as f:
+                saved_hash = json.load(f)["parameters_hash"]
+        except FileNotFoundError:
+            raise ValueError(
+                "No record of the hyperparameters of the trajectory"
+            )
+        if saved_hash != parameters.content_hash():
+            raise ValueError(
+                "The trajectory was imputed with other hyperparameters"
+            )
+    for extension in ["parquet", "csv"]:
+        if os.path.exists(f"{path}.{extension}"):
+            return read_records(f"{path}.{extension}")
+    raise FileNotFoundError(f"No trajectory found at {path}")
+
+
 def gps_stats_main(
     study_folder: str,
     output_folder: str,
@@ -894,6 +2055,11 @@ def gps_stats_main(
     all_memory_dict: dict = None,
     all_bv_set: dict = None,
     quality_threshold: float = 0.05,
+    n_jobs: int = 1,
+    stage_report: bool = False,
+    profile_stages: bool = False,
+    output_format: OutputFormat = OutputFormat.CSV,
+    batch_size: int = 50,
 ):
     """This the main function to do the GPS imputation.
     It calls every function defined before.
@@ -906,7 +2072,7 @@ def gps_stats_main(
         frequency: Frequency, the frequency of the summary stats
             (resolution for summary statistics)
         save_traj: bool, True if you want to save the trajectories as a
-            csv file, False if you don't
+            csv or Parquet file, False if you don't
         places_of_interest: list of amenities or leisure places to watch,
             keywords as used in openstreetmaps
         save_log: bool, True if you want to output a log of locations
@@ -938,39 +2104,42 @@ def gps_stats_main(
         all_bv_set: dict, from previous run (none if it's the first time)
         quality_threshold: float, a percentage value of the fraction of data
             required for a summary to be created.
+        n_jobs: int, number of worker processes processing participants
+            in parallel, 1 to process them one by one
+        stage_report: bool, True to write the wall time, CPU time, peak
+            memory and row counts of each stage for each participant
+        profile_stages: bool, True to also write a cProfile dump of each
+            stage for each participant, only if stage_report True
+        output_format: OutputFormat, format of the summary stats and
+            trajectories, Parquet files also contain the mobility
+            matrices of the trajectories and need pyarrow
+        batch_size: int, number of participants whose nearby locations
+            are fetched together before their summaries, only if
+            places_of_interest or save_log, so that at most batch_size
+            trajectories are kept in memory
     Returns:
-        write summary stats as csv for each user during the specified
-            period
-        and a log of all locations visited as a json file if required
+        write summary stats as csv or Parquet for each user during the
+            specified period
+        and a log of all locations visited as a json file for each user
+            if required
         and imputed trajectory if required
         and memory objects (all_memory_dict and all_bv_set)
             as pickle files for future use
-        and a record csv file to show which users are processed
-        and logger csv file to show warnings and bugs during the run
+        and a run report csv file to show which users are processed,
+            skipped for low data quality, or failed with which error
+        and a stage report as jsonl and csv files if required
     """
 
+    if output_format == OutputFormat.PARQUET:
+        require_pyarrow()
     os.makedirs(output_folder, exist_ok=True)
 
     if parameters is None:
         parameters = Hyperparameters()
 
-    pars0 = [
-        parameters.l1, parameters.l2, parameters.l3, parameters.a1,
-        parameters.a2, parameters.b1, parameters.b2, parameters.b3
-    ]
-    pars1 = [
-        parameters.l1, parameters.l2, parameters.a1, parameters.a2,
-        parameters.b1, parameters.b2, parameters.b3, parameters.g
-    ]
-
-    orig_r = parameters.r
-    orig_w = parameters.w
-    orig_h = parameters.h
-
     # participant_ids should be a list of str
     if participant_ids is None:
         participant_ids = os.listdir(study_folder)
-    # create a record of processed user participant_id and starting/ending time
 
     if all_memory_dict is None:
         all_memory_dict = {}
@@ -987,116 +2156,199 @@ def gps_stats_main(
         os.makedirs(f"{output_folder}/daily", exist_ok=True)
     if save_traj:
         os.makedirs(f"{output_folder}/trajectory", exist_ok=True)
+        if output_format == OutputFormat.PARQUET:
+            os.makedirs(f"{output_folder}/mobmat", exist_ok=True)
+    if save_log:
+        os.makedirs(f"{output_folder}/logs", exist_ok=True)
+    instrumentation = None
+    if stage_report:
+        report_path = f"{output_folder}/stage_report.jsonl"
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        instrumentation = Instrumentation(
+            report_path,
+            f"{output_folder}/profiles" if profile_stages else None,
+        )
 
-    for participant_id in participant_ids:
-        sys.stdout.write(f"User: {participant_id}\n")
-        # data quality check
-        quality = gps_quality_check(study_folder, participant_id)
-        if quality > quality_threshold:
-            # read data
-            sys.stdout.write("Read in the csv files ...\n")
-            data, _, _ = read_data(
-                participant_id, study_folder, "gps",
-                tz_str, time_start, time_end,
-            )
-            if orig_r is None:
-                parameters.r = parameters.itrvl
-            if orig_h is None:
-                parameters.h = parameters.r
-            if orig_w is None:
-                parameters.w = np.mean(data.accuracy)
-            # process data
-            mobmat1 = GPS2MobMat(
-                data, parameters.itrvl, parameters.accuracylim,
-                parameters.r, parameters.w, parameters.h
-            )
-            mobmat2 = InferMobMat(mobmat1, parameters.itrvl, parameters.r)
-            out_dict = BV_select(
-                mobmat2,
-                parameters.sigma2,
-                parameters.tol,
-                parameters.d,
-                pars0,
-                all_memory_dict[str(participant_id)],
-                all_bv_set[str(participant_id)],
-            )
-            all_bv_set[str(participant_id)] = bv_set = out_dict["BV_set"]
-            all_memory_dict[str(participant_id)] = out_dict["memory_dict"]
-            imp_table = ImputeGPS(mobmat2, bv_set, parameters.method,
-                                  parameters.switch, parameters.num,
-                                  parameters.linearity, tz_str, pars1)
-            traj = Imp2traj(imp_table, mobmat2, parameters.itrvl,
-                            parameters.r, parameters.w, parameters.h)
+    def impute_args(participant_id: str) -> tuple:
+        return (
+            study_folder, output_folder, tz_str, save_traj, parameters,
+            time_start, time_end, all_memory_dict[str(participant_id)],
+            all_bv_set[str(participant_id)], quality_threshold,
+            instrumentation, output_format,
+        )
+
+    summary_args = (
+        output_folder, tz_str, frequency, places_of_interest, save_log,
+        threshold, split_day_night, person_point_radius, place_point_radius,
+    )
+    report: List[dict] = []
+
+    def record(
+        participant_id: str, imputed: Any, error: Optional[BaseException],
+        stage: str,
+    ) -> None:
+        if error is not None:
+            report_failure(report, participant_id, error, stage)
+        elif imputed is None:
+            report.append({"participant_id": participant_id,
+                           "status": "low_quality", "stage": stage,
+                           "error": ""})
+        else:
             # save all_memory_dict and all_bv_set
+            all_memory_dict[str(participant_id)] = imputed[1]
+            all_bv_set[str(participant_id)] = imputed[2]
             with open(f"{output_folder}/all_memory_dict.pkl", "wb") as f:
                 pickle.dump(all_memory_dict, f)
             with open(f"{output_folder}/all_bv_set.pkl", "wb") as f:
                 pickle.dump(all_bv_set, f)
-            if save_traj is True:
-                pd_traj = pd.DataFrame(traj)
-                pd_traj.columns = ["status", "x0", "y0", "t0", "x1", "y1",
-                                   "t1", "obs"]
-                pd_traj.to_csv(
-                    f"{output_folder}/trajectory/{participant_id}.csv",
-                    index=False
-                )
-            if frequency == Frequency.BOTH:
-                summary_stats1, logs1 = gps_summaries(
-                    traj,
-                    tz_str,
-                    Frequency.HOURLY,
-                    places_of_interest,
-                    save_log,
-                    threshold,
-                    split_day_night,
-                )
-                write_all_summaries(participant_id, summary_stats1,
-                                    f"{output_folder}/hourly")
-                summary_stats2, logs2 = gps_summaries(
-                    traj,
-                    tz_str,
-                    Frequency.DAILY,
-                    places_of_interest,
-                    save_log,
-                    threshold,
-                    split_day_night,
-                    person_point_radius,
-                    place_point_radius,
-                )
-                write_all_summaries(participant_id, summary_stats2,
-                                    f"{output_folder}/daily")
-                if save_log:
-                    os.makedirs(f"{output_folder}/logs", exist_ok=True)
-                    with open(
-                        f"{output_folder}/logs/locations_logs_hourly.json",
-                        "w",
-                    ) as hourly:
-                        json.dump(logs1, hourly, indent=4)
-                    with open(
-                        f"{output_folder}/logs/locations_logs_daily.json",
-                        "w",
-                    ) as daily:
-                        json.dump(logs2, daily, indent=4)
-            else:
-                summary_stats, logs = gps_summaries(
-                    traj,
-                    tz_str,
-                    frequency,
-                    places_of_interest,
-                    save_log,
-                    threshold,
-                    split_day_night,
-                )
-                write_all_summaries(
-                    participant_id, summary_stats, output_folder
+
+    if places_of_interest is None and not save_log:
+        # each participant is imputed and summarized by the same worker
+        for participant_id, imputed, error in map_participants(
+            process_participant,
+            # nearby locations are queried by summarize_participant()
+            ((participant_id, (impute_args(participant_id),
+                               (*summary_args, None, instrumentation,
+                                output_format)))
+             for participant_id in participant_ids),
+            n_jobs,
+        ):
+            record(participant_id, imputed, error, "processing")
+            if imputed is not None:
+                report.append({"participant_id": participant_id,
+                               "status": "processed", "stage": "",
+                               "error": ""})
+    else:
+        # participants are summarized by batch as they are imputed, so
+        # that the nearby locations of a batch are fetched together, by
+        # the same workers, so that at most n_jobs participants are
+        # processed at once
+        executor = None
+        if n_jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+
+        def imputed_trajectories() -> Iterator[Tuple[str, np.ndarray]]:
+            for participant_id, imputed, error in map_participants(
+                impute_participant,
+                ((participant_id, impute_args(participant_id))
+                 for participant_id in participant_ids),
+                n_jobs, executor=executor,
+            ):
+                record(participant_id, imputed, error, "imputation")
+                if imputed is not None:
+                    yield participant_id, imputed[0]
+
+        try:
+            for participant_id, error, stage in summarize_participants(
+                imputed_trajectories(), summary_args, True, n_jobs,
+                instrumentation, output_format, batch_size, executor,
+            ):
+                if error is not None:
+                    report_failure(report, participant_id, error, stage)
+                else:
+                    report.append({"participant_id": participant_id,
+                                   "status": "processed", "stage": "",
+                                   "error": ""})
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    pd.DataFrame(
+        report, columns=["participant_id", "status", "stage", "error"]
+    ).to_csv(f"{output_folder}/run_report.csv", index=False)
+    if instrumentation is not None:
+        instrumentation.to_csv(f"{output_folder}/stage_report.csv")
+
+
+def gps_summaries_from_saved(
+    trajectory_folder: str,
+    output_folder: str,
+    tz_str: str,
+    frequency: Frequency,
+    parameters: Optional[Hyperparameters] = None,
+    places_of_interest: Optional[list] = None,
+    save_log: bool = False,
+    threshold: Optional[int] = None,
+    split_day_night: bool = False,
+    person_point_radius: float = 2,
+    place_point_radius: float = 7.5,
+    participant_ids: Optional[list] = None,
+    n_jobs: int = 1,
+    output_format: OutputFormat = OutputFormat.CSV,
+    batch_size: int = 50,
+):
+    """This function computes the summary statistics from trajectories
+    saved by gps_stats_main() with save_traj True, without imputing them
+    again.
+
+    Args:
+        trajectory_folder: str, the trajectory folder in the output
+            folder of gps_stats_main()
+        output_folder: str, the path of the folder
+            where you want to save results
+        parameters: Hyperparameters, only trajectories imputed with these
+            hyperparameters are summarized, all of them if None
+        participant_ids: a list of beiwe IDs, all the participants with
+            a trajectory if None
+        tz_str, frequency, places_of_interest, save_log, threshold,
+            split_day_night, person_point_radius, place_point_radius,
+            n_jobs, output_format, batch_size: as in gps_stats_main()
+    Returns:
+        write summary stats as csv or Parquet for each user
+        and a log of all locations visited as a json file for each user
+            if required
+        and a run report csv file to show which users are processed,
+            or failed with which error
+    """
+
+    if output_format == OutputFormat.PARQUET:
+        require_pyarrow()
+    os.makedirs(output_folder, exist_ok=True)
+
+    if participant_ids is None:
+        participant_ids = sorted({
+            os.path.splitext(filename)[0]
+            for filename in os.listdir(trajectory_folder)
+            if filename.endswith((".csv", ".parquet"))
+        })
+
+    if frequency == Frequency.BOTH:
+        os.makedirs(f"{output_folder}/hourly", exist_ok=True)
+        os.makedirs(f"{output_folder}/daily", exist_ok=True)
+    if save_log:
+        os.makedirs(f"{output_folder}/logs", exist_ok=True)
+
+    report: List[dict] = []
+
+    # trajectories are loaded one by one as the summaries need them
+    def saved_trajectories() -> Iterator[Tuple[str, np.ndarray]]:
+        for participant_id in participant_ids:
+            try:
+                records = load_saved_trajectory(
+                    trajectory_folder, participant_id, parameters
                 )
-                if save_log:
-                    os.makedirs(f"{output_folder}/logs", exist_ok=True)
-                    with open(
-                        f"{output_folder}/logs/locations_logs.json",
-                        "w",
-                    ) as loc:
-                        json.dump(logs, loc, indent=4)
+            except Exception as exception:
+                report_failure(report, participant_id, exception, "loading")
+                continue
+            yield participant_id, records
+
+    summary_args = (
+        output_folder, tz_str, frequency, places_of_interest, save_log,
+        threshold, split_day_night, person_point_radius, place_point_radius,
+    )
+    for participant_id, error, stage in summarize_participants(
+        saved_trajectories(), summary_args,
+        places_of_interest is not None or save_log, n_jobs,
+        output_format=output_format, batch_size=batch_size,
+    ):
+        if error is not None:
+            report_failure(report, participant_id, error, stage)
         else:
-            sys.stdout.write("GPS data are not collected"
-                             " or the data quality is too low\n")
+            report.append({"participant_id": participant_id,
+                           "status": "processed", "stage": "",
+                           "error": ""})
+
+    pd.DataFrame(
+        report, columns=["participant_id", "status", "stage", "error"]
+    ).to_csv(f"{output_folder}/run_report.csv", index=False)
@@ -41,7 +41,8 @@ def get_windows(df, start, end, window_length_ms):
     Generate evenly spaced windows over a time period.  For each window, 
     figure out which rows of a data frame were observed during the window.
     Usually df contains an hour of raw sensor data, and start/end are the 
-    beginning/ending timestamps for that hour.
+    beginning/ending timestamps for that hour.  Rows are assigned to
+    windows at once with get_window_offsets().
 
     Args:
         df (pandas.DataFrame): A pandas dataframe with a 'timestamp' column.
@@ -62,16 +63,52 @@ def get_windows(df, start, end, window_length_ms):
                        evenly divide the interval.')
     else:
         try:
-            windows = OrderedDict.fromkeys(np.arange(start, end, window_length_ms))
-            for i in range(len(df)):
-                key = df.timestamp[i] - (df.timestamp[i] % window_length_ms)
-                if windows[key] is None:
-                    windows[key] = [i]
-                else:
-                    windows[key].append(i)
+            order, offsets = get_window_offsets(np.asarray(df.timestamp), 
+                                                start, end, 
+                                                window_length_ms)
+            windows = OrderedDict()
+            for i, key in enumerate(np.arange(start, end, window_length_ms)):
+                rows = order[offsets[i]:offsets[i+1]]
+                windows[key] = rows.tolist() if len(rows) > 0 else None
             return(windows)
         except:
             logger.warning('Unable to identify windows.')
+
+
+def get_window_offsets(timestamps, start, end, window_length_ms):
+    '''
+    Assign timestamps to evenly spaced windows over a time period, in a 
+    single pass.  The rows of window i are order[offsets[i]:offsets[i+1]], 
+    as in a compressed sparse row (CSR) matrix.
+
+    Args:
+        timestamps (numpy.ndarray):  Millisecond timestamps, e.g. the 
+            'timestamp' column of a dataframe of raw sensor data.
+        start (int):  Millisecond timestamp for the beginning of the time 
+            period.  Must be before the first timestamp, and a multiple of 
+            window_length_ms.
+        end (int):  Millisecond timestamp for the end of the time period.
+            Must be after the last timestamp.
+        window_length_ms (int):  Length of window, e.g. use 60*1000 for 
+            1-minute windows.
+
+    Returns:
+        order (numpy.ndarray):  Row indices sorted by window, in their 
+            original order within each window.
+        offsets (numpy.ndarray):  Position in order of the first row of 
+            each window, followed by the number of rows.
+    '''
+    keys = timestamps - (timestamps % window_length_ms)
+    windows = (keys - start) // window_length_ms
+    n_windows = len(range(start, end, window_length_ms))
+    if ((keys - start) % window_length_ms != 0).any() or \
+            (windows < 0).any() or (windows >= n_windows).any():
+        raise ValueError('Timestamps outside of the windows.')
+    windows = windows.astype(int)
+    order = np.argsort(windows, kind = 'stable')
+    counts = np.bincount(windows, minlength = n_windows)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return(order, offsets)
             
 
 def directory_size(dirpath, ndigits = 1):
@@ -2,10 +2,16 @@
 
 '''
 import os
+import gzip
 import json
-from collections import OrderedDict
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from logging import getLogger
 
+import pandas as pd
+
 
 logger = getLogger(__name__)
 
@@ -76,7 +82,132 @@ def read_json(filepath, ordered = False):
         logger.warning('Unable to read JSON file.')
 
 
-def setup_csv(name, dirpath, header):
+class CSVWriter:
+    '''
+    Writes lines to a csv file in batches, keeping the file open instead
+    of opening and closing it for each line.  Use as a context manager,
+    or call close() to write the remaining lines, which are otherwise
+    written when the writer is garbage collected or at exit:
+
+        with CSVWriter(filepath, header) as writer:
+            for line in lines:
+                writer.write(line)
+
+    Args:
+        filepath (str): Path to the csv file.
+        header (list):  Optionally, list of column headers (str).  If
+            given, the file is overwritten and starts with the header.
+            Otherwise lines are appended to the file.
+        flush_size (int): Number of lines kept in memory before they are
+            written to the file.
+        missing_strings (list): List of strings to replace with ''.  Note
+            that 'nan' covers both float('NaN') and np.nan.
+        compress (bool): Compress the file with gzip.  If None, the file
+            is compressed if filepath ends with '.gz'.
+    '''
+    def __init__(self, filepath, header = None, flush_size = 1000,
+                 missing_strings = ['nan'], compress = None):
+        if compress is None:
+            compress = filepath.endswith('.gz')
+        mode = 'a' if header is None else 'w'
+        if compress:
+            self.file = gzip.open(filepath, mode + 't')
+        else:
+            self.file = open(filepath, mode)
+        self.filepath = filepath
+        self.flush_size = flush_size
+        self.missing_strings = missing_strings
+        self.buffer = []
+        if header is not None:
+            self.buffer.append(','.join(header) + '\n')
+        # the remaining lines are written if the writer is not closed,
+        # when it is garbage collected or when the interpreter exits
+        self._finalizer = weakref.finalize(self, _close_csv, self.file,
+                                           self.buffer)
+
+    def format_line(self, line):
+        '''
+        Formats a line of the csv.
+
+        Args:
+            line (list): Line items, converted to strings and joined with
+                ','.  None and missing strings are replaced with ''.
+
+        Returns:
+            text (str): The line, terminated with '\n'.
+        '''
+        # Replace None with ''
+        line = ['' if i is None else i for i in line]
+        # Make sure everything is a string
+        line = [str(i) for i in line]
+        # Replace missing values with ''
+        line = ['' if i in self.missing_strings else i for i in line]
+        return(','.join(line) + '\n')
+
+    def write(self, line):
+        '''
+        Adds a line to the csv, written once flush_size lines are waiting.
+
+        Args:
+            line (list): Line items, see format_line().
+
+        Returns:
+            None
+        '''
+        self.buffer.append(self.format_line(line))
+        if len(self.buffer) >= self.flush_size:
+            self.write_buffer()
+
+    def write_buffer(self):
+        '''
+        Writes the waiting lines with a single call.
+        '''
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.buffer.clear()
+
+    def flush(self):
+        '''
+        Writes the waiting lines to the file, and flushes the file.
+        '''
+        self.write_buffer()
+        self.file.flush()
+
+    def close(self):
+        '''
+        Writes the waiting lines and closes the file.
+        '''
+        self._finalizer()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _close_csv(file, buffer):
+    '''
+    Writes the lines waiting in the buffer of a CSVWriter and closes its
+    file, once.
+
+    Args:
+        file (file object): The file of the writer.
+        buffer (list): The lines waiting, as strings.
+
+    Returns:
+        None
+    '''
+    if not file.closed:
+        try:
+            if buffer:
+                file.write(''.join(buffer))
+                buffer.clear()
+        finally:
+            file.close()
+
+
+def setup_csv(name, dirpath, header, compress = False):
     '''
     Creates a csv file with the given column labels.
     Overwrites a file with the same name.
@@ -85,25 +216,27 @@ def setup_csv(name, dirpath, header):
         name (str):  Name of csv file to create, without extension.
         dirpath (str):  Path to location for csv file.
         header (list):  List of column headers (str).
+        compress (bool):  Compress the file with gzip, with extension
+            '.csv.gz' instead of '.csv'.
     
     Returns:
         filepath (str): Path to the new csv file.
     '''
-    filepath = os.path.join(dirpath, name + '.csv')
+    filepath = os.path.join(dirpath, name + ('.csv.gz' if compress else '.csv'))
     if os.path.exists(filepath):
         logger.warning('Overwriting existing file with that name.')
-    f = open(filepath, 'w')
-    f.write(','.join(header) + '\n')
-    f.close()
+    CSVWriter(filepath, header).close()
     return(filepath)    
 
 
 def write_to_csv(filepath, line, missing_strings = ['nan']):
     '''
-    Writes line to a csv file.
+    Writes line to a csv file.  To write many lines, CSVWriter is faster
+    since the file is opened once.
 
     Args:
-        filepath (str): Path to a text file.
+        filepath (str): Path to a text file, compressed with gzip if it 
+            ends with '.gz'.
         line (list): Line of items to add to the csv.  Line items are 
             converted to strings, joined with ',' and terminated with '\n'.
         missing_strings (list): List of strings to replace with ''.  Note that 
@@ -113,15 +246,57 @@ def write_to_csv(filepath, line, missing_strings = ['nan']):
         None
     '''
     try:
-        # Replace None with ''
-        line = ['' if i is None else i for i in line]
-        # Make sure everything is a string
-        line = [str(i) for i in line]
-        # Replace missing values with ''
-        line = ['' if i in missing_strings else i for i in line]
-        # Write to file
-        f = open(filepath, "a")
-        f.write(','.join(line) + "\n")
-        f.close()
+        with CSVWriter(filepath, missing_strings = missing_strings) as writer:
+            writer.write(line)
     except:
-        logger.warning('Unable to append line to CSV.')
\ No newline at end of file
+        logger.warning('Unable to append line to CSV.')
+
+
+def map_files(function, paths, n_threads = 8, max_pending = None):
+    '''
+    Applies a function to files in a thread pool, so that the latency of
+    opening and reading many small files overlaps, and yields the results
+    in the order of the paths.
+
+    Args:
+        function (callable): Called as function(path) for each path.
+        paths (iterable): Paths (str) of the files.
+        n_threads (int): Number of files read at the same time.  
+            With 1, files are read one by one in this thread.
+        max_pending (int): Maximum number of files read ahead of the 
+            results consumed, 2 * n_threads if None.
+
+    Returns:
+        results (iterator): function(path) for each path, in order.
+    '''
+    if n_threads <= 1:
+        for path in paths:
+            yield function(path)
+        return
+    if max_pending is None:
+        max_pending = 2 * n_threads
+    with ThreadPoolExecutor(max_workers = n_threads) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(function, path))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_csv_files(paths, n_threads = 8, **kwargs):
+    '''
+    Reads csv files in a thread pool.
+
+    Args:
+        paths (iterable): Paths (str) of the csv files, or file-like 
+            objects.
+        n_threads (int): Number of files read at the same time.
+        **kwargs: Keyword arguments of pandas.read_csv().
+
+    Returns:
+        data (iterator): A DataFrame for each path, in order.
+    '''
+    return map_files(partial(pd.read_csv, **kwargs), paths, n_threads)
+
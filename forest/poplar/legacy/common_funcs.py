@@ -1,10 +1,106 @@
+import io
+import json
 import os
+import re
 import sys
+import time
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
 from pytz import timezone
 import calendar
+import operator
+from forest.constants import RAW_CACHE_DIR
+from forest.poplar.functions.io import map_files
+from forest.poplar.legacy.raw_cache import read_cached
+
+## column types of the datastreams, so that pandas does not infer them for every file
+DATASTREAM_DTYPES = {
+    "gps": {"timestamp": np.int64, "UTC time": str, "latitude": np.float64,
+            "longitude": np.float64, "altitude": np.float64, "accuracy": np.float64},
+}
+## filenames of Beiwe, 'YYYY-MM-DD HH_MM_SS.csv' in UTC
+FILENAME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}_")
+## folders of a participant whose files are not named by hour
+NON_HOURLY_STREAMS = ["survey_answers","survey_timings","audio_recordings"]
+## the manifest of the files of a participant, saved in the cache folder of read_data() if any
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 3
+## folders modified less than this many seconds before they are listed are listed again at the next
+## call, since files added within the same tick of the clock leave their modification time unchanged
+MANIFEST_MIN_AGE = 2
+## number of manifests kept in memory, the least recently used are dropped first
+MANIFEST_CACHE_SIZE = 16
+## manifests already built in this process, by participant folder
+_manifests: OrderedDict = OrderedDict()
+## comparisons allowed in the filters of read_data()
+FILTER_OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+                    "==": operator.eq, "!=": operator.ne}
+## files larger than this are parsed and filtered by chunks of CHUNK_ROWS rows,
+## so that they are never fully in memory
+CHUNK_MIN_BYTES = 64 * 1024 ** 2
+CHUNK_ROWS = 100000
+## times which do not exist locally are looked up this long before, as pytz does
+NONEXISTENT_SHIFT = 6 * 3600
+
+@lru_cache(maxsize=None)
+def timezone_table(tz_str):
+    """
+    Docstring
+    Args: tz_str: timezone (str)
+    Return: a tuple of lists, the UTC times (Unix time) at which the offset of the timezone changes,
+            the offset (seconds) from then on, and whether it is daylight saving time;
+            built once per timezone from the transitions of pytz
+    """
+    loc_tz = timezone(tz_str)
+    if not hasattr(loc_tz, "_utc_transition_times"):
+        ## UTC and timezones with a fixed offset
+        return [calendar.timegm(datetime.min.timetuple())], [int(loc_tz.utcoffset(None).total_seconds())], [False]
+    transitions = [calendar.timegm(time.timetuple()) for time in loc_tz._utc_transition_times]
+    offsets = [int(info[0].total_seconds()) for info in loc_tz._transition_info]
+    dst = [bool(info[1]) for info in loc_tz._transition_info]
+    return transitions, offsets, dst
+
+@lru_cache(maxsize=None)
+def timezone_arrays(tz_str):
+    """
+    Docstring
+    Args: tz_str: timezone (str)
+    Return: the lists of timezone_table() as numpy arrays, for the conversion of arrays
+    """
+    transitions, offsets, dst = timezone_table(tz_str)
+    return np.array(transitions, dtype=np.int64), np.array(offsets, dtype=np.int64), np.array(dst, dtype=bool)
+
+def local2stamp(local, tz_str):
+    """
+    Docstring
+    Args: local: the local time of the timezone, in seconds since 1970-01-01 00:00:00
+          tz_str: timezone (str)
+    Return: Unix time, with the same semantics as pytz localize(is_dst=False):
+            ambiguous times are standard time, and times skipped at the start of
+            daylight saving time take the offset from before the change
+    """
+    transitions, offsets, dst = timezone_table(tz_str)
+    shift = 0
+    while True:
+        ## the offsets one day before and after are the only possible ones
+        candidates = {}
+        for delta in (-86400, 86400):
+            stamp = local - offsets[max(0, bisect_right(transitions, local + delta) - 1)]
+            index = max(0, bisect_right(transitions, stamp) - 1)
+            if stamp + offsets[index] == local:
+                candidates[stamp] = dst[index]
+        if len(candidates) > 0:
+            break
+        local -= NONEXISTENT_SHIFT
+        shift += NONEXISTENT_SHIFT
+    standard = [stamp for stamp in candidates if not candidates[stamp]]
+    if len(candidates) == 2 and len(standard) == 1:
+        return standard[0] + shift
+    return max(candidates) + shift
 
 def datetime2stamp(time_list,tz_str):
     """
@@ -17,11 +113,8 @@ def datetime2stamp(time_list,tz_str):
     to check all timezones
     Return: Unix time, which is what Beiwe uses
     """
-    loc_tz =  timezone(tz_str)
-    loc_dt = loc_tz.localize(datetime(time_list[0], time_list[1], time_list[2], time_list[3], time_list[4], time_list[5]))
-    utc = timezone("UTC")
-    utc_dt = loc_dt.astimezone(utc)
-    timestamp = calendar.timegm(utc_dt.timetuple())
+    loc_dt = datetime(time_list[0], time_list[1], time_list[2], time_list[3], time_list[4], time_list[5])
+    timestamp = local2stamp(calendar.timegm(loc_dt.timetuple()), tz_str)
     return timestamp
 
 def stamp2datetime(stamp,tz_str):
@@ -35,10 +128,10 @@ def stamp2datetime(stamp,tz_str):
     to check all timezones
     Return: a list of integers [year, month, day, hour (0-23), min, sec] in the specified tz
     """
-    loc_tz =  timezone(tz_str)
-    utc = timezone("UTC")
-    utc_dt = utc.localize(datetime.utcfromtimestamp(stamp))
-    loc_dt = utc_dt.astimezone(loc_tz)
+    transitions, offsets, _ = timezone_table(tz_str)
+    utc_dt = datetime.utcfromtimestamp(stamp)
+    index = max(0, bisect_right(transitions, calendar.timegm(utc_dt.timetuple())) - 1)
+    loc_dt = utc_dt + timedelta(seconds=offsets[index])
     return [loc_dt.year, loc_dt.month,loc_dt.day,loc_dt.hour,loc_dt.minute,loc_dt.second]
 
 def filename2stamp(filename):
@@ -53,7 +146,245 @@ def filename2stamp(filename):
     stamp = datetime2stamp((y,m,d,h,0,0),'UTC')
     return stamp
 
-def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start, time_end):
+def scan_stream(folder_path, cached = None):
+    """
+    Docstring
+    Args: folder_path: the path of the folder of a datastream
+          cached: optionally, a previous scan of the folder, returned as is if the folder was not modified
+          since, or if the names of its files did not change
+    Return: a dict with the names of the files named by hour ("files") and their UNIX time ("stamps"),
+            sorted by time, and the modification time of the folder in ns ("mtime_ns"), None if too recent
+            to tell whether files were added since, see MANIFEST_MIN_AGE
+            files whose name is not an hour, e.g. hidden files, are left out
+    The files are not looked up one by one: files are added or removed by hour, which modifies the folder
+    """
+    mtime_ns = os.stat(folder_path).st_mtime_ns
+    if cached is not None and cached["mtime_ns"] is not None and cached["mtime_ns"] == mtime_ns:
+        return cached
+    if time.time_ns() - mtime_ns < MANIFEST_MIN_AGE * 10 ** 9:
+        mtime_ns = None
+    names = [name for name in os.listdir(folder_path) if FILENAME_PATTERN.match(name) is not None]
+    if cached is not None and len(cached["files"]) == len(names) and set(cached["files"].tolist()) == set(names):
+        if cached["mtime_ns"] == mtime_ns:
+            return cached
+        return dict(cached, mtime_ns=mtime_ns)
+    files = np.array(names, dtype=str)
+    stamps = filenames2stamps(files)
+    order = np.lexsort((files, stamps))
+    return {"files": files[order], "stamps": stamps[order], "mtime_ns": mtime_ns}
+
+def manifest_path(cache_folder, ID):
+    """
+    Docstring
+    Args: cache_folder: the folder of the cache of read_data(); ID: beiwe ID
+    Return: the path of the saved manifest of the participant
+    """
+    return cache_folder + "/" + ID + "/" + MANIFEST_NAME
+
+def load_manifest(path):
+    """
+    Docstring
+    Args: path: the path of a saved manifest, see manifest_path()
+    Return: the manifest, as returned by participant_manifest(),
+            an empty dict if there is none or if it cannot be read
+    """
+    try:
+        with open(path, "r") as f:
+            saved = json.load(f)
+        if saved.get("version") != MANIFEST_VERSION:
+            return {}
+        manifest = {}
+        for datastream, stream in saved["streams"].items():
+            manifest[datastream] = {"files": np.array(stream["files"], dtype=str),
+                                    "stamps": np.array(stream["stamps"], dtype=np.int64),
+                                    "mtime_ns": stream["mtime_ns"]}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+    return manifest
+
+def save_manifest(path, manifest):
+    """
+    Docstring
+    Args: path: the path of the saved manifest, see manifest_path()
+          manifest: as returned by participant_manifest()
+    Saves the manifest, replacing the previous one at once; nothing is saved if the folder is read-only
+    """
+    streams = {}
+    for datastream, stream in manifest.items():
+        streams[datastream] = {"files": stream["files"].tolist(),
+                               "stamps": stream["stamps"].tolist(),
+                               "mtime_ns": stream["mtime_ns"]}
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "streams": streams}, f)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def participant_manifest(study_folder: str, ID: str, cache_folder = None):
+    """
+    Docstring
+    Args: study_folder: the path of the folder which contains all the users; ID: beiwe ID
+          cache_folder: the folder of the cache of read_data(), where the manifest is saved;
+          FOREST_RAW_CACHE_DIR if None, only kept in memory if empty
+    Return: a dict of datastream -> dict of the files named by hour, as returned by scan_stream(),
+            for each folder of the participant except the NON_HOURLY_STREAMS
+    The manifest is kept in memory for the MANIFEST_CACHE_SIZE participants used last, and saved in the
+    cache folder, never in the folder of the participant; the folder of the participant is listed at
+    every call, and the folder of a datastream only once modified, see scan_stream()
+    """
+    if cache_folder is None:
+        cache_folder = RAW_CACHE_DIR
+    participant_path = study_folder + "/" + ID
+    path = manifest_path(cache_folder, ID) if cache_folder else None
+    cached = _manifests.get(participant_path)
+    if cached is None:
+        cached = load_manifest(path) if path is not None else {}
+    manifest = {}
+    with os.scandir(participant_path) as it:
+        for entry in it:
+            if not entry.is_dir() or entry.name in NON_HOURLY_STREAMS:
+                continue
+            manifest[entry.name] = scan_stream(entry.path, cached.get(entry.name))
+    changed = set(manifest) != set(cached) or any(manifest[name] is not cached[name] for name in manifest)
+    if not changed:
+        manifest = cached
+    elif path is not None:
+        save_manifest(path, manifest)
+    _manifests[participant_path] = manifest
+    _manifests.move_to_end(participant_path)
+    while len(_manifests) > MANIFEST_CACHE_SIZE:
+        _manifests.popitem(last=False)
+    return manifest
+
+def datetimes2stamps(time_array, tz_str):
+    """
+    Docstring
+    Args: time_array: a 2d array of integers, one row [year, month, day, hour (0-23), min, sec] per time,
+          tz_str: timezone (str), where the study is conducted
+    Return: a numpy array of Unix time (int64), as datetime2stamp() of each row
+    """
+    time_array = np.asarray(time_array, dtype=np.int64).reshape(-1, 6)
+    [year, month, day, hour, minute, second] = time_array.T
+    days = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + day - 1
+    local = days * 86400 + hour * 3600 + minute * 60 + second
+    if not (seconds2datetimes(local) == time_array).all():
+        raise ValueError("time_array contains dates or times which do not exist")
+    transitions, offsets, dst = timezone_arrays(tz_str)
+    ## same steps as local2stamp() for all times at once
+    stamps = np.empty(len(local), dtype=np.int64)
+    shift = np.zeros(len(local), dtype=np.int64)
+    todo = np.arange(len(local))
+    while len(todo) > 0:
+        local_todo = local[todo] - shift[todo]
+        candidates = []
+        for delta in (-86400, 86400):
+            stamp = local_todo - offsets[np.maximum(np.searchsorted(transitions, local_todo + delta, side="right") - 1, 0)]
+            index = np.maximum(np.searchsorted(transitions, stamp, side="right") - 1, 0)
+            candidates.append((stamp, stamp + offsets[index] == local_todo, dst[index]))
+        [(stamp0, valid0, dst0), (stamp1, valid1, dst1)] = candidates
+        two = valid0 & valid1 & (stamp0 != stamp1)
+        ## of two candidates, the one in standard time, or else the latest
+        chosen = np.where(two, np.where(dst0 != dst1, np.where(dst0, stamp1, stamp0), np.maximum(stamp0, stamp1)),
+                          np.where(valid0, stamp0, stamp1))
+        found = valid0 | valid1
+        stamps[todo[found]] = chosen[found] + shift[todo[found]]
+        todo = todo[~found]
+        shift[todo] += NONEXISTENT_SHIFT
+    return stamps
+
+def stamps2datetimes(stamps, tz_str):
+    """
+    Docstring
+    Args: stamps: an array of Unix time, the timestamps in Beiwe
+          tz_str: timezone (str), where the study is conducted
+    Return: a 2d numpy array of integers, one row [year, month, day, hour (0-23), min, sec] per stamp
+            in the specified tz, as stamp2datetime() of each stamp
+    """
+    ## whole seconds after rounding to microseconds, like datetime.utcfromtimestamp()
+    [fraction, seconds] = np.modf(np.asarray(stamps, dtype=np.float64).reshape(-1))
+    micros = np.round(fraction * 1e6)
+    seconds = seconds.astype(np.int64) + (micros >= 1e6) - (micros < 0)
+    transitions, offsets, _ = timezone_arrays(tz_str)
+    index = np.maximum(np.searchsorted(transitions, seconds, side="right") - 1, 0)
+    return seconds2datetimes(seconds + offsets[index])
+
+def seconds2datetimes(seconds):
+    """
+    Docstring
+    Args: seconds: an array of times in seconds since 1970-01-01 00:00:00
+    Return: a 2d numpy array of integers, one row [year, month, day, hour (0-23), min, sec] per time
+    """
+    time = np.asarray(seconds, dtype=np.int64).astype("datetime64[s]")
+    years = time.astype("datetime64[Y]")
+    months = time.astype("datetime64[M]")
+    days = time.astype("datetime64[D]")
+    seconds_of_day = (time - days).astype(np.int64)
+    return np.column_stack([years.astype(np.int64) + 1970, (months - years).astype(np.int64) + 1,
+                            (days - months).astype(np.int64) + 1, seconds_of_day // 3600,
+                            seconds_of_day % 3600 // 60, seconds_of_day % 60])
+
+def filenames2stamps(filenames):
+    """
+    Docstring
+    Args: filenames: an array of filenames of communication logs, 'YYYY-MM-DD HH_MM_SS.csv'
+    Return: a numpy array of UNIX time (int64), as filename2stamp() of each filename
+    """
+    ## 'YYYY-MM-DD HH' is parsed at once as an hour of numpy
+    hours = np.char.replace(np.asarray(filenames, dtype=str).astype("<U13"), " ", "T")
+    return hours.astype("datetime64[h]").astype(np.int64) * 3600
+
+def check_filters(filters):
+    """
+    Docstring
+    Args: filters: a list of (column, operator, value), e.g. ("accuracy", "<", 51), or None
+    Return: the filters as a list, raising a ValueError if one is not a triple or if its operator is not
+            among FILTER_OPERATORS
+    """
+    filters = list(filters or [])
+    for row_filter in filters:
+        if len(row_filter) != 3 or row_filter[1] not in FILTER_OPERATORS:
+            raise ValueError("Invalid filter " + repr(row_filter) + ", expected (column, operator, value)"
+                             + " with operator among " + ", ".join(FILTER_OPERATORS))
+    return filters
+
+def select_columns(data, columns):
+    """
+    Docstring
+    Args: data: a pd dataframe; columns: a list of columns
+    Return: the columns of data in this order, raising a ValueError if some are not in data
+    """
+    missing = [column for column in columns if column not in data.columns]
+    if len(missing) > 0:
+        raise ValueError("Unknown columns " + ", ".join(map(str, missing)) + ", the columns are "
+                         + ", ".join(map(str, data.columns)))
+    if list(data.columns) == list(columns):
+        return data
+    return data[columns]
+
+def filter_rows(data, filters):
+    """
+    Docstring
+    Args: data: a pd dataframe; filters: a list of (column, operator, value), e.g. ("accuracy", "<", 51),
+          with operator among FILTER_OPERATORS, see check_filters()
+    Return: the rows of data meeting all the filters, raising a ValueError if a column is not in data
+    """
+    missing = [column for column, _, _ in filters if column not in data.columns]
+    if len(missing) > 0:
+        raise ValueError("Unknown columns in the filters " + ", ".join(map(str, missing)) + ", the columns are "
+                         + ", ".join(map(str, data.columns)))
+    keep = np.ones(data.shape[0], dtype=bool)
+    for column, op, value in filters:
+        keep &= np.asarray(FILTER_OPERATORS[op](data[column], value))
+    if keep.all():
+        return data
+    return data[keep].reset_index(drop=True)
+
+def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start, time_end, file_contents = None, n_threads = 8,
+              cache_folder = None, columns = None, filters = None, trim_rows = False):
     """
     Docstring
     Args: ID: beiwe ID; study_folder: the path of the folder which contains all the users
@@ -67,12 +398,27 @@ def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start
           if identifiers files are present and the earliest identifiers registration timestamp occurred
             after the provided time_start (or if time_start is None) then that identifier timestamp
             will be used instead.
+          file_contents: optional dict of filename -> bytes of files already read (e.g. by a quality check),
+            which are parsed from memory instead of being opened again
+          n_threads: number of files read at the same time
+          cache_folder: folder of a binary cache of the parsed files (requires pyarrow), where the files of
+            each day are saved once parsed and memory-mapped by later calls, as long as they do not change,
+            and where the manifest of the files of the participant is saved, see participant_manifest();
+            FOREST_RAW_CACHE_DIR if None, no cache if empty
+          columns: the list of columns to read, in this order, all if None
+          filters: a list of (column, operator, value), e.g. [("accuracy", "<", 51)], only the rows meeting
+            all of them are kept, as soon as they are parsed; operators are <, <=, >, >=, == and !=,
+            and the columns need not be among columns
+          trim_rows: if True, only the rows whose timestamp is within [stamp_start, stamp_end) are kept,
+            instead of all the rows of the files of the hours in range
     return: a panda dataframe of the datastream (not for accelerometer data!) and corresponding starting/ending timestamp (UTC),
             you can convert it to numpy array as needed
             For accelerometer data, instead of a panda dataframe, it returns a list of filenames
             The reason is the volume of accelerometer data is too large, we need to process it on the fly:
             read one csv file, process one, not wait until all the csv's are imported (that may be too large in memory!)
+            iter_stream() in forest.poplar.raw.readers does so by time windows
     """
+    row_filters = check_filters(filters)
     df = pd.DataFrame()
     stamp_start = 1e12
     stamp_end = 0
@@ -83,9 +429,13 @@ def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start
     elif not os.path.exists(folder_path):
         print('User '+ str(ID) + ' : ' + str(datastream) + ' data are not collected.')
     else:
-        filenames = np.sort(np.array(os.listdir(folder_path)))
-        ## create a list to convert all filenames to UNIX time
-        filestamps = np.array([filename2stamp(filename) for filename in filenames])
+        if cache_folder is None:
+            cache_folder = RAW_CACHE_DIR
+        ## filenames and their UNIX time, sorted, from the manifest of the participant
+        manifest = participant_manifest(study_folder, ID, cache_folder)
+        stream = manifest[datastream] if datastream in manifest else scan_stream(folder_path)
+        filenames = stream["files"]
+        filestamps = stream["stamps"]
         ## find the timestamp in the identifier (when the user was enrolled)
         if os.path.exists(study_folder + "/" + ID + "/identifiers"):
             identifier_Files = os.listdir(study_folder + "/" + ID + "/identifiers")
@@ -96,7 +446,7 @@ def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start
             else:
                 stamp_start1 = identifiers["timestamp"][0]/1000
         else:
-            stamp_start1 = sorted(filestamps)[0]
+            stamp_start1 = int(filestamps[0])
         ## now determine the starting and ending time according to the Docstring
         if time_start == None:
             stamp_start = stamp_start1
@@ -106,14 +456,7 @@ def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start
             # test conditions of the beiwe backend.)
             stamp_start = max(stamp_start1,stamp_start2)
         ##Last hour: look at all the subject's directories (except survey) and find the latest date for each directory
-        directories = os.listdir(study_folder + "/" + ID)
-        directories = list(set(directories)-set(["survey_answers","survey_timings","audio_recordings"]))
-        all_timestamps = []
-        for i in directories:
-            files = os.listdir(study_folder + "/" + ID + "/" + i)
-            all_timestamps += [filename2stamp(filename) for filename in files]
-        ordered_timestamps = sorted([timestamp for timestamp in all_timestamps if timestamp is not None])
-        stamp_end1 = ordered_timestamps[-1]
+        stamp_end1 = max(int(stream["stamps"][-1]) for stream in manifest.values() if len(stream["stamps"]) > 0)
         if time_end == None:
             stamp_end = stamp_end1
         else:
@@ -121,19 +464,49 @@ def read_data(ID:str, study_folder: str, datastream:str, tz_str: str, time_start
             stamp_end = min(stamp_end1,stamp_end2)
 
         ## extract the filenames in range
-        files_in_range = filenames[(filestamps>=stamp_start)*(filestamps<stamp_end)]
+        first, last = np.searchsorted(filestamps, stamp_start), np.searchsorted(filestamps, stamp_end)
+        files_in_range = filenames[first:last]
         if len(files_in_range) == 0:
             sys.stdout.write('User '+ str(ID) + ' : There are no ' + str(datastream) + ' data in range.'+ '\n')
         else:
             if datastream!='accelerometer':
-                ## read in the data one by one file and stack them
-                for data_file in files_in_range:
-                    dest_path = folder_path + "/" + data_file
-                    hour_data = pd.read_csv(dest_path)
-                    if df.shape[0]==0:
-                        df = hour_data
-                    else:
-                        df = df.append(hour_data,ignore_index=True)
+                ## read in the data one by one file and stack them once at the end
+                dtype = DATASTREAM_DTYPES.get(datastream)
+                if trim_rows:
+                    row_filters += [("timestamp", ">=", stamp_start*1000), ("timestamp", "<", stamp_end*1000)]
+                ## the columns parsed, with those of the filters, which are dropped once the rows are filtered
+                usecols = None
+                if columns is not None:
+                    usecols = list(columns) + [column for column, _, _ in row_filters if column not in columns]
+                def parse_hour(data_file, usecols = None, predicates = ()):
+                    source = folder_path + "/" + data_file
+                    if file_contents is not None and data_file in file_contents:
+                        source = io.BytesIO(file_contents[data_file])
+                    ## missing columns are reported by select_columns(), as for the files read from the cache
+                    read_cols = None if usecols is None else usecols.__contains__
+                    if len(predicates) == 0:
+                        return pd.read_csv(source, dtype=dtype, usecols=read_cols)
+                    if isinstance(source, io.BytesIO) or os.path.getsize(source) < CHUNK_MIN_BYTES:
+                        return filter_rows(pd.read_csv(source, dtype=dtype, usecols=read_cols), predicates)
+                    ## the rows of large files are filtered chunk by chunk while they are parsed
+                    chunks = [filter_rows(chunk, predicates)
+                              for chunk in pd.read_csv(source, dtype=dtype, usecols=read_cols, chunksize=CHUNK_ROWS)]
+                    if len(chunks) == 1:
+                        return chunks[0]
+                    return pd.concat(chunks, ignore_index=True)
+                if cache_folder:
+                    ## the cache keeps whole files, which are filtered once read
+                    hourly_data = read_cached(cache_folder, study_folder, ID, datastream, stream, first, last, parse_hour, n_threads)
+                    if len(row_filters) > 0:
+                        hourly_data = [filter_rows(hour_data, row_filters) for hour_data in hourly_data]
+                else:
+                    hourly_data = list(map_files(partial(parse_hour, usecols=usecols, predicates=row_filters),
+                                                 files_in_range, n_threads))
+                if columns is not None:
+                    hourly_data = [select_columns(hour_data, columns) for hour_data in hourly_data]
+                ## empty files are skipped, unless they are all empty
+                non_empty = [hour_data for hour_data in hourly_data if hour_data.shape[0]>0]
+                df = pd.concat(non_empty or hourly_data[-1:], ignore_index=True)
     
     if datastream == "accelerometer":
         return files_in_range, stamp_start, stamp_end
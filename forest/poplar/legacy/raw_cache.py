@@ -0,0 +1,156 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from forest.poplar.functions.io import map_files
+
+try:
+    import pyarrow as pa
+except ImportError:  ## optional, pip install forest[parquet]
+    pa = None
+
+## metadata of the cached files, identifying the csv files they were parsed from
+CACHE_KEY = b"forest_files"
+
+def day_cache_path(cache_folder, ID, datastream, day):
+    """
+    Docstring
+    Args: cache_folder: the folder of the cache; ID: beiwe ID; datastream: e.g. 'gps'
+          day: the UTC day of the files, in days since 1970-01-01
+    Return: the path of the Arrow file of the day
+    """
+    date = str(np.datetime64(int(day), "D"))
+    return cache_folder + "/" + ID + "/" + datastream + "/" + date + ".arrow"
+
+def day_cache_key(folder_path, filenames):
+    """
+    Docstring
+    Args: folder_path: the path of the folder of the datastream; filenames: the files of the day
+    Return: the names, sizes and modification times of the files, as a json string
+    The files are looked up again, since a file rewritten in place does not change its folder
+    """
+    key = []
+    for filename in filenames:
+        stat = os.stat(folder_path + "/" + filename)
+        key.append([str(filename), stat.st_size, stat.st_mtime_ns])
+    return json.dumps(key)
+
+def load_day(path, key):
+    """
+    Docstring
+    Args: path: the path of the Arrow file of the day; key: as returned by day_cache_key()
+    Return: a list of memory-mapped buffers, one Arrow stream per csv file of the day,
+            or None if there is no cached file for these csv files
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        if (reader.schema.metadata or {}).get(CACHE_KEY) != key.encode("utf-8"):
+            return None
+        segments = reader.read_all().column("data")
+        return [segment.as_buffer() for segment in segments]
+    except (OSError, ValueError, pa.ArrowException):
+        return None
+
+def save_day(path, key, hourly_data):
+    """
+    Docstring
+    Args: path: the path of the Arrow file of the day; key: as returned by day_cache_key()
+          hourly_data: a list of pd dataframes, one per csv file of the day
+    Each dataframe is saved as an Arrow stream with its own column types, in a row of the file;
+    nothing is saved if a column cannot be stored by Arrow, e.g. a column mixing numbers and strings
+    """
+    segments = []
+    try:
+        for hour_data in hourly_data:
+            table = pa.Table.from_pandas(hour_data, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            segments.append(sink.getvalue().to_pybytes())
+    except (pa.ArrowException, TypeError, ValueError):
+        return
+    day_table = pa.Table.from_arrays([pa.array(segments, type=pa.large_binary())], names=["data"])
+    day_table = day_table.replace_schema_metadata({CACHE_KEY: key.encode("utf-8")})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with pa.OSFile(temp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, day_table.schema) as writer:
+                writer.write_table(day_table)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def table_to_frame(table):
+    """
+    Docstring
+    Args: table: a table of the cache
+    Return: the pd dataframe, with missing values of text columns as nan like pd.read_csv()
+    """
+    data = table.to_pandas()
+    for column in data.columns[data.dtypes == object]:
+        data[column] = data[column].fillna(np.nan)
+    return data
+
+def segments_to_frames(segments):
+    """
+    Docstring
+    Args: segments: a list of buffers of the cache, the Arrow streams of csv files
+    Return: a list of pd dataframes, where consecutive files with the same columns and types
+            are converted at once, and empty files are kept on their own
+    """
+    tables = [pa.ipc.open_stream(segment).read_all() for segment in segments]
+    frames = []
+    group = []
+    for table in tables:
+        if group and (table.num_rows == 0 or not table.schema.equals(group[0].schema)):
+            frames.append(table_to_frame(pa.concat_tables(group)))
+            group = []
+        if table.num_rows == 0:
+            frames.append(table_to_frame(table))
+        else:
+            group.append(table)
+    if group:
+        frames.append(table_to_frame(pa.concat_tables(group)))
+    return frames
+
+def read_cached(cache_folder, study_folder, ID, datastream, stream, first, last, read_file, n_threads = 8):
+    """
+    Docstring
+    Args: cache_folder: the folder of the cache; study_folder: the path of the folder which contains all the users
+          ID: beiwe ID; datastream: e.g. 'gps'
+          stream: the files of the datastream, as returned by scan_stream()
+          first, last: the indices of the first file to read and of the first file after them
+          read_file: the function parsing a csv file, called with its name
+          n_threads: number of files parsed at the same time
+    Return: a list of pd dataframes of the files to read, in order, where the files read from
+            the cache with the same columns are in the same dataframe, see segments_to_frames()
+    The files of each UTC day are parsed once and saved in an Arrow file of the cache,
+    which is memory-mapped instead as long as the names, sizes and modification times
+    of the files of the day do not change
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for the cache of raw data, "
+                          "install it with pip install forest[parquet]")
+    stamps = stream["stamps"]
+    folder_path = study_folder + "/" + ID + "/" + datastream
+    hourly_data = []
+    for day in np.unique(stamps[first:last] // 86400):
+        day_first = np.searchsorted(stamps, day * 86400)
+        day_last = np.searchsorted(stamps, (day + 1) * 86400)
+        ## the files to read among the files of the day
+        first_in_day = max(first, day_first) - day_first
+        last_in_day = min(last, day_last) - day_first
+        path = day_cache_path(cache_folder, ID, datastream, day)
+        key = day_cache_key(folder_path, stream["files"][day_first:day_last])
+        segments = load_day(path, key)
+        if segments is not None:
+            hourly_data += segments_to_frames(segments[first_in_day:last_in_day])
+            continue
+        day_data = list(map_files(read_file, stream["files"][day_first:day_last], n_threads))
+        save_day(path, key, day_data)
+        hourly_data += day_data[first_in_day:last_in_day]
+    return hourly_data
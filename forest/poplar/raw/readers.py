@@ -1,3 +1,196 @@
 '''
-Functions for working with raw Beiwe GPS data.
+Functions for working with raw Beiwe data.
 '''
+import queue
+import threading
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+from ..legacy.common_funcs import (datetime2stamp, participant_manifest,
+                                   scan_stream)
+
+
+logger = getLogger(__name__)
+
+
+def read_ahead(iterable, size = 2):
+    '''
+    Iterates in a background thread, so that the next items are ready
+    while the current one is processed.
+
+    Args:
+        iterable (iterable): Items, e.g. from a generator reading files.
+        size (int): Maximum number of items read ahead of the consumer.
+
+    Returns:
+        items (iterator): The items of iterable, in order.  Errors raised
+            by iterable are raised again by the consumer.
+    '''
+    items = queue.Queue(maxsize = size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # gives up if the consumer stopped, instead of blocking forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as error:
+            put((done, error))
+
+    thread = threading.Thread(target = produce, daemon = True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def iter_stream(ID, study_folder, stream, window, time_start = None,
+                time_end = None, tz_str = 'UTC', columns = None,
+                prefetch = 2):
+    '''
+    Iterates over the raw data of a participant by time windows, reading
+    one hourly file at a time, so that memory is bounded by a file, the
+    files read ahead and a window of data.  Intended for high-volume
+    streams such as accelerometer, for which read_data() only returns
+    filenames.
+
+    The rows of a file are merged with those of the previous file from the
+    window of its first row, so that data overlapping the boundary of two
+    files are yielded in a single window.  Rows older than a window
+    already yielded are skipped with a warning.
+
+    Args:
+        ID (str): Beiwe ID.
+        study_folder (str): Path of the folder which contains all the
+            users.
+        stream (str): Name of the data stream, e.g. 'accelerometer'.
+        window (int): Length of the windows in seconds, e.g. 60.  Windows
+            start at multiples of window since 1970-01-01 UTC.
+        time_start, time_end (list): Optionally, [year, month, day, hour,
+            minute, second] in tz_str of the first time and of the time
+            after the last.  All data are read if None.
+        tz_str (str): Timezone of time_start and time_end.
+        columns (list): Columns to read, all if None.  The timestamps
+            are read in any case to find the windows.
+        prefetch (int): Number of files read ahead in a background thread.
+            With 0, files are read when needed.
+
+    Returns:
+        chunks (iterator): Tuples (start, data), where start is the
+            millisecond timestamp of the beginning of a window and data
+            is a dictionary of numpy arrays by column, with the rows
+            observed during the window, sorted by timestamp.  Windows
+            without data are skipped, and each window is yielded once.
+    '''
+    folder_path = study_folder + '/' + ID + '/' + stream
+    manifest = participant_manifest(study_folder, ID)
+    files = manifest[stream] if stream in manifest else scan_stream(folder_path)
+    stamp_start, stamp_end = -np.inf, np.inf
+    if time_start is not None:
+        stamp_start = datetime2stamp(time_start, tz_str)
+    if time_end is not None:
+        stamp_end = datetime2stamp(time_end, tz_str)
+    # files of the hours overlapping with the time range
+    first = np.searchsorted(files['stamps'], stamp_start - 3600, 'right')
+    last = np.searchsorted(files['stamps'], stamp_end, 'left')
+    window_ms = window * 1000
+    usecols = None
+    if columns is not None:
+        usecols = list(columns)
+        if 'timestamp' not in usecols:
+            usecols.append('timestamp')
+
+    def read_files():
+        for filename in files['files'][first:last]:
+            data = pd.read_csv(folder_path + '/' + filename, usecols = usecols)
+            timestamp = data['timestamp'].to_numpy()
+            keep = (timestamp >= stamp_start * 1000) & \
+                (timestamp < stamp_end * 1000)
+            if not keep.all():
+                data = data[keep]
+            yield data.sort_values('timestamp', kind = 'mergesort')
+
+    frames = read_files()
+    if prefetch > 0:
+        frames = read_ahead(frames, prefetch)
+    # sorted rows not yielded yet, from one or more files
+    pending = None
+    # index of the last window yielded
+    last_key = None
+    for data in frames:
+        if last_key is not None:
+            late = data['timestamp'].to_numpy() // window_ms <= last_key
+            if late.any():
+                logger.warning('%s: skipping %d %s rows older than the '
+                               'windows already read', ID, late.sum(),
+                               stream)
+                data = data[~late]
+        if len(data) == 0:
+            continue
+        if pending is not None:
+            # the windows before the first row of this file are complete
+            first_stamp = data['timestamp'].iat[0]
+            first_key = first_stamp // window_ms
+            keys = pending['timestamp'].to_numpy() // window_ms
+            split = np.searchsorted(keys, first_key, 'left')
+            for chunk in _window_chunks(pending.iloc[:split],
+                                        keys[:split], window_ms, columns):
+                last_key = chunk[0] // window_ms
+                yield chunk
+            if split < len(pending):
+                data = pd.concat([pending.iloc[split:], data])
+                if pending['timestamp'].iat[-1] > first_stamp:
+                    data = data.sort_values('timestamp', kind = 'mergesort')
+        pending = data
+    if pending is not None:
+        keys = pending['timestamp'].to_numpy() // window_ms
+        yield from _window_chunks(pending, keys, window_ms, columns)
+
+
+def _window_chunks(data, keys, window_ms, columns):
+    '''
+    Builds the chunks yielded by iter_stream().
+
+    Args:
+        data (DataFrame): Rows sorted by timestamp.
+        keys (array): Index of the window of each row.
+        window_ms (int): Length of the windows in milliseconds.
+        columns (list): Columns of the chunks, all if None.
+
+    Returns:
+        chunks (iterator): For each window with rows, the millisecond
+            timestamp of its beginning and a dictionary of numpy arrays
+            by column.
+    '''
+    if len(keys) == 0:
+        return
+    if columns is None:
+        columns = data.columns
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1,
+                             [len(keys)]])
+    for i in range(len(bounds) - 1):
+        rows = data.iloc[bounds[i]:bounds[i + 1]]
+        yield int(keys[bounds[i]] * window_ms), {column: rows[column].to_numpy()
+                                                 for column in columns}
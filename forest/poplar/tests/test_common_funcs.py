@@ -0,0 +1,328 @@
+"""Tests for the functions of poplar reading raw Beiwe data"""
+
+import calendar
+from collections import OrderedDict
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+from forest.poplar.legacy import common_funcs
+from forest.poplar.legacy.common_funcs import (FILTER_OPERATORS,
+                                               datetime2stamp,
+                                               datetimes2stamps,
+                                               manifest_path,
+                                               participant_manifest,
+                                               read_data, stamp2datetime,
+                                               stamps2datetimes)
+
+
+HEADER = "timestamp,UTC time,latitude,longitude,altitude,accuracy\n"
+
+
+def write_hour(folder, hour, rows=1):
+    """Writes the gps file of an hour of 2021-03-01, with a row a second"""
+    stamp = 1614556800 + hour * 3600
+    lines = [
+        f"{(stamp + i) * 1000},2021-03-01T{hour:02d}:00:{i:02d}.000,"
+        f"51.45,-2.59,10,{5 + i}\n"
+        for i in range(rows)
+    ]
+    path = folder / f"2021-03-01 {hour:02d}_00_00.csv"
+    path.write_text(HEADER + "".join(lines))
+    return path
+
+
+def age_folder(path, seconds=3600):
+    """Sets the modification time of a folder in the past"""
+    stamp = os.stat(path).st_mtime_ns - seconds * 10 ** 9
+    os.utime(path, ns=(stamp, stamp))
+
+
+@pytest.fixture(autouse=True)
+def manifests(monkeypatch):
+    """Manifests kept in memory by the tests only"""
+    cache = OrderedDict()
+    monkeypatch.setattr(common_funcs, "_manifests", cache)
+    return cache
+
+
+@pytest.fixture()
+def study(tmp_path):
+    """Study folder with a participant whose gps folder has 3 hours"""
+    gps = tmp_path / "study" / "user1" / "gps"
+    gps.mkdir(parents=True)
+    for hour in [2, 0, 1]:
+        write_hour(gps, hour)
+    (gps / ".DS_Store").write_text("")
+    (tmp_path / "study" / "user1" / "notes.txt").write_text("")
+    return tmp_path / "study"
+
+
+def test_participant_manifest_fresh_scan(study, tmp_path):
+    """Testing the files named by hour are sorted by time, and the manifest
+    is saved in the cache folder, not in the folder of the participant
+    """
+    before = sorted(os.listdir(study / "user1"))
+    cache_folder = str(tmp_path / "cache")
+    manifest = participant_manifest(str(study), "user1", cache_folder)
+    assert list(manifest) == ["gps"]
+    assert list(manifest["gps"]["files"]) == [
+        f"2021-03-01 0{hour}_00_00.csv" for hour in range(3)
+    ]
+    assert list(manifest["gps"]["stamps"]) == [
+        1614556800 + hour * 3600 for hour in range(3)
+    ]
+    assert sorted(os.listdir(study / "user1")) == before
+    with open(manifest_path(cache_folder, "user1")) as f:
+        saved = json.load(f)
+    assert saved["streams"]["gps"]["files"] == list(manifest["gps"]["files"])
+
+
+def test_participant_manifest_without_cache_folder(study, tmp_path):
+    """Testing no manifest is written without a cache folder"""
+    before = sorted(str(path) for path in tmp_path.rglob("*"))
+    manifest = participant_manifest(str(study), "user1", "")
+    assert participant_manifest(str(study), "user1", "") is manifest
+    assert sorted(str(path) for path in tmp_path.rglob("*")) == before
+
+
+@pytest.mark.parametrize("aged", [False, True])
+def test_participant_manifest_added_file(study, tmp_path, aged):
+    """Testing a file added after a scan is found, also right after it,
+    whatever the resolution of the modification times
+    """
+    cache_folder = str(tmp_path / "cache")
+    if aged:
+        age_folder(study / "user1" / "gps")
+    participant_manifest(str(study), "user1", cache_folder)
+    write_hour(study / "user1" / "gps", 3)
+    manifest = participant_manifest(str(study), "user1", cache_folder)
+    assert list(manifest["gps"]["stamps"]) == [
+        1614556800 + hour * 3600 for hour in range(4)
+    ]
+
+
+def test_participant_manifest_stale(study, tmp_path, manifests):
+    """Testing a saved manifest is not used once files were added or
+    removed, and a saved manifest which cannot be read is ignored
+    """
+    cache_folder = str(tmp_path / "cache")
+    gps = study / "user1" / "gps"
+    age_folder(gps)
+    participant_manifest(str(study), "user1", cache_folder)
+    manifests.clear()
+    (gps / "2021-03-01 01_00_00.csv").unlink()
+    write_hour(gps, 5)
+    manifest = participant_manifest(str(study), "user1", cache_folder)
+    expected = ["2021-03-01 00_00_00.csv", "2021-03-01 02_00_00.csv",
+                "2021-03-01 05_00_00.csv"]
+    assert list(manifest["gps"]["files"]) == expected
+    with open(manifest_path(cache_folder, "user1")) as f:
+        assert json.load(f)["streams"]["gps"]["files"] == expected
+
+    manifests.clear()
+    with open(manifest_path(cache_folder, "user1"), "w") as f:
+        f.write('{"version": 3, "streams": {"gps": ')
+    manifest = participant_manifest(str(study), "user1", cache_folder)
+    assert len(manifest["gps"]["files"]) == 3
+
+
+def test_participant_manifest_reused(study, tmp_path, manifests, mocker):
+    """Testing an unchanged stream is neither listed nor sorted again,
+    from memory or from the saved manifest, once its folder is old enough
+    to tell files were not added since
+    """
+    cache_folder = str(tmp_path / "cache")
+    manifest = participant_manifest(str(study), "user1", cache_folder)
+    assert manifest["gps"]["mtime_ns"] is None
+    assert participant_manifest(str(study), "user1", cache_folder) is manifest
+    age_folder(study / "user1" / "gps")
+    manifest = participant_manifest(str(study), "user1", cache_folder)
+    assert manifest["gps"]["mtime_ns"] is not None
+    listdir = mocker.spy(common_funcs.os, "listdir")
+    assert participant_manifest(str(study), "user1", cache_folder) is manifest
+    manifests.clear()
+    saved = participant_manifest(str(study), "user1", cache_folder)
+    assert listdir.call_count == 0
+    for key in ["files", "stamps", "mtime_ns"]:
+        assert np.array_equal(saved["gps"][key], manifest["gps"][key])
+
+
+def test_participant_manifest_memory_bounded(study, manifests, monkeypatch):
+    """Testing only the manifests used last are kept in memory"""
+    monkeypatch.setattr(common_funcs, "MANIFEST_CACHE_SIZE", 2)
+    for participant_id in ["user2", "user3"]:
+        gps = study / participant_id / "gps"
+        gps.mkdir(parents=True)
+        write_hour(gps, 0)
+    for participant_id in ["user1", "user2", "user3"]:
+        participant_manifest(str(study), participant_id, "")
+    assert list(manifests) == [f"{study}/user2", f"{study}/user3"]
+
+
+@pytest.fixture(params=["", "cache"])
+def read_gps(request, tmp_path):
+    """Reads the gps data of a study with 4 hours of 30 rows,
+    without and with the cache of parsed files
+    """
+    cache_folder = ""
+    if request.param:
+        pytest.importorskip("pyarrow")
+        cache_folder = str(tmp_path / "cache")
+    gps = tmp_path / "rows" / "user1" / "gps"
+    gps.mkdir(parents=True)
+    for hour in range(4):
+        write_hour(gps, hour, 30)
+
+    def read(**kwargs):
+        data, _, _ = read_data("user1", str(tmp_path / "rows"), "gps", "UTC",
+                               [2021, 3, 1, 0, 0, 10],
+                               [2021, 3, 1, 2, 0, 20],
+                               cache_folder=cache_folder, **kwargs)
+        return data
+    return read
+
+
+def test_read_data_columns(read_gps):
+    """Testing the columns read are those of the whole data, in order"""
+    data = read_gps()
+    columns = ["accuracy", "timestamp", "latitude"]
+    pd.testing.assert_frame_equal(read_gps(columns=columns), data[columns])
+
+
+@pytest.mark.parametrize("op", list(FILTER_OPERATORS))
+@pytest.mark.parametrize("columns", [None, ["timestamp", "latitude"]])
+def test_read_data_filters(read_gps, op, columns):
+    """Testing the rows read with a filter are those of the whole data
+    meeting it, also when its column is not read
+    """
+    data = read_gps()
+    expected = data[FILTER_OPERATORS[op](data["accuracy"], 20)]
+    expected = expected.reset_index(drop=True)
+    if columns is not None:
+        expected = expected[columns]
+    filtered = read_gps(columns=columns, filters=[("accuracy", op, 20)])
+    assert 0 < len(filtered) < len(data) or op in ["==", "!="]
+    pd.testing.assert_frame_equal(filtered, expected)
+
+
+@pytest.mark.parametrize("columns", [None, ["latitude"]])
+def test_read_data_trim_rows(read_gps, columns):
+    """Testing the rows kept with trim_rows are those of the whole data
+    within the time range
+    """
+    data = read_gps()
+    start = datetime2stamp([2021, 3, 1, 0, 0, 10], "UTC") * 1000
+    end = datetime2stamp([2021, 3, 1, 2, 0, 20], "UTC") * 1000
+    keep = (data["timestamp"] >= start) & (data["timestamp"] < end)
+    expected = data[keep].reset_index(drop=True)
+    if columns is not None:
+        expected = expected[columns]
+    trimmed = read_gps(columns=columns, trim_rows=True)
+    assert len(trimmed) == 50 and len(data) == 60
+    pd.testing.assert_frame_equal(trimmed, expected)
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"filters": [("accuracy", "~", 20)]}, "Invalid filter"),
+    ({"filters": [("accuracy", "<")]}, "Invalid filter"),
+    ({"filters": [("speed", "<", 20)]}, "Unknown columns in the filters"),
+    ({"columns": ["timestamp", "speed"]}, "Unknown columns speed"),
+])
+def test_read_data_rejects_unknown(read_gps, kwargs, message):
+    """Testing unknown operators and columns are reported"""
+    with pytest.raises(ValueError, match=message):
+        read_gps(**kwargs)
+
+
+def pytz_datetime2stamp(time_list, tz_str):
+    """datetime2stamp() as computed by pytz, is_dst=False by default"""
+    local = pytz.timezone(tz_str).localize(datetime.datetime(*time_list))
+    return calendar.timegm(local.astimezone(pytz.utc).timetuple())
+
+
+def pytz_stamp2datetime(stamp, tz_str):
+    """stamp2datetime() as computed by pytz"""
+    utc = pytz.utc.localize(datetime.datetime.utcfromtimestamp(stamp))
+    local = utc.astimezone(pytz.timezone(tz_str))
+    return [local.year, local.month, local.day,
+            local.hour, local.minute, local.second]
+
+
+@pytest.mark.parametrize("time_list, tz_str, expected", [
+    # skipped at the start of daylight saving time, offset from before
+    ([2021, 3, 14, 2, 30, 0], "America/New_York", "2021-03-14 07:30:00"),
+    ([2021, 3, 28, 1, 30, 0], "Europe/London", "2021-03-28 01:30:00"),
+    ([2021, 10, 3, 2, 30, 0], "Australia/Sydney", "2021-10-02 16:30:00"),
+    # repeated at the end of daylight saving time, standard time
+    ([2021, 11, 7, 1, 30, 0], "America/New_York", "2021-11-07 06:30:00"),
+    ([2021, 10, 31, 1, 30, 0], "Europe/London", "2021-10-31 01:30:00"),
+    ([2021, 4, 4, 2, 30, 0], "Australia/Sydney", "2021-04-03 16:30:00"),
+    # day skipped when Samoa changed of side of the date line
+    ([2011, 12, 30, 12, 0, 0], "Pacific/Apia", "2011-12-30 22:00:00"),
+    # fixed offsets, whose sign is inverted in the Etc names
+    ([2021, 7, 1, 12, 0, 0], "Etc/GMT-1", "2021-07-01 11:00:00"),
+    ([2021, 7, 1, 12, 0, 0], "Etc/GMT+5", "2021-07-01 17:00:00"),
+    ([2021, 7, 1, 12, 0, 0], "UTC", "2021-07-01 12:00:00"),
+])
+def test_datetime2stamp_special_times(time_list, tz_str, expected):
+    """Testing times which do not exist or exist twice locally are
+    converted as pytz localize() does
+    """
+    stamp = datetime2stamp(time_list, tz_str)
+    assert stamp == pytz_datetime2stamp(time_list, tz_str)
+    assert stamp == calendar.timegm(
+        datetime.datetime.fromisoformat(expected).timetuple()
+    )
+    assert datetimes2stamps([time_list], tz_str).tolist() == [stamp]
+
+
+@pytest.mark.parametrize("tz_str, day", [
+    ("America/New_York", (2021, 3, 14)),
+    ("America/New_York", (2021, 11, 7)),
+    ("Europe/London", (2021, 3, 28)),
+    ("Europe/London", (2021, 10, 31)),
+    ("Australia/Sydney", (2021, 4, 4)),
+    ("Australia/Sydney", (2021, 10, 3)),
+    # daylight saving time of 30 minutes
+    ("Australia/Lord_Howe", (2021, 4, 4)),
+    ("Australia/Lord_Howe", (2021, 10, 3)),
+    # transitions at midnight
+    ("America/Sao_Paulo", (2018, 11, 4)),
+    ("America/Sao_Paulo", (2019, 2, 17)),
+    ("Pacific/Apia", (2011, 12, 30)),
+    ("Etc/GMT-1", (2021, 3, 28)),
+    ("UTC", (2021, 3, 28)),
+])
+def test_conversions_around_transitions(tz_str, day):
+    """Testing every quarter of an hour of the two days around a change of
+    offset is converted as pytz does, by the scalar and array functions
+    """
+    start = datetime.datetime(*day) - datetime.timedelta(days=1)
+    time_lists = [
+        list((start + datetime.timedelta(minutes=15 * i)).timetuple()[:6])
+        for i in range(2 * 96)
+    ]
+    stamps = [pytz_datetime2stamp(time_list, tz_str)
+              for time_list in time_lists]
+    assert [datetime2stamp(time_list, tz_str)
+            for time_list in time_lists] == stamps
+    assert datetimes2stamps(time_lists, tz_str).tolist() == stamps
+
+    utc_stamps = calendar.timegm(start.timetuple()) + 900 * np.arange(192)
+    expected = [pytz_stamp2datetime(int(stamp), tz_str)
+                for stamp in utc_stamps]
+    assert [stamp2datetime(int(stamp), tz_str)
+            for stamp in utc_stamps] == expected
+    assert stamps2datetimes(utc_stamps, tz_str).tolist() == expected
+
+
+def test_datetimes2stamps_rejects_invalid_dates():
+    """Testing dates which do not exist are rejected"""
+    with pytest.raises(ValueError):
+        datetimes2stamps([[2021, 2, 29, 0, 0, 0]], "UTC")
@@ -0,0 +1,82 @@
+"""Tests for the data processing tools of poplar"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forest.poplar.functions.helpers import get_window_offsets, get_windows
+
+# 2021-03-01 00:00:00 UTC in milliseconds
+START = 1614556800000
+MINUTE = 60000
+HOUR = 60 * MINUTE
+
+
+def loop_get_windows(df, start, end, window_length_ms):
+    """get_windows() as it was before the windows were assigned at once,
+    one row at a time
+    """
+    if (end - start) % window_length_ms != 0:
+        return None
+    try:
+        windows = OrderedDict.fromkeys(np.arange(start, end,
+                                                 window_length_ms))
+        for i in range(len(df)):
+            key = df.timestamp[i] - (df.timestamp[i] % window_length_ms)
+            if windows[key] is None:
+                windows[key] = [i]
+            else:
+                windows[key].append(i)
+        return windows
+    except Exception:
+        return None
+
+
+def random_stamps(size, seed=0):
+    """Unsorted timestamps within the hour after START, some of them
+    equal, leaving some minutes without data
+    """
+    rng = np.random.default_rng(seed)
+    minutes = rng.choice(np.arange(0, 60, 3), size)
+    return START + minutes * MINUTE + rng.integers(0, 3, size) * 20000
+
+
+@pytest.mark.parametrize("stamps, start, end, window", [
+    (random_stamps(500), START, START + HOUR, MINUTE),
+    (random_stamps(500, 1), START, START + HOUR, 5 * MINUTE),
+    (random_stamps(500, 2), START, START + HOUR, 1000),
+    (random_stamps(50), START - HOUR, START + 2 * HOUR, MINUTE),
+    (np.array([START + 59999]), START, START + HOUR, MINUTE),
+    (np.array([START + HOUR - 1]), START, START + HOUR, MINUTE),
+    (np.array([], dtype=np.int64), START, START + HOUR, MINUTE),
+    (np.array([START - 1, START]), START, START + HOUR, MINUTE),
+    (np.array([START, START + HOUR]), START, START + HOUR, MINUTE),
+    (random_stamps(10), START + 1000, START + HOUR + 1000, MINUTE),
+    (random_stamps(10), START, START + HOUR, 7 * MINUTE),
+    (random_stamps(10).astype(float), START, START + HOUR, MINUTE),
+])
+def test_get_windows_same_as_loop(stamps, start, end, window):
+    """Testing the windows are those found one row at a time, including
+    empty windows, a single row and rows outside of the time period
+    """
+    df = pd.DataFrame({"timestamp": stamps, "x": np.arange(len(stamps))})
+    windows = get_windows(df, start, end, window)
+    expected = loop_get_windows(df, start, end, window)
+    if expected is None:
+        assert windows is None
+    else:
+        assert list(windows.items()) == list(expected.items())
+
+
+def test_get_window_offsets():
+    """Testing the rows of each window keep their order"""
+    stamps = START + np.array([70, 10, 130, 20, 75]) * 1000
+    order, offsets = get_window_offsets(stamps, START, START + 3 * MINUTE,
+                                        MINUTE)
+    assert order.tolist() == [1, 3, 0, 4, 2]
+    assert offsets.tolist() == [0, 2, 4, 5]
+    with pytest.raises(ValueError):
+        get_window_offsets(stamps, START + MINUTE, START + 3 * MINUTE,
+                           MINUTE)
@@ -0,0 +1,142 @@
+"""Tests for the input/output functions of poplar"""
+
+import gc
+import gzip
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from forest.poplar.functions.io import CSVWriter, setup_csv, write_to_csv
+
+HEADER = ["timestamp", "x", "note"]
+LINES = [
+    [1614556800000, 0.5, "a"],
+    [1614556801000, None, ""],
+    [1614556802000, float("nan"), "nan"],
+    [1614556803000, np.nan, np.float64(1.25)],
+    [1614556804000, np.int64(-3), "b c"],
+] * 700
+
+
+def unbuffered_setup_csv(name, dirpath, header):
+    """setup_csv() as it was before CSVWriter, writing the header"""
+    filepath = os.path.join(dirpath, name + ".csv")
+    with open(filepath, "w") as f:
+        f.write(",".join(header) + "\n")
+    return filepath
+
+
+def unbuffered_write_to_csv(filepath, line, missing_strings=("nan",)):
+    """write_to_csv() as it was before CSVWriter, opening the file for
+    each line
+    """
+    line = ["" if i is None else i for i in line]
+    line = [str(i) for i in line]
+    line = ["" if i in missing_strings else i for i in line]
+    with open(filepath, "a") as f:
+        f.write(",".join(line) + "\n")
+
+
+@pytest.fixture()
+def expected(tmp_path):
+    """Content of the csv file written one line at a time"""
+    filepath = unbuffered_setup_csv("expected", str(tmp_path), HEADER)
+    for line in LINES:
+        unbuffered_write_to_csv(filepath, line)
+    with open(filepath, "rb") as f:
+        return f.read()
+
+
+def read_bytes(filepath):
+    """Reads a csv file, compressed with gzip or not"""
+    opener = gzip.open if filepath.endswith(".gz") else open
+    with opener(filepath, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", ["out.csv", "out.csv.gz"])
+@pytest.mark.parametrize("flush_size", [1, 1000, 10000])
+def test_csv_writer_same_as_unbuffered(tmp_path, expected, name,
+                                       flush_size):
+    """Testing the file is the one written line by line, with a single
+    header, whatever the lines waiting
+    """
+    filepath = str(tmp_path / name)
+    with CSVWriter(filepath, HEADER, flush_size) as writer:
+        for line in LINES:
+            writer.write(line)
+    assert read_bytes(filepath) == expected
+    assert read_bytes(filepath).count(b"timestamp") == 1
+
+
+def test_setup_csv_same_as_unbuffered(tmp_path, expected):
+    """Testing setup_csv() and write_to_csv() write the same file as
+    before
+    """
+    filepath = setup_csv("out", str(tmp_path), HEADER)
+    assert read_bytes(filepath) == b"timestamp,x,note\n"
+    for line in LINES:
+        write_to_csv(filepath, line)
+    assert read_bytes(filepath) == expected
+
+
+def test_csv_writer_appends_without_header(tmp_path, expected):
+    """Testing a writer without header appends to the file"""
+    filepath = setup_csv("out", str(tmp_path), HEADER)
+    with CSVWriter(filepath) as writer:
+        for line in LINES[:1000]:
+            writer.write(line)
+    with CSVWriter(filepath, flush_size=7) as writer:
+        for line in LINES[1000:]:
+            writer.write(line)
+    assert read_bytes(filepath) == expected
+
+
+def test_csv_writer_flushes_on_close_and_exit(tmp_path):
+    """Testing the waiting lines are written by close() and when leaving
+    the context, also after an error
+    """
+    closed = str(tmp_path / "closed.csv")
+    writer = CSVWriter(closed, HEADER)
+    writer.write(LINES[0])
+    assert read_bytes(closed) == b""
+    writer.close()
+    writer.close()
+    assert read_bytes(closed) == b"timestamp,x,note\n1614556800000,0.5,a\n"
+
+    exited = str(tmp_path / "exited.csv")
+    with pytest.raises(ValueError):
+        with CSVWriter(exited, HEADER) as writer:
+            writer.write(LINES[0])
+            raise ValueError("stopped")
+    assert read_bytes(exited) == read_bytes(closed)
+
+
+def test_csv_writer_never_closed(tmp_path):
+    """Testing the lines of a writer never closed are written when it is
+    garbage collected
+    """
+    filepath = str(tmp_path / "out.csv.gz")
+    writer = CSVWriter(filepath, HEADER)
+    writer.write(LINES[0])
+    del writer
+    gc.collect()
+    assert read_bytes(filepath) == b"timestamp,x,note\n1614556800000,0.5,a\n"
+
+
+def test_csv_writer_never_closed_at_exit(tmp_path):
+    """Testing the lines of a writer never closed are written when the
+    interpreter exits
+    """
+    filepath = str(tmp_path / "out.csv")
+    code = (
+        "import sys\n"
+        "from forest.poplar.functions.io import CSVWriter\n"
+        "writer = CSVWriter(sys.argv[1], ['timestamp'])\n"
+        "writer.write([1614556800000])\n"
+    )
+    subprocess.run([sys.executable, "-c", code, filepath], check=True)
+    assert read_bytes(filepath) == b"timestamp\n1614556800000\n"
@@ -0,0 +1,111 @@
+"""Tests for the cache of parsed raw files of poplar"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from forest.poplar.legacy import raw_cache
+from forest.poplar.legacy.common_funcs import read_data
+
+
+HEADER = "timestamp,UTC time,latitude,longitude,altitude,accuracy\n"
+# 2021-03-01 00:00:00 UTC
+START = 1614556800
+
+
+def write_hour(folder, hour, accuracy=5):
+    """Writes a gps file of an hour since START with three rows"""
+    stamp = START + hour * 3600
+    name = pd.Timestamp(stamp, unit="s").strftime("%Y-%m-%d %H_00_00.csv")
+    lines = [
+        f"{(stamp + i) * 1000},{name[:10]}T00:00:0{i}.000,51.45,-2.59,10,"
+        f"{accuracy + i}\n"
+        for i in range(3)
+    ]
+    path = folder / name
+    path.write_text(HEADER + "".join(lines))
+    return path
+
+
+@pytest.fixture()
+def study(tmp_path):
+    """Study folder with 2 hours of gps data on each of 2 days"""
+    gps = tmp_path / "study" / "user1" / "gps"
+    gps.mkdir(parents=True)
+    for hour in [0, 1, 24, 25]:
+        write_hour(gps, hour)
+    return tmp_path / "study"
+
+
+def read_gps(study, cache_folder):
+    """Reads all the gps data of the participant"""
+    data, _, _ = read_data("user1", str(study), "gps", "UTC", None, None,
+                           cache_folder=cache_folder)
+    return data
+
+
+def test_cache_same_as_csv(study, tmp_path, mocker):
+    """Testing the data read through the cache are those of the csv files,
+    parsed once and memory-mapped by the next reads
+    """
+    pytest.importorskip("pyarrow")
+    cache_folder = str(tmp_path / "cache")
+    expected = read_gps(study, "")
+    parse = mocker.spy(raw_cache, "map_files")
+    pd.testing.assert_frame_equal(read_gps(study, cache_folder), expected)
+    assert parse.call_count == 2
+    assert sorted(os.listdir(f"{cache_folder}/user1/gps")) == [
+        "2021-03-01.arrow", "2021-03-02.arrow"
+    ]
+    pd.testing.assert_frame_equal(read_gps(study, cache_folder), expected)
+    assert parse.call_count == 2
+
+
+@pytest.mark.parametrize("same_size", [False, True])
+def test_cache_rewritten_file(study, tmp_path, same_size):
+    """Testing a file rewritten in place is parsed again, whether its size
+    or only its modification time changed
+    """
+    pytest.importorskip("pyarrow")
+    cache_folder = str(tmp_path / "cache")
+    read_gps(study, cache_folder)
+    path = write_hour(study / "user1" / "gps", 1, 6 if same_size else 10)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    data = read_gps(study, cache_folder)
+    pd.testing.assert_frame_equal(data, read_gps(study, ""))
+    assert data["accuracy"].iloc[3] == (6 if same_size else 10)
+
+
+@pytest.mark.parametrize("size", [0, 100, None])
+def test_cache_corrupt_file(study, tmp_path, size):
+    """Testing a cache file which is empty, partial or not an Arrow file
+    is parsed again and replaced
+    """
+    pytest.importorskip("pyarrow")
+    cache_folder = str(tmp_path / "cache")
+    read_gps(study, cache_folder)
+    path = f"{cache_folder}/user1/gps/2021-03-01.arrow"
+    with open(path, "rb") as f:
+        content = f.read()
+    with open(path, "wb") as f:
+        f.write(b"not an arrow file" if size is None else content[:size])
+    pd.testing.assert_frame_equal(read_gps(study, cache_folder),
+                                  read_gps(study, ""))
+    key = raw_cache.day_cache_key(
+        str(study / "user1" / "gps"),
+        ["2021-03-01 00_00_00.csv", "2021-03-01 01_00_00.csv"],
+    )
+    assert raw_cache.load_day(path, key) is not None
+
+
+def test_cache_without_pyarrow(study, tmp_path, monkeypatch):
+    """Testing the cache asks for pyarrow when it is not installed,
+    while the data are still read without cache
+    """
+    monkeypatch.setattr(raw_cache, "pa", None)
+    with pytest.raises(ImportError, match="forest\\[parquet\\]"):
+        read_gps(study, str(tmp_path / "cache"))
+    assert not (tmp_path / "cache" / "user1" / "gps").exists()
+    assert len(read_gps(study, "")) > 0
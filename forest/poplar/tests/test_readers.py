@@ -0,0 +1,184 @@
+"""Tests for the readers of raw Beiwe data streams of poplar"""
+
+import itertools
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forest.poplar.raw.readers import iter_stream, read_ahead
+
+# 2021-03-01 00:00:00 UTC in milliseconds
+START = 1614556800000
+HOUR = 3600000
+
+
+def write_file(folder, hour, stamps):
+    """Writes the accelerometer file of an hour since START with rows
+    at the given timestamps, in this order
+    """
+    stamps = np.asarray(stamps, dtype=np.int64)
+    data = pd.DataFrame({
+        "timestamp": stamps,
+        "UTC time": pd.to_datetime(stamps, unit="ms").strftime(
+            "%Y-%m-%dT%H:%M:%S.%f"
+        ),
+        "accuracy": "unknown",
+        "x": stamps % 1000 / 100,
+        "y": stamps % 7,
+        "z": -1.0,
+    })
+    name = pd.Timestamp(START + hour * HOUR, unit="ms").strftime(
+        "%Y-%m-%d %H_00_00.csv"
+    )
+    data.to_csv(folder / name, index=False)
+    return data
+
+
+@pytest.fixture()
+def stream(tmp_path):
+    """Study folder with 3 hours of accelerometer data, whose files overlap
+    and are not sorted, and all their rows sorted by timestamp
+    """
+    folder = tmp_path / "study" / "user1" / "accelerometer"
+    folder.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    frames = []
+    for hour in range(3):
+        # rows of the last and next minutes are in the files around
+        stamps = np.arange(START + hour * HOUR - 40000,
+                           START + (hour + 1) * HOUR + 40000, 1370)
+        stamps = stamps[stamps >= START]
+        frames.append(write_file(folder, hour, rng.permutation(stamps)))
+    data = pd.concat(frames).drop_duplicates("timestamp")
+    return tmp_path / "study", data.sort_values("timestamp")
+
+
+def read_windows(study, window=60, **kwargs):
+    """Reads the windows of the stream as a list"""
+    return list(iter_stream("user1", str(study), "accelerometer", window,
+                            **kwargs))
+
+
+def as_frame(chunks):
+    """Stacks the data of the windows"""
+    return pd.concat([pd.DataFrame(data) for _, data in chunks],
+                     ignore_index=True)
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_iter_stream_windows(stream, prefetch):
+    """Testing each window is yielded once with all its rows sorted,
+    also when the files overlap
+    """
+    study, data = stream
+    chunks = read_windows(study, prefetch=prefetch)
+    starts = [start for start, _ in chunks]
+    assert starts == sorted(set(data["timestamp"] // 60000 * 60000))
+    for start, chunk in chunks:
+        assert (chunk["timestamp"] // 60000 * 60000 == start).all()
+    # the rows in two files are yielded twice, next to each other
+    pd.testing.assert_frame_equal(
+        as_frame(chunks).drop_duplicates("timestamp"),
+        data.reset_index(drop=True)
+    )
+
+
+def test_iter_stream_columns_without_timestamp(stream):
+    """Testing the windows have the columns asked for, in order,
+    when the timestamps are not among them
+    """
+    study, _ = stream
+    chunks = read_windows(study, columns=["y", "x"])
+    assert all(list(chunk) == ["y", "x"] for _, chunk in chunks)
+    expected = as_frame(read_windows(study))[["y", "x"]]
+    pd.testing.assert_frame_equal(as_frame(chunks), expected)
+
+
+def test_iter_stream_time_range(stream):
+    """Testing only the rows of the time range are read"""
+    study, data = stream
+    chunks = read_windows(study, 300, time_start=[2021, 3, 1, 0, 30, 0],
+                          time_end=[2021, 3, 1, 1, 10, 0])
+    keep = ((data["timestamp"] >= START + HOUR // 2)
+            & (data["timestamp"] < START + HOUR + 600000))
+    assert [start for start, _ in chunks] == [
+        START + HOUR // 2 + i * 300000 for i in range(8)
+    ]
+    pd.testing.assert_frame_equal(
+        as_frame(chunks).drop_duplicates("timestamp"),
+        data[keep].reset_index(drop=True)
+    )
+
+
+def test_iter_stream_skips_late_rows(tmp_path, caplog):
+    """Testing rows older than the windows already yielded are skipped
+    with a warning instead of yielding a window twice
+    """
+    folder = tmp_path / "study" / "user1" / "accelerometer"
+    folder.mkdir(parents=True)
+    write_file(folder, 0, [START, START + 1000])
+    write_file(folder, 1, [START + HOUR, START + HOUR + 1000])
+    write_file(folder, 2, [START + 2000, START + 2 * HOUR])
+    with caplog.at_level(logging.WARNING):
+        chunks = read_windows(tmp_path / "study")
+    assert [start for start, _ in chunks] == [START, START + HOUR,
+                                              START + 2 * HOUR]
+    assert list(chunks[0][1]["timestamp"]) == [START, START + 1000]
+    assert "skipping 1 accelerometer rows" in caplog.text
+
+
+def test_read_ahead_order_and_errors():
+    """Testing the items are yielded in order, then the error raised
+    while reading them
+    """
+    def items():
+        yield from range(5)
+        raise ValueError("unreadable file")
+
+    read = []
+    with pytest.raises(ValueError, match="unreadable file"):
+        for item in read_ahead(items(), 2):
+            read.append(item)
+    assert read == list(range(5))
+
+
+def test_read_ahead_stops_when_abandoned():
+    """Testing the thread reading ahead stops, with a bounded number of
+    items read, when the consumer stops early
+    """
+    threads = threading.active_count()
+    produced = []
+
+    def items():
+        for i in itertools.count():
+            produced.append(i)
+            yield i
+
+    ahead = read_ahead(items(), 3)
+    assert [next(ahead), next(ahead)] == [0, 1]
+    time.sleep(0.1)
+    assert threading.active_count() == threads + 1
+    # the 2 items consumed, 3 queued and 1 waiting for room
+    assert len(produced) <= 6
+    ahead.close()
+    assert threading.active_count() == threads
+    count = len(produced)
+    time.sleep(0.2)
+    assert len(produced) == count
+
+
+def test_iter_stream_stops_reading_when_abandoned(stream):
+    """Testing no thread is left reading files when the windows of a
+    stream are not all read
+    """
+    study, _ = stream
+    threads = threading.active_count()
+    chunks = iter_stream("user1", str(study), "accelerometer", 60)
+    next(chunks)
+    assert threading.active_count() == threads + 1
+    chunks.close()
+    assert threading.active_count() == threads
@@ -9,6 +9,8 @@ import numpy as np
 import pandas as pd
 import pytz
 
+from forest.poplar.functions.io import read_csv_files
+
 # Explore use of logging function (TO DO: Read wiki)
 logger = logging.getLogger(__name__)
 
@@ -93,8 +95,8 @@ def read_and_aggregate(study_dir, beiwe_id, data_stream):
         all_files = glob.glob(os.path.join(st_path, '*/*.csv'))
         # Sort file paths for when they're read in
         all_files = sorted(all_files)
-        # Read in all files
-        survey_data = [pd.read_csv(file) for file in all_files]
+        # Read in all files, several at a time
+        survey_data = list(read_csv_files(all_files))
         survey_data = pd.concat(survey_data, axis=0, ignore_index=False)
         survey_data['beiwe_id'] = beiwe_id
         survey_data['UTC time'] = survey_data['UTC time'].astype('datetime64[ns]')
@@ -3,7 +3,8 @@ import sys
 import pandas as pd
 import numpy as np
 from ..poplar.legacy.common_funcs import (read_data, write_all_summaries,
-                                          datetime2stamp, stamp2datetime)
+                                          datetime2stamp, stamp2datetime,
+                                          stamps2datetimes)
 
 def comm_logs_summaries(ID:str, df_text, df_call, stamp_start, stamp_end, tz_str, option):
     """
@@ -28,8 +29,8 @@ def comm_logs_summaries(ID:str, df_text, df_call, stamp_start, stamp_end, tz_str
         step_size = 3600*24
     
     ## for each chunk, calculate the summary statistics (colmean or count)
-    for stamp in np.arange(table_start,table_end+1,step=step_size):
-        (year, month, day, hour, minute, second) = stamp2datetime(stamp,tz_str)
+    stamps = np.arange(table_start,table_end+1,step=step_size)
+    for stamp, (year, month, day, hour, minute, second) in zip(stamps, stamps2datetimes(stamps,tz_str).tolist()):
         if df_text.shape[0] > 0:
             temp_text = df_text[(df_text["timestamp"]/1000>=stamp)&(df_text["timestamp"]/1000<stamp+step_size)]
             m_len = np.array(temp_text['message length'])
@@ -11,11 +11,15 @@ requires = [
     'ratelimit',
     'requests',  # bonsai
     'scipy',
-    'shapely',  # jasmine
+    'shapely>=2.0',  # jasmine
     'timezonefinder',  # poplar, bonsai
     'wheel'  # for ratelimit
 ]
 
+extras_require = {
+    'parquet': ['pyarrow'],  # jasmine, poplar
+}
+
 package_data = {'': ['*.csv', '*.json']}
 
 with open('README.md') as f:
@@ -34,5 +38,6 @@ setup(
     license=license,
     packages=find_packages(include=["forest*"]),
     package_data=package_data,
-    install_requires=requires
+    install_requires=requires,
+    extras_require=extras_require
 )
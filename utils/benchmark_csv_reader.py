@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Benchmark reading many small hourly csv files one by one and with a
+thread pool, optionally with a simulated latency per file as on network
+file systems
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from forest.poplar.functions.io import map_files
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--files", type=int, default=2000,
+                    help="number of hourly files")
+parser.add_argument("--rows", type=int, default=600,
+                    help="number of rows of each file")
+parser.add_argument("--threads", type=str, default="1,4,8,16",
+                    help="comma separated numbers of threads")
+parser.add_argument("--latency", type=float, default=0,
+                    help="simulated latency of opening a file in seconds")
+
+
+def write_files(folder: str, n_files: int, n_rows: int) -> list:
+    """Writes n_files hourly GPS files of n_rows rows each."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for hour in range(n_files):
+        timestamp = (1614556800 + hour * 3600) * 1000 + np.arange(n_rows)
+        data = pd.DataFrame({
+            "timestamp": timestamp,
+            "UTC time": pd.to_datetime(timestamp, unit="ms").strftime(
+                "%Y-%m-%dT%H:%M:%S.%f"
+            ),
+            "latitude": 51.45 + rng.normal(0, 0.01, n_rows),
+            "longitude": -2.58 + rng.normal(0, 0.01, n_rows),
+            "altitude": rng.normal(50, 5, n_rows),
+            "accuracy": rng.uniform(5, 30, n_rows),
+        })
+        path = f"{folder}/{hour:06d}.csv"
+        data.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def main() -> int:
+    args = parser.parse_args()
+
+    def read(path: str) -> pd.DataFrame:
+        if args.latency > 0:
+            time.sleep(args.latency)
+        return pd.read_csv(path)
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_files(folder, args.files, args.rows)
+        sys.stdout.write(
+            f"{args.files} files of {args.rows} rows, "
+            f"{os.cpu_count()} CPUs, latency {args.latency} s\n"
+        )
+        reference = None
+        for n_threads in map(int, args.threads.split(",")):
+            start = time.perf_counter()
+            data = pd.concat(
+                map_files(read, paths, n_threads), ignore_index=True
+            )
+            elapsed = time.perf_counter() - start
+            if reference is None:
+                reference = data
+            elif not data.equals(reference):
+                raise RuntimeError(f"Different data with {n_threads} threads")
+            sys.stdout.write(
+                f"{n_threads:>3} threads {elapsed:>8.2f} s "
+                f"{args.files / elapsed:>8.0f} files/s\n"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""Benchmark each stage of Jasmine on synthetic GPS data of several scales,
+print the throughput and peak memory of the stages, and flag regressions
+against a baseline file
+
+Times depend on the machine, so the baseline should be saved with
+--save-baseline on the machine comparing commits, e.g. at the base commit
+of a change. Run from a checkout as python utils/benchmark_jasmine.py,
+without installing forest.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# the forest package of the checkout, also in the worker processes
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_FOLDER not in sys.path:
+    sys.path.insert(0, REPO_FOLDER)
+
+from forest.bonsai.simulate_gps_data import (  # noqa: E402
+    sim_synthetic_gps_data
+)
+from forest.jasmine.instrument import Instrumentation  # noqa: E402
+from forest.jasmine.traj2stats import (  # noqa: E402
+    Frequency, Hyperparameters, impute_participant, summarize_participant
+)
+
+SCALES = {"day": 1, "week": 7, "month": 30, "year": 365}
+START_DATE = datetime.date(2021, 3, 1)
+TZ_STR = "Europe/London"
+PARTICIPANT_ID = "user_1"
+# stages faster than this in the baseline are too noisy to compare
+MIN_WALL_TIME = 0.1
+# peaks of memory smaller than this in the baseline are too noisy
+MIN_MEMORY_MB = 10
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--scales", type=str, default="day",
+                    help="comma separated scales among "
+                    + ", ".join(SCALES))
+parser.add_argument("--cycles", type=str, default="10:0.5",
+                    help="comma separated on/off cycles as "
+                    "cycle_in_minutes:missing_rate")
+parser.add_argument("--seed", type=int, default=0,
+                    help="seed of the synthetic data and of the imputation")
+parser.add_argument("--output", type=str, default=None,
+                    help="path of a json file to save the results")
+parser.add_argument("--baseline", type=str, default=None,
+                    help="path of a json file with the results to compare")
+parser.add_argument("--save-baseline", action="store_true",
+                    help="save the results as the baseline instead")
+parser.add_argument("--tolerance", type=float, default=0.25,
+                    help="relative slowdown or memory increase flagged")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="number of runs of each case, the fastest time and "
+                    "the smallest memory of each stage are kept")
+
+
+def write_study(data: pd.DataFrame, folder: str) -> None:
+    """Writes the data as hourly csv files named by their UTC hour."""
+    gps_folder = f"{folder}/{PARTICIPANT_ID}/gps"
+    os.makedirs(gps_folder, exist_ok=True)
+    data = data.drop(columns="user")
+    hours = (data["UTC time"] // 3600000).astype(np.int64)
+    for hour, hourly in data.groupby(hours):
+        filename = datetime.datetime.utcfromtimestamp(
+            hour * 3600
+        ).strftime("%Y-%m-%d %H_00_00.csv")
+        hourly.to_csv(f"{gps_folder}/{filename}", index=False)
+
+
+def run_case(days: int, cycle: int, percentage: float, seed: int) -> dict:
+    """Runs every stage of Jasmine on one participant.
+
+    Returns:
+        dict, with the rows per second, wall time and peak memory
+            above the memory at its start of each stage
+    """
+    # only the results are printed
+    warnings.simplefilter("ignore")
+    with tempfile.TemporaryDirectory() as folder, \
+            open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        data = sim_synthetic_gps_data(
+            1, START_DATE, START_DATE + datetime.timedelta(days=days),
+            cycle, percentage, tz_str=TZ_STR, seed=seed,
+        )
+        write_study(data, f"{folder}/study")
+        os.makedirs(f"{folder}/output", exist_ok=True)
+        instrumentation = Instrumentation(f"{folder}/stages.jsonl")
+        # the imputation is random
+        np.random.seed(seed)
+        imputed = impute_participant(
+            PARTICIPANT_ID, f"{folder}/study", f"{folder}/output", TZ_STR,
+            False, Hyperparameters(), None, None, None, None, 0,
+            instrumentation,
+        )
+        if imputed is None:
+            raise RuntimeError("No data to benchmark")
+        summarize_participant(
+            PARTICIPANT_ID, imputed[0], f"{folder}/output", TZ_STR,
+            Frequency.DAILY, None, False, None, False, 2, 7.5, None,
+            instrumentation,
+        )
+        with open(f"{folder}/stages.jsonl", encoding="utf-8") as report:
+            records = [json.loads(line) for line in report]
+
+    results = {}
+    for record in records:
+        rows = record["rows_in"] or record["rows_out"] or 0
+        results[record["stage"]] = {
+            "rows": rows,
+            "rows_per_s": rows / max(record["wall_time"], 1e-9),
+            "wall_time": record["wall_time"],
+            "peak_memory_mb": record["peak_memory_mb"],
+        }
+    return results
+
+
+def best_of(runs: list) -> dict:
+    """Keeps the fastest time and the smallest memory of each stage
+    among several runs of a case, the least disturbed by other processes.
+    """
+    results = {}
+    for stage, metrics in runs[0].items():
+        stage_runs = [run[stage] for run in runs]
+        fastest = min(stage_runs, key=lambda metrics: metrics["wall_time"])
+        memories = [metrics["peak_memory_mb"] for metrics in stage_runs
+                    if metrics["peak_memory_mb"] is not None]
+        results[stage] = dict(
+            fastest, peak_memory_mb=min(memories) if memories else None
+        )
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Lists the stages slower or using more memory than the baseline,
+    ignoring the stages too fast or using too little memory to compare.
+    """
+    regressions = []
+    for case, stages in results.items():
+        for stage, metrics in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if base is None:
+                continue
+            if (
+                base["wall_time"] >= MIN_WALL_TIME
+                and metrics["rows_per_s"]
+                < base["rows_per_s"] * (1 - tolerance)
+            ):
+                regressions.append(
+                    f"{case} {stage}: {metrics['rows_per_s']:.0f} rows/s, "
+                    f"baseline {base['rows_per_s']:.0f} rows/s"
+                )
+            if (
+                metrics["peak_memory_mb"] is not None
+                and base.get("peak_memory_mb") is not None
+                and base["peak_memory_mb"] >= MIN_MEMORY_MB
+                and metrics["peak_memory_mb"]
+                > base["peak_memory_mb"] * (1 + tolerance)
+            ):
+                regressions.append(
+                    f"{case} {stage}: {metrics['peak_memory_mb']:.0f} MB, "
+                    f"baseline {base['peak_memory_mb']:.0f} MB"
+                )
+    return regressions
+
+
+def main() -> int:
+    args = parser.parse_args()
+    results = {}
+    # a new process for each run so that runs do not share memory
+    context = multiprocessing.get_context("spawn")
+    for scale in args.scales.split(","):
+        for cycle_str in args.cycles.split(","):
+            cycle, percentage = cycle_str.split(":")
+            case = f"{scale}_{cycle}_{percentage}"
+            runs = []
+            for _ in range(max(1, args.repeat)):
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    runs.append(executor.submit(
+                        run_case, SCALES[scale], int(cycle),
+                        float(percentage), args.seed,
+                    ).result())
+            results[case] = best_of(runs)
+            for stage, metrics in results[case].items():
+                peak = metrics["peak_memory_mb"]
+                sys.stdout.write(
+                    f"{case:<20} {stage:<15} {metrics['rows']:>10} rows "
+                    f"{metrics['rows_per_s']:>12.0f} rows/s "
+                    f"{metrics['wall_time']:>9.2f} s "
+                    f"{'?' if peak is None else f'{peak:.0f}':>6} MB\n"
+                )
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline is None:
+        return 0
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=4)
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        sys.stdout.write(f"REGRESSION {regression}\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())